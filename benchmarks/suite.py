@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+import argparse
+import base64
+import itertools
+import json
+import logging
+import os
+import pathlib
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+import nbformat
+from nbclient import NotebookClient
+
+from firenze.notebook import Notebook
+from firenze.sources import SourceCache
+
+BASELINE_PATH = pathlib.Path(__file__).parent / "baseline.json"
+
+CASES = {
+    "cells": [10, 100, 300],
+    "source_lines": [20],
+    "output_bytes": [0, 20_000],
+    "parameters": [0, 50],
+}
+# a subset of the full cases, so it can be compared with the same baseline
+QUICK_CASES = {
+    "cells": [10, 100],
+    "source_lines": [20],
+    "output_bytes": [0],
+    "parameters": [0, 50],
+}
+
+
+class StubClient(NotebookClient):
+    def async_setup_kernel(self):
+        class StubContext:
+            async def __aenter__(self):
+                pass
+
+            async def __aexit__(self, exc_type, exc_value, traceback):
+                pass
+
+        return StubContext()
+
+    async def async_execute_cell(self, cell, index, **kwargs):
+        cell["outputs"] = cell["metadata"].get("stub_outputs", [])
+
+
+def make_notebook(cells: int, source_lines: int, output_bytes: int, parameters: int):
+    notebook = nbformat.v4.new_notebook(
+        metadata={
+            "kernelspec": {"name": "python3", "display_name": "Python 3", "language": "python"}
+        }
+    )
+    parameters_source = "\n".join(f"parameter_{i} = {i}" for i in range(parameters))
+    notebook.cells.append(nbformat.v4.new_code_cell(parameters_source or "pass"))
+    image = base64.b64encode(os.urandom(output_bytes)).decode() if output_bytes else None
+    for i in range(1, cells):
+        if i % 5 == 0:
+            notebook.cells.append(nbformat.v4.new_markdown_cell(f"## Section {i}\nSome *text*."))
+            continue
+        source = "\n".join(f"value_{i}_{j} = {j} * 2  # line {j}" for j in range(source_lines))
+        outputs = [nbformat.v4.new_output("stream", text=f"cell {i}\n" * 3)]
+        if image is not None:
+            outputs.append(nbformat.v4.new_output("display_data", data={"image/png": image}))
+        cell = nbformat.v4.new_code_cell(source)
+        cell["metadata"]["stub_outputs"] = outputs
+        notebook.cells.append(cell)
+    return notebook
+
+
+def timeit(function: Callable, repeat: int, setup: Optional[Callable] = None) -> Dict:
+    timings = []
+    for _ in range(repeat):
+        argument = setup() if setup is not None else None
+        start = time.perf_counter()
+        function(argument)
+        timings.append(time.perf_counter() - start)
+    return {"min": min(timings), "median": statistics.median(timings), "repeat": repeat}
+
+
+def executed(jupyter_notebook) -> Notebook:
+    notebook = Notebook(nbformat.from_dict(jupyter_notebook))
+    notebook.client = StubClient(notebook.jupyter_notebook)
+    for cell in notebook.code_cells:
+        cell["outputs"] = cell["metadata"].get("stub_outputs", [])
+    return notebook
+
+
+def benchmark_case(case: Dict, repeat: int, directory: pathlib.Path, s3_bucket) -> List[Dict]:
+    jupyter_notebook = make_notebook(**case)
+    path = directory / "notebook.ipynb"
+    path.write_text(nbformat.writes(jupyter_notebook))
+    parameters = {f"parameter_{i}": i * 10 for i in range(case["parameters"])}
+
+    def fresh(_=None):
+        notebook = Notebook(nbformat.from_dict(jupyter_notebook))
+        notebook.client = StubClient(notebook.jupyter_notebook)
+        return notebook
+
+    def rerender_one_cell():
+        notebook = executed(jupyter_notebook)
+        notebook.html
+        notebook.code_cells[-1]["outputs"] = [nbformat.v4.new_output("stream", text="changed")]
+        return notebook
+
+    stages = {
+        "from_local": (lambda _: Notebook.from_local(None, path), None),
+        "set_parameters": (lambda notebook: notebook.set_parameters(**parameters), fresh),
+        "execute": (lambda notebook: notebook.execute(), fresh),
+        "html": (lambda notebook: notebook.html, lambda: executed(jupyter_notebook)),
+        "html_incremental": (lambda notebook: notebook.html, rerender_one_cell),
+        "save_notebook": (
+            lambda notebook: notebook.save_notebook(str(directory / "output.ipynb")),
+            lambda: executed(jupyter_notebook),
+        ),
+        "write_html": (
+            lambda notebook: notebook.write_html(str(directory / "output.html")),
+            lambda: executed(jupyter_notebook),
+        ),
+    }
+    if s3_bucket is not None:
+        s3_bucket.put_object(Key="notebook.ipynb", Body=path.read_bytes())
+        s3_path = "s3://benchmarks/notebook.ipynb"
+        memory_cache = SourceCache()
+        stages["from_s3"] = (lambda _: Notebook.from_s3(s3_path, source_cache=SourceCache()), None)
+        # a new process only finds the notebook in the disk cache
+        stages["from_s3_disk_cache"] = (
+            lambda _: Notebook.from_s3(s3_path, source_cache=SourceCache(directory / "sources")),
+            None,
+        )
+        stages["from_s3_memory_cache"] = (
+            lambda _: Notebook.from_s3(s3_path, source_cache=memory_cache),
+            None,
+        )
+
+    results = []
+    for stage, (function, setup) in stages.items():
+        timing = timeit(function, repeat, setup)
+        if stage == "execute":
+            timing["per_cell"] = timing["min"] / case["cells"]
+        results.append({"stage": stage, "case": case, **timing})
+    return results
+
+
+STARTUP_COMMANDS = {
+    "import_cli": [sys.executable, "-c", "import firenze.cli"],
+    "cli_help": [sys.executable, "-m", "firenze.cli", "--help"],
+}
+
+
+def benchmark_startup(repeat: int) -> List[Dict]:
+    # every run is a new process, so the import time is part of each one
+    root = str(pathlib.Path(__file__).parent.parent)
+    env = {
+        **os.environ,
+        "PYTHONPATH": os.pathsep.join(filter(None, [root, os.environ.get("PYTHONPATH")])),
+    }
+
+    def start(command):
+        subprocess.run(command, check=True, capture_output=True, env=env)
+
+    return [
+        {"stage": stage, "case": {}, **timeit(start, repeat, lambda: command)}
+        for stage, command in STARTUP_COMMANDS.items()
+    ]
+
+
+def mock_s3_bucket():
+    try:
+        import boto3
+        from moto import mock_s3
+    except ImportError:
+        return None, None
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    # moto stores the checksum trailer of streamed uploads as part of the object
+    os.environ.setdefault("AWS_REQUEST_CHECKSUM_CALCULATION", "when_required")
+    mock = mock_s3()
+    mock.start()
+    bucket = boto3.resource("s3").create_bucket(Bucket="benchmarks")
+    return mock, bucket
+
+
+def run(cases: Dict, repeat: int) -> Dict:
+    print("Benchmarking startup", file=sys.stderr)
+    results = benchmark_startup(repeat)
+    mock, bucket = mock_s3_bucket()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            for values in itertools.product(*cases.values()):
+                case = dict(zip(cases, values))
+                print(f"Benchmarking {case}", file=sys.stderr)
+                results.extend(benchmark_case(case, repeat, pathlib.Path(directory), bucket))
+    finally:
+        if mock is not None:
+            mock.stop()
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+
+
+def result_key(result: Dict) -> str:
+    return json.dumps([result["stage"], result["case"]], sort_keys=True)
+
+
+def compare(
+    current: Dict, baseline: Dict, tolerance: float, min_difference: float = 0.01
+) -> List[str]:
+    baseline_results = {result_key(result): result for result in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        reference = baseline_results.get(result_key(result))
+        if reference is None:
+            continue
+        ratio = result["min"] / reference["min"]
+        # stages that take a few milliseconds are too noisy to compare by ratio alone
+        if ratio > 1 + tolerance and result["min"] - reference["min"] > min_difference:
+            regressions.append(
+                f"{result['stage']} {result['case']}: {reference['min']:.4f}s -> "
+                f"{result['min']:.4f}s ({ratio:.2f}x)"
+            )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark firenze's own overhead.")
+    parser.add_argument("--quick", action="store_true", help="Run a reduced set of cases.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument(
+        "--compare", nargs="?", const=str(BASELINE_PATH), help="Compare against a baseline."
+    )
+    parser.add_argument("--tolerance", type=float, default=0.5, help="Allowed slowdown ratio.")
+    parser.add_argument(
+        "--min-difference", type=float, default=0.01, help="Ignore slowdowns below these seconds."
+    )
+    args = parser.parse_args(argv)
+    # nbconvert warns about missing alt text on every rendered image
+    logging.basicConfig(level=logging.ERROR, format="%(message)s")
+
+    results = run(QUICK_CASES if args.quick else CASES, args.repeat)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        pathlib.Path(args.output).write_text(output)
+    else:
+        print(output)
+
+    if args.compare:
+        baseline = json.loads(pathlib.Path(args.compare).read_text())
+        regressions = compare(results, baseline, args.tolerance, args.min_difference)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+import base64
+import copy
+import hashlib
+import html
+import os
+import pathlib
+import posixpath
+from typing import Optional, Set
+
+from firenze import s3
+
+EXTENSIONS = {
+    "image/png": "png",
+    "image/jpeg": "jpg",
+    "image/gif": "gif",
+    "image/webp": "webp",
+    "application/pdf": "pdf",
+}
+
+
+class AssetStore:
+    def __init__(self, path: str, link_prefix: str, threshold: int):
+        self.path = path.rstrip("/")
+        self.link_prefix = link_prefix.rstrip("/")
+        self.threshold = threshold
+        self._written: Set[str] = set()
+
+    @classmethod
+    def for_html(cls, html_path: str, threshold: int, path: Optional[str] = None) -> "AssetStore":
+        is_s3 = html_path.startswith("s3://")
+        directory = (posixpath if is_s3 else os.path).dirname(html_path)
+        if path is None:
+            path = f"{directory}/assets" if directory else "assets"
+        if is_s3 != path.startswith("s3://"):
+            raise ValueError("Assets must be stored in the same kind of location as the HTML")
+        if is_s3:
+            html_bucket, html_key = s3.split_path(html_path)
+            bucket, key = s3.split_path(path.rstrip("/") + "/")
+            if bucket != html_bucket:
+                raise ValueError("Assets must be stored in the same s3 bucket as the HTML")
+            link_prefix = posixpath.relpath(key, posixpath.dirname(html_key) or ".")
+        else:
+            link_prefix = os.path.relpath(path, directory or ".")
+        return cls(path, link_prefix, threshold)
+
+    @property
+    def key(self):
+        return [self.path, self.link_prefix, self.threshold]
+
+    def externalize(self, cell):
+        outputs = cell.get("outputs", [])
+        externalized = [self._externalize_output(output) for output in outputs]
+        if all(new is old for new, old in zip(externalized, outputs)):
+            return cell
+        cell = copy.copy(cell)
+        cell["outputs"] = externalized
+        return cell
+
+    def _externalize_output(self, output):
+        data = output.get("data", {})
+        # text/html takes priority over images when rendering, so they would not be shown
+        if "text/html" in data:
+            return output
+        for mimetype, extension in EXTENSIONS.items():
+            if len(data.get(mimetype, "")) <= self.threshold:
+                continue
+            content = base64.b64decode(data[mimetype])
+            if len(content) <= self.threshold:
+                continue
+            name = f"{hashlib.sha256(content).hexdigest()}.{extension}"
+            self.write(name, content)
+            output = copy.copy(output)
+            output["data"] = {k: v for k, v in data.items() if k != mimetype}
+            output["data"]["text/html"] = self.link(name, mimetype, output.get("metadata", {}))
+            return output
+        return output
+
+    def link(self, name: str, mimetype: str, metadata) -> str:
+        src = html.escape(f"{self.link_prefix}/{name}")
+        if mimetype == "application/pdf":
+            return f'<a href="{src}">{name}</a>'
+        size = "".join(
+            f' {dimension}="{metadata[mimetype][dimension]}"'
+            for dimension in ("width", "height")
+            if dimension in metadata.get(mimetype, {})
+        )
+        return f'<img src="{src}"{size} alt="{mimetype} output"/>'
+
+    def write(self, name: str, content: bytes):
+        if name in self._written:
+            return
+        path = f"{self.path}/{name}"
+        if path.startswith("s3://"):
+            s3.shared().write_if_missing(path, content)
+        else:
+            local_path = pathlib.Path(path)
+            if not local_path.exists():
+                local_path.parent.mkdir(parents=True, exist_ok=True)
+                # concurrent runs may write the same asset, so it only appears once complete
+                temporary_path = local_path.with_name(f".{name}.{os.getpid()}")
+                temporary_path.write_bytes(content)
+                os.replace(temporary_path, local_path)
+        self._written.add(name)
@@ -0,0 +1,208 @@
+import asyncio
+import dataclasses
+import html
+import itertools
+import json
+import logging
+import os
+import time
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional
+
+from firenze.exports import Exports, load
+
+if TYPE_CHECKING:
+    from nbclient import NotebookClient
+
+INDEX_VALUE_LENGTH = 200
+INDEX_TEMPLATE = """<!DOCTYPE html>
+<html lang="en">
+<head><meta charset="utf-8"/><title>Runs</title>
+<style>
+body {{ font-family: sans-serif; margin: 2em; }}
+table {{ border-collapse: collapse; }}
+td, th {{ border: 1px solid #ddd; padding: 0.3em 0.6em; text-align: left; vertical-align: top; }}
+ul {{ margin: 0; padding-left: 1em; }}
+</style></head>
+<body>
+<table>
+<tr><th>Run</th><th>Parameters</th><th>Status</th><th>Elapsed</th><th>Report</th><th>Exports</th></tr>
+{rows}
+</table>
+</body>
+</html>
+"""
+
+
+@dataclasses.dataclass
+class BatchRun:
+    index: int
+    parameters: Dict[str, Any]
+    output_html_path: str
+    output_notebook_path: Optional[str] = None
+    status: str = "pending"
+    error: Optional[str] = None
+    started_at: Optional[float] = None
+    elapsed: Optional[float] = None
+    exports: Dict[str, str] = dataclasses.field(default_factory=dict)
+
+
+def parameter_grid(grid: Dict[str, List[Any]]) -> List[Dict[str, Any]]:
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*grid.values())]
+
+
+def read_parameter_sets(path) -> List[Dict[str, Any]]:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def combine_parameter_sets(
+    parameter_sets: Optional[Iterable[Dict[str, Any]]] = None,
+    grid: Optional[Dict[str, List[Any]]] = None,
+    fixed: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, Any]]:
+    parameter_sets = list(parameter_sets) if parameter_sets is not None else [{}]
+    grid_sets = parameter_grid(grid) if grid else [{}]
+    return [
+        {**(fixed or {}), **parameter_set, **grid_set}
+        for parameter_set in parameter_sets
+        for grid_set in grid_sets
+    ]
+
+
+def check_parameter_sets(parameter_sets: List[Dict[str, Any]]):
+    # output paths are formatted with the run index and the parameters, so they cannot share a name
+    if any("index" in parameters for parameters in parameter_sets):
+        raise ValueError("A parameter cannot be named index, it is the run index in output paths")
+
+
+def format_path(template: str, index: int, parameters: Dict[str, Any]) -> str:
+    return template.format(index=index, **parameters)
+
+
+async def run_batch(
+    notebook,
+    parameter_sets: Iterable[Dict[str, Any]],
+    output_html_path: str,
+    output_notebook_path: Optional[str] = None,
+    max_concurrency: int = 4,
+    summary_path: Optional[str] = None,
+    client_factory: Optional[Callable[..., "NotebookClient"]] = None,
+    kernel_pool=None,
+    cache=None,
+    exports_path: Optional[str] = None,
+) -> List[BatchRun]:
+    parameter_sets = list(parameter_sets)
+    check_parameter_sets(parameter_sets)
+    runs = [
+        BatchRun(
+            index=index,
+            parameters=parameters,
+            output_html_path=format_path(output_html_path, index, parameters),
+            output_notebook_path=(
+                format_path(output_notebook_path, index, parameters)
+                if output_notebook_path
+                else None
+            ),
+        )
+        for index, parameters in enumerate(parameter_sets)
+    ]
+    semaphore = asyncio.Semaphore(max_concurrency)
+    total = len(runs)
+
+    async def execute(run: BatchRun):
+        async with semaphore:
+            run.started_at = time.time()
+            run.status = "running"
+            instance = notebook.copy(client_factory)
+            instance.name = f"Run {run.index + 1}"
+            instance.clean()
+            exports = None
+            if exports_path is not None:
+                exports = Exports.from_path(f"{exports_path.rstrip('/')}/{run.index}")
+            try:
+                instance.set_parameters(**run.parameters)
+                await instance.async_execute(kernel_pool, cache=cache, exports=exports)
+                run.status = "ok"
+            except Exception as e:
+                run.status = "failed"
+                run.error = f"{type(e).__name__}: {e}"
+            finally:
+                run.elapsed = time.time() - run.started_at
+                if exports is not None:
+                    run.exports = dict(exports.artifacts)
+            # a run whose outputs cannot be written fails alone, the others and the summary go on
+            try:
+                await instance.async_write_html(run.output_html_path)
+                if run.output_notebook_path:
+                    await instance.async_save_notebook(run.output_notebook_path)
+            except Exception as e:
+                run.status = "failed"
+                error = f"Could not write the outputs: {type(e).__name__}: {e}"
+                run.error = error if run.error is None else f"{run.error}. {error}"
+            logging.info(
+                f"Run {run.index + 1}/{total} {run.status} in {run.elapsed:0.1f} seconds: "
+                f"{run.output_html_path}"
+            )
+
+    await asyncio.gather(*(execute(run) for run in runs))
+    if summary_path is not None:
+        await notebook.async_save(summary_path, summary(runs))
+    return runs
+
+
+def summary(runs: List[BatchRun]) -> str:
+    return json.dumps(
+        {
+            "total": len(runs),
+            "ok": sum(run.status == "ok" for run in runs),
+            "failed": sum(run.status == "failed" for run in runs),
+            "runs": [dataclasses.asdict(run) for run in runs],
+        },
+        indent=2,
+    )
+
+
+async def run_reduce(
+    notebook,
+    runs: List[BatchRun],
+    output_html_path: str,
+    parameter: str = "partitions",
+    kernel_pool=None,
+):
+    # the reduce notebook gets where the values of every run are, never their rendered outputs
+    partitions = [
+        {"parameters": run.parameters, "status": run.status, "exports": run.exports} for run in runs
+    ]
+    notebook.clean()
+    notebook.set_parameters(**{parameter: partitions})
+    try:
+        await notebook.async_execute(kernel_pool)
+    finally:
+        await notebook.async_write_html(output_html_path)
+
+
+def index_html(runs: List[BatchRun], index_path: str) -> str:
+    def link(path: str) -> str:
+        # links are relative when both files live in the same place, so the index can be moved
+        if path.startswith("s3://") == index_path.startswith("s3://"):
+            path = os.path.relpath(path, os.path.dirname(index_path) or ".")
+        return html.escape(path, quote=True)
+
+    rows = []
+    for run in runs:
+        values = []
+        for name, path in sorted(run.exports.items()):
+            value = f'<a href="{link(path)}">{html.escape(os.path.basename(path))}</a>'
+            if path.endswith(".json"):
+                value = html.escape(json.dumps(load(path))[:INDEX_VALUE_LENGTH])
+            values.append(f"<li><b>{html.escape(name)}</b>: {value}</li>")
+        parameters = ", ".join(f"{name}={value!r}" for name, value in run.parameters.items())
+        rows.append(
+            f"<tr><td>{run.index}</td><td>{html.escape(parameters)}</td>"
+            f"<td>{html.escape(run.status)}</td>"
+            f"<td>{run.elapsed or 0:0.1f}s</td>"
+            f'<td><a href="{link(run.output_html_path)}">report</a></td>'
+            f"<td><ul>{''.join(values)}</ul></td></tr>"
+        )
+    return INDEX_TEMPLATE.format(rows="\n".join(rows))
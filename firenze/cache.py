@@ -0,0 +1,152 @@
+import json
+import logging
+import os
+import pathlib
+import tempfile
+from typing import Any, Dict, List, Optional
+
+import nbformat
+
+from firenze import kernel_state, s3
+from firenze.hashing import digest
+
+NO_CACHE_TAG = "no-cache"
+
+
+class LocalCacheStore:
+    def __init__(self, directory, max_size: Optional[int] = None):
+        self.directory = pathlib.Path(directory)
+        self.max_size = max_size
+
+    def get(self, name: str) -> Optional[bytes]:
+        path = self.directory / name
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        # the modification time doubles as the last access time for the LRU eviction
+        os.utime(path)
+        return data
+
+    def put(self, name: str, data: bytes):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # runs writing the same entry at once, or a crash, must never leave it half written
+        descriptor, temporary = tempfile.mkstemp(prefix=f".{name}.", dir=self.directory)
+        try:
+            with os.fdopen(descriptor, "wb") as f:
+                f.write(data)
+            os.replace(temporary, self.directory / name)
+        except BaseException:
+            pathlib.Path(temporary).unlink(missing_ok=True)
+            raise
+        if self.max_size is not None:
+            self.evict(self.max_size)
+
+    def delete(self, name: str):
+        (self.directory / name).unlink(missing_ok=True)
+
+    def evict(self, max_size: int):
+        entries = sorted(
+            (entry.stat().st_mtime, entry.stat().st_size, entry)
+            for entry in self.directory.iterdir()
+            if entry.is_file()
+        )
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in entries:
+            if total <= max_size:
+                break
+            entry.unlink(missing_ok=True)
+            total -= size
+
+
+class S3CacheStore:
+    def __init__(self, s3_prefix: str, s3_client=None):
+        self.bucket, _, prefix = s3_prefix.replace("s3://", "").partition("/")
+        self.prefix = prefix.rstrip("/")
+        self.s3_client = s3_client if s3_client is not None else s3.shared().client
+
+    def _key(self, name: str) -> str:
+        return f"{self.prefix}/{name}" if self.prefix else name
+
+    def get(self, name: str) -> Optional[bytes]:
+        try:
+            data = self.s3_client.get_object(Bucket=self.bucket, Key=self._key(name))
+        except self.s3_client.exceptions.NoSuchKey:
+            return None
+        return data["Body"].read()
+
+    def put(self, name: str, data: bytes):
+        self.s3_client.put_object(Bucket=self.bucket, Key=self._key(name), Body=data)
+
+    def delete(self, name: str):
+        self.s3_client.delete_object(Bucket=self.bucket, Key=self._key(name))
+
+
+def cache_store(path: str, max_size: Optional[int] = None):
+    if str(path).startswith("s3://"):
+        return S3CacheStore(path)
+    return LocalCacheStore(path, max_size)
+
+
+class CellCache:
+    def __init__(self, store, strategy: str = "replay"):
+        if strategy not in ("replay", "restore"):
+            raise ValueError(f"Unknown cache strategy {strategy}")
+        self.store = store
+        self.strategy = strategy
+        self.hits = 0
+        self.misses = 0
+
+    def keys(self, jupyter_notebook, parameters: Dict[str, Any]) -> List[Optional[str]]:
+        kernelspec = jupyter_notebook.metadata.get("kernelspec", {})
+        parameters_key = digest(parameters, kernelspec)
+        keys: List[Optional[str]] = []
+        upstream = ""
+        for cell in jupyter_notebook.cells:
+            if cell["cell_type"] != "code" or NO_CACHE_TAG in cell["metadata"].get("tags", []):
+                keys.append(None)
+                continue
+            upstream = digest(cell["source"], parameters_key, upstream)
+            keys.append(upstream)
+        return keys
+
+    def get(self, key: str) -> Optional[Dict]:
+        data = self.store.get(f"{key}.json")
+        if data is None:
+            return None
+        try:
+            return json.loads(data)
+        except ValueError:
+            logging.warning(f"Ignoring the unreadable cache entry {key}")
+            return None
+
+    def put(self, key: str, cell):
+        entry = {"outputs": cell["outputs"], "execution_count": cell["execution_count"]}
+        self.store.put(f"{key}.json", json.dumps(entry).encode("utf_8"))
+
+    @staticmethod
+    def apply(entry: Dict, cell):
+        cell["outputs"] = [nbformat.from_dict(output) for output in entry["outputs"]]
+        cell["execution_count"] = entry["execution_count"]
+
+    async def save_state(self, client, key: str):
+        data, skipped = await kernel_state.snapshot(client)
+        # a snapshot that misses names cannot rebuild the kernel, so it is not worth storing
+        if not skipped:
+            self.store.put(f"{key}.state", data)
+
+    async def rebuild_state(self, client, cells, keys: List[Optional[str]]):
+        last_key = next((key for key in reversed(keys) if key is not None), None)
+        if self.strategy == "restore" and last_key is not None:
+            data = self.store.get(f"{last_key}.state")
+            if data is not None and not await kernel_state.restore(client, data):
+                return
+            logging.info("Kernel state not restored from the cache, replaying cached cells")
+        for cell in cells:
+            if cell["cell_type"] == "code" and cell["source"].strip():
+                await kernel_state.run_silently(client, cell["source"])
+
+    def report(self, hits: int, misses: int):
+        self.hits += hits
+        self.misses += misses
+        logging.info(f"Cache: {hits} hits, {misses} misses")
@@ -0,0 +1,68 @@
+import json
+import os
+import pathlib
+import time
+from typing import Dict, List
+
+import nbformat
+from nbformat.v4.nbjson import BytesEncoder
+
+from firenze.hashing import digest
+
+
+class CellLog:
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+
+    def start(self):
+        self._append({"event": "start", "time": time.time()})
+
+    def append(self, index: int, cell):
+        self._append(
+            {
+                "event": "cell",
+                "index": index,
+                "source": digest(cell["source"]),
+                "execution_count": cell["execution_count"],
+                "outputs": cell["outputs"],
+            }
+        )
+
+    def _append(self, record: Dict):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        line = (json.dumps(record, cls=BytesEncoder, ensure_ascii=False) + "\n").encode("utf_8")
+        # one line per record, written at once, so a crash can only cut the last one short. the next
+        # record starts on its own line, and the cut one is ignored
+        with open(self.path, "ab+") as f:
+            if f.seek(0, os.SEEK_END):
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    line = b"\n" + line
+            f.write(line)
+
+    def records(self) -> List[Dict]:
+        records: List[Dict] = []
+        with open(self.path, encoding="utf_8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if record["event"] == "start":
+                    records = []
+                else:
+                    records.append(record)
+        return records
+
+    def rebuild(self, jupyter_notebook: nbformat.NotebookNode) -> int:
+        applied = set()
+        # only the last run counts, and only for cells that did not change since
+        for record in self.records():
+            index = record["index"]
+            cells = jupyter_notebook.cells
+            if index >= len(cells) or digest(cells[index]["source"]) != record["source"]:
+                continue
+            cells[index]["outputs"] = [nbformat.from_dict(output) for output in record["outputs"]]
+            cells[index]["execution_count"] = record["execution_count"]
+            applied.add(index)
+        return len(applied)
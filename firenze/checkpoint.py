@@ -0,0 +1,104 @@
+import json
+import logging
+from typing import Any, Dict, List, Optional, Set
+
+import nbformat
+
+from firenze import kernel_state
+from firenze.cache import cache_store
+from firenze.dependencies import analyze, is_executable
+from firenze.hashing import digest
+
+MANIFEST = "checkpoint.json"
+
+
+class Checkpoint:
+    def __init__(self, store, resume: bool = False, save_state: bool = True):
+        self.store = store
+        self.resume = resume
+        self.save_state = save_state
+        self._manifest: Dict[str, Any] = {}
+
+    @classmethod
+    def from_path(cls, path: str, **kwargs) -> "Checkpoint":
+        return cls(cache_store(path), **kwargs)
+
+    @staticmethod
+    def fingerprint(cells, completed: int) -> str:
+        # a checkpoint only applies to a notebook whose completed cells did not change
+        return digest([cell["source"] for cell in cells[:completed] if is_executable(cell)])
+
+    def load(self, cells) -> int:
+        if not self.resume:
+            return 0
+        data = self.store.get(MANIFEST)
+        if data is None:
+            logging.info("No checkpoint to resume from, executing every cell")
+            return 0
+        manifest = json.loads(data)
+        completed = manifest["completed"]
+        if manifest["fingerprint"] != self.fingerprint(cells, completed):
+            logging.warning("The notebook changed since the checkpoint, executing every cell")
+            return 0
+        for index in range(completed):
+            if not is_executable(cells[index]):
+                continue
+            entry = json.loads(self.store.get(f"cell-{index}.json"))
+            cells[index]["outputs"] = [nbformat.from_dict(output) for output in entry["outputs"]]
+            cells[index]["execution_count"] = entry["execution_count"]
+        self._manifest = manifest
+        logging.info(f"Resuming after cell {completed} from the checkpoint")
+        return completed
+
+    async def save(self, client, cells, index: int):
+        cell = cells[index]
+        entry = {"outputs": cell["outputs"], "execution_count": cell["execution_count"]}
+        self.store.put(f"cell-{index}.json", json.dumps(entry).encode("utf_8"))
+        skipped: Optional[List[str]] = None
+        state = None
+        if self.save_state:
+            data, skipped = await kernel_state.snapshot(client)
+            state = f"state-{index}.pickle"
+            self.store.put(state, data)
+        # the manifest goes last and names its own snapshot, so an interrupted save leaves the
+        # previous checkpoint usable
+        manifest = {
+            "completed": index + 1,
+            "fingerprint": self.fingerprint(cells, index + 1),
+            "skipped": skipped,
+            "state": state,
+        }
+        self.store.put(MANIFEST, json.dumps(manifest).encode("utf_8"))
+        previous = self._manifest.get("state")
+        if previous is not None and previous != state:
+            self.store.delete(previous)
+        self._manifest = manifest
+
+    async def rebuild_state(self, client, cells):
+        replay = range(len(cells))
+        state = self._manifest.get("state")
+        data = self.store.get(state) if state is not None else None
+        if data is not None:
+            skipped = set(self._manifest["skipped"]) | set(await kernel_state.restore(client, data))
+            replay = self._cells_defining(cells, skipped)
+            if replay:
+                logging.info(
+                    f"Replaying {len(replay)} cells to define {', '.join(sorted(skipped))}"
+                )
+        else:
+            logging.info("No kernel state in the checkpoint, replaying the executed cells")
+        for index in replay:
+            if is_executable(cells[index]):
+                await kernel_state.run_silently(client, cells[index]["source"])
+        if data is not None and replay:
+            # replayed cells may reassign names that later cells changed, the snapshot has the
+            # latest value of everything it could serialize
+            await kernel_state.restore(client, data)
+
+    @staticmethod
+    def _cells_defining(cells, names: Set[str]) -> List[int]:
+        if not names:
+            return []
+        return [
+            index for index, cell in analyze(cells).items() if cell.opaque or cell.defines & names
+        ]
@@ -1,12 +1,25 @@
 #!/usr/bin/env python3
 import asyncio
+import contextlib
+import dataclasses
 import json
 import logging
+import signal
 import sys
 
 import click
 
+from firenze import batch, compression, jobs, kernel_pool, server
+from firenze.cache import CellCache, cache_store
+from firenze.cell_log import CellLog
+from firenze.checkpoint import Checkpoint
+from firenze.html_writer import BackgroundHTMLWriter
+from firenze.limits import ResourceLimits
+from firenze.metrics import MetricsCollector
 from firenze.notebook import Notebook
+from firenze.selection import Selection
+from firenze.sources import SourceCache
+from firenze.streaming import OutputStreamer
 
 
 # a bit hacky
@@ -17,6 +30,108 @@ class PathOrS3(click.Path):
         return super().convert(value, param, ctx)
 
 
+def cache_options(command):
+    command = click.option(
+        "--cache-strategy",
+        type=click.Choice(["replay", "restore"]),
+        default="replay",
+        help="Rebuild the kernel state after cached cells by re-running them or from a snapshot.",
+    )(command)
+    command = click.option(
+        "--cache-max-size", type=int, help="Maximum size of a local cache, in megabytes."
+    )(command)
+    command = click.option(
+        "--cache",
+        "cache_path",
+        type=PathOrS3(),
+        help="Directory or s3 prefix of the cell execution cache. Disabled by default.",
+    )(command)
+    return command
+
+
+def assets_options(command):
+    command = click.option(
+        "--assets-path",
+        type=PathOrS3(),
+        help="Where external assets are written. Defaults to `assets` next to the HTML.",
+    )(command)
+    command = click.option(
+        "--external-assets-threshold",
+        type=int,
+        help="Write outputs larger than this many bytes as separate files linked from the HTML.",
+    )(command)
+    return command
+
+
+def metrics_options(command):
+    command = click.option(
+        "--metrics-log",
+        type=PathOrS3(),
+        help="Also write the metrics of every cell to this JSON lines file.",
+    )(command)
+    command = click.option(
+        "--metrics",
+        "collect_metrics",
+        is_flag=True,
+        help="Record the time, memory and CPU of every cell, shown as a table in the HTML.",
+    )(command)
+    return command
+
+
+def source_cache_options(command):
+    command = click.option(
+        "--source-cache-max-size",
+        type=int,
+        help="Maximum size of the source notebook cache, in megabytes.",
+    )(command)
+    command = click.option(
+        "--source-cache",
+        "source_cache_path",
+        type=click.Path(),
+        envvar="FIRENZE_SOURCE_CACHE",
+        help="Directory where notebooks read from s3 are kept, and only downloaded again if they "
+        "changed.",
+    )(command)
+    return command
+
+
+def output_options(command):
+    command = click.option(
+        "--compress",
+        type=click.Choice(compression.CODECS),
+        help="Compress the HTML and notebook outputs, zstd needs the zstandard package.",
+    )(command)
+    command = click.option(
+        "--max-output-size",
+        type=int,
+        help="Keep only the first and last characters of streams longer than this in the outputs.",
+    )(command)
+    command = click.option(
+        "--stream-outputs",
+        is_flag=True,
+        help="Log the printed output and errors of every cell as they happen.",
+    )(command)
+    return command
+
+
+def limits_options(command):
+    command = click.option(
+        "--cpus", help="CPUs the kernel is pinned to, like 0-3,8. Only on linux."
+    )(command)
+    command = click.option(
+        "--max-memory",
+        type=int,
+        help="Kill the kernel when it and its subprocesses use more megabytes than this.",
+    )(command)
+    command = click.option(
+        "--run-timeout", type=float, help="Seconds the whole notebook may run before it is stopped."
+    )(command)
+    command = click.option(
+        "--cell-timeout", type=float, help="Seconds a cell may run before it is interrupted."
+    )(command)
+    return command
+
+
 @click.command()
 @click.argument("notebook-path", type=PathOrS3(exists=True))
 @click.option("-o", "--output-html-path", type=PathOrS3(), default="output.html")
@@ -24,42 +139,571 @@ class PathOrS3(click.Path):
 @click.option(
     "-i", "--in-place", is_flag=True, help="Overwrite the notebook file with the execution."
 )
+@click.option(
+    "--kernel-pool",
+    "kernel_pool_socket",
+    type=click.Path(),
+    envvar="FIRENZE_KERNEL_POOL",
+    help="Socket of a running `firenze-pool` daemon to take a warm kernel from.",
+)
+@click.option(
+    "-p",
+    "--parallel",
+    "parallel_workers",
+    type=int,
+    default=0,
+    help="Run independent cells concurrently in up to this many extra kernels.",
+)
+@click.option(
+    "--checkpoint",
+    "checkpoint_path",
+    type=PathOrS3(),
+    help="Directory or s3 prefix where progress is saved after every cell.",
+)
+@click.option(
+    "--resume", is_flag=True, help="Continue from the first cell the checkpoint does not hold."
+)
+@click.option(
+    "--checkpoint-state/--no-checkpoint-state",
+    default=True,
+    help="Save the kernel namespace with the checkpoint, instead of replaying cells on resume.",
+)
+@click.option(
+    "--cell-log",
+    "cell_log_path",
+    type=click.Path(dir_okay=False),
+    help="Append the outputs of every cell to this file as it finishes, see `firenze-rebuild`.",
+)
+@click.option(
+    "--only-tag",
+    "only_tags",
+    multiple=True,
+    help="Execute only the cells with this tag and the cells they read from.",
+)
+@click.option(
+    "--only-changed",
+    is_flag=True,
+    help="Execute only the cells affected by the parameters that differ from the notebook.",
+)
+@cache_options
+@assets_options
+@metrics_options
+@output_options
+@limits_options
+@source_cache_options
 @click.argument("parameters", nargs=-1)
-def execute_notebook(notebook_path, output_html_path, quiet, in_place, parameters):
+def execute_notebook(
+    notebook_path,
+    output_html_path,
+    quiet,
+    in_place,
+    kernel_pool_socket,
+    parallel_workers,
+    checkpoint_path,
+    resume,
+    checkpoint_state,
+    cell_log_path,
+    only_tags,
+    only_changed,
+    cache_path,
+    cache_max_size,
+    cache_strategy,
+    external_assets_threshold,
+    assets_path,
+    collect_metrics,
+    metrics_log,
+    stream_outputs,
+    max_output_size,
+    compress,
+    cell_timeout,
+    run_timeout,
+    max_memory,
+    cpus,
+    source_cache_path,
+    source_cache_max_size,
+    parameters,
+):
+    if parallel_workers and cache_path is not None:
+        raise click.UsageError("--parallel cannot be combined with --cache")
+    if checkpoint_path is None and resume:
+        raise click.UsageError("--resume needs a --checkpoint")
+    if in_place and compress is not None:
+        # compressed local notebooks get the codec extension, so the notebook would not be updated
+        raise click.UsageError("--in-place cannot be combined with --compress")
+    if checkpoint_path is not None and (parallel_workers or cache_path is not None):
+        raise click.UsageError("--checkpoint cannot be combined with --parallel or --cache")
+    selective = bool(only_tags) or only_changed
+    if selective and (parallel_workers or cache_path is not None or checkpoint_path is not None):
+        raise click.UsageError(
+            "--only-tag and --only-changed cannot be combined with --parallel, --cache or "
+            "--checkpoint"
+        )
     parsed_options = parse_options(parameters)
-    notebook = Notebook.from_path(notebook_path)
-    notebook.clean()
+    notebook = Notebook.from_path(
+        notebook_path, source_cache=build_source_cache(source_cache_path, source_cache_max_size)
+    )
+    selection = None
+    if selective:
+        # the cells that are not executed keep the outputs the notebook already has
+        changed = None
+        if only_changed:
+            changed = frozenset(notebook.changed_parameters(**parsed_options))
+        selection = Selection(frozenset(only_tags), changed)
+    else:
+        notebook.clean()
     notebook.set_parameters(**parsed_options)
+    notebook.externalize_assets(external_assets_threshold, assets_path)
+    notebook.metrics = build_metrics(collect_metrics, metrics_log)
+    notebook.streamer = build_streamer(stream_outputs, max_output_size)
+    notebook.compression = build_compression(compress)
+    notebook.limits = build_limits(cell_timeout, run_timeout, max_memory, cpus)
+    notebook.cell_log = CellLog(cell_log_path) if cell_log_path is not None else None
     done_event = asyncio.Event()
 
-    if quiet:
-        logging.basicConfig(level=logging.WARNING, format="%(message)s")
-    else:
-        logging.basicConfig(level=logging.INFO, format="%(message)s")
+    configure_logging(quiet)
+    pool = None
+    if kernel_pool_socket is not None:
+        pool = kernel_pool.RemoteKernelPool(kernel_pool_socket)
+        if not pool.is_available():
+            logging.warning(f"No kernel pool at {kernel_pool_socket}, starting a new kernel")
+            pool = None
+
+    cache = build_cache(cache_path, cache_max_size, cache_strategy)
+    checkpoint = None
+    if checkpoint_path is not None:
+        checkpoint = Checkpoint.from_path(
+            checkpoint_path, resume=resume, save_state=checkpoint_state
+        )
 
     async def execute_and_write():
+        cell_executed = asyncio.Event()
+
         async def execute():
-            await notebook.async_execute()
-            done_event.set()
+            try:
+                await notebook.async_execute(
+                    kernel_pool=pool,
+                    on_cell_executed=cell_executed.set,
+                    cache=cache,
+                    parallel_workers=parallel_workers,
+                    checkpoint=checkpoint,
+                    selection=selection,
+                )
+            finally:
+                done_event.set()
+                cell_executed.set()
 
         async def write_while_running():
+            # write as soon as a cell finishes, and every 5 seconds while a long cell is running
             while not done_event.is_set():
                 await write()
-                await asyncio.sleep(5)
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(cell_executed.wait(), timeout=5)
+                cell_executed.clear()
 
         async def write():
             if in_place:
-                notebook.save_notebook(notebook_path)
-            notebook.write_html(output_html_path)
+                await notebook.async_save_notebook(notebook_path)
+            # rendering is CPU bound, so it runs in another process and never delays the kernel
+            html_writer.submit(output_html_path)
 
-        await asyncio.gather(
-            asyncio.create_task(execute()), asyncio.create_task(write_while_running())
-        )
-        await write()
+        async with BackgroundHTMLWriter(notebook) as html_writer:
+            try:
+                await asyncio.gather(
+                    asyncio.create_task(execute()), asyncio.create_task(write_while_running())
+                )
+            finally:
+                await write()
+                if metrics_log is not None:
+                    await notebook.async_save(metrics_log, notebook.metrics.jsonl())
 
     asyncio.run(execute_and_write())
 
 
+@click.command()
+@click.argument("notebook-path", type=PathOrS3(exists=True))
+@click.option(
+    "-o",
+    "--output-html-path",
+    type=PathOrS3(),
+    default="output_{index}.html",
+    help="Path template, formatted with `index` and the parameters of each run.",
+)
+@click.option(
+    "-n", "--output-notebook-path", type=PathOrS3(), help="Path template for executed notebooks."
+)
+@click.option(
+    "-g",
+    "--grid",
+    multiple=True,
+    help="Parameter grid axis as name=[values]. Every combination of axes is run.",
+)
+@click.option(
+    "-f",
+    "--parameters-file",
+    type=click.Path(exists=True),
+    help="JSON lines file with one set of parameters per line.",
+)
+@click.option("-j", "--max-concurrency", type=int, default=4, help="Maximum live kernels.")
+@click.option(
+    "-w",
+    "--warm-kernels",
+    is_flag=True,
+    help="Keep --max-concurrency kernels started and recycle them between runs.",
+)
+@click.option("--kernel-max-uses", type=int, default=20, help="Runs before a kernel is replaced.")
+@click.option("-s", "--summary-path", type=PathOrS3(), default="summary.json")
+@click.option(
+    "-e",
+    "--exports-path",
+    type=PathOrS3(),
+    help="Directory or s3 prefix for the values defined in cells tagged `export`, one per run.",
+)
+@click.option(
+    "-r",
+    "--reduce",
+    "reduce_notebook_path",
+    type=PathOrS3(exists=True),
+    help="Notebook executed after the runs, with their exports in its `partitions` parameter.",
+)
+@click.option("--reduce-output-path", type=PathOrS3(), default="reduce.html")
+@click.option(
+    "--index-path", type=PathOrS3(), help="Write an HTML index of the runs and their exports."
+)
+@cache_options
+@assets_options
+@metrics_options
+@output_options
+@limits_options
+@source_cache_options
+@click.option("-q", "--quiet", count=True, help="Decrease verbosity.")
+@click.argument("parameters", nargs=-1)
+def execute_batch(
+    notebook_path,
+    output_html_path,
+    output_notebook_path,
+    grid,
+    parameters_file,
+    max_concurrency,
+    warm_kernels,
+    kernel_max_uses,
+    summary_path,
+    exports_path,
+    reduce_notebook_path,
+    reduce_output_path,
+    index_path,
+    cache_path,
+    cache_max_size,
+    cache_strategy,
+    external_assets_threshold,
+    assets_path,
+    collect_metrics,
+    metrics_log,
+    stream_outputs,
+    max_output_size,
+    compress,
+    cell_timeout,
+    run_timeout,
+    max_memory,
+    cpus,
+    source_cache_path,
+    source_cache_max_size,
+    quiet,
+    parameters,
+):
+    if reduce_notebook_path is not None and exports_path is None:
+        raise click.UsageError("--reduce needs an --exports-path")
+    if exports_path is not None and cache_path is not None:
+        raise click.UsageError("--exports-path cannot be combined with --cache")
+    configure_logging(quiet)
+    grid = parse_options(grid)
+    for name, values in grid.items():
+        if not isinstance(values, list):
+            raise click.BadParameter(f"{name} must be a JSON list", param_hint="--grid")
+    parameter_sets = batch.combine_parameter_sets(
+        batch.read_parameter_sets(parameters_file) if parameters_file else None,
+        grid,
+        parse_options(parameters),
+    )
+    try:
+        batch.check_parameter_sets(parameter_sets)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    source_cache = build_source_cache(source_cache_path, source_cache_max_size)
+    notebook = Notebook.from_path(notebook_path, source_cache=source_cache)
+    notebook.externalize_assets(external_assets_threshold, assets_path)
+    notebook.metrics = build_metrics(collect_metrics, metrics_log)
+    notebook.streamer = build_streamer(stream_outputs, max_output_size)
+    notebook.compression = build_compression(compress)
+    notebook.limits = build_limits(cell_timeout, run_timeout, max_memory, cpus)
+    cache = build_cache(cache_path, cache_max_size, cache_strategy)
+
+    async def execute(pool=None):
+        runs = await notebook.async_execute_batch(
+            parameter_sets,
+            output_html_path,
+            output_notebook_path=output_notebook_path,
+            max_concurrency=max_concurrency,
+            summary_path=summary_path,
+            kernel_pool=pool,
+            cache=cache,
+            exports_path=exports_path,
+        )
+        if index_path is not None:
+            index = await asyncio.to_thread(batch.index_html, runs, index_path)
+            await notebook.async_save_output(index_path, index)
+        if reduce_notebook_path is not None:
+            reduce_notebook = Notebook.from_path(reduce_notebook_path, source_cache=source_cache)
+            reduce_notebook.name = "Reduce"
+            reduce_notebook.compression = notebook.compression
+            await batch.run_reduce(reduce_notebook, runs, reduce_output_path, kernel_pool=pool)
+        return runs
+
+    async def execute_with_pool():
+        pool_size = min(max_concurrency, len(parameter_sets))
+        async with kernel_pool.KernelPool(size=pool_size, max_uses=kernel_max_uses) as pool:
+            return await execute(pool)
+
+    runs = asyncio.run(execute_with_pool() if warm_kernels else execute())
+    if metrics_log is not None:
+        notebook.save(metrics_log, notebook.metrics.jsonl())
+    if any(run.status != "ok" for run in runs):
+        sys.exit(1)
+
+
+@click.command()
+@click.option("--socket", "socket_path", type=click.Path(), default=kernel_pool.DEFAULT_SOCKET_PATH)
+@click.option("-n", "--size", type=int, default=4, help="Number of warm kernels.")
+@click.option("--max-uses", type=int, default=20, help="Runs before a kernel is replaced.")
+@click.option("--kernel-name", default="python3")
+@click.option(
+    "--health-check-interval", type=float, default=30, help="Seconds between idle kernel checks."
+)
+@click.option("-q", "--quiet", count=True, help="Decrease verbosity.")
+def kernel_pool_daemon(socket_path, size, max_uses, kernel_name, health_check_interval, quiet):
+    configure_logging(quiet)
+
+    async def serve():
+        async with kernel_pool.KernelPool(
+            size=size,
+            max_uses=max_uses,
+            kernel_name=kernel_name,
+            health_check_interval=health_check_interval,
+        ) as pool:
+            logging.info(f"Serving {size} warm kernels at {socket_path}")
+            server = asyncio.create_task(kernel_pool.serve(pool, socket_path))
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                asyncio.get_running_loop().add_signal_handler(signum, server.cancel)
+            with contextlib.suppress(asyncio.CancelledError):
+                await server
+
+    asyncio.run(serve())
+
+
+@click.command()
+@click.argument("queue-path", type=PathOrS3())
+@click.option("--name", help="Name of the worker in the jobs. Defaults to the host and process id.")
+@click.option(
+    "--lease-timeout",
+    type=float,
+    default=300,
+    help="Seconds without a heartbeat before a job is handed to another worker.",
+)
+@click.option("--poll-interval", type=float, default=5, help="Seconds between checks for jobs.")
+@click.option("--max-jobs", type=int, help="Exit after running this many jobs.")
+@click.option("--exit-when-empty", is_flag=True, help="Exit when there are no jobs to run.")
+@source_cache_options
+@click.option("-q", "--quiet", count=True, help="Decrease verbosity.")
+def job_worker(
+    queue_path,
+    name,
+    lease_timeout,
+    poll_interval,
+    max_jobs,
+    exit_when_empty,
+    source_cache_path,
+    source_cache_max_size,
+    quiet,
+):
+    configure_logging(quiet)
+    worker = jobs.Worker(
+        jobs.JobQueue(jobs.job_store(queue_path)),
+        name=name,
+        lease_timeout=lease_timeout,
+        poll_interval=poll_interval,
+        handle_signals=True,
+        source_cache=build_source_cache(source_cache_path, source_cache_max_size),
+    )
+    logging.info(f"Worker {worker.name} waiting for jobs in {queue_path}")
+    asyncio.run(worker.run(max_jobs, exit_when_empty))
+
+
+@click.command()
+@click.argument("queue-path", type=PathOrS3())
+@click.argument("notebook-path", type=PathOrS3())
+@click.option("-o", "--output-html-path", type=PathOrS3(), default="output.html")
+@click.option("-n", "--output-notebook-path", type=PathOrS3(), help="Also save the notebook here.")
+@click.option("--max-attempts", type=int, default=3, help="Executions before a job fails.")
+@click.argument("parameters", nargs=-1)
+def submit_job(
+    queue_path, notebook_path, output_html_path, output_notebook_path, max_attempts, parameters
+):
+    job = jobs.Job(
+        notebook_path=notebook_path,
+        output_html_path=output_html_path,
+        parameters=parse_options(parameters),
+        output_notebook_path=output_notebook_path,
+        max_attempts=max_attempts,
+    )
+    jobs.JobQueue(jobs.job_store(queue_path)).submit(job)
+    click.echo(job.id)
+
+
+@click.command()
+@click.argument("notebook-path", type=PathOrS3(exists=True))
+@click.argument("cell-log-path", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "-n", "--output-notebook-path", type=PathOrS3(), help="Defaults to the notebook itself."
+)
+@click.option("-o", "--output-html-path", type=PathOrS3(), help="Also write the HTML here.")
+def rebuild_notebook(notebook_path, cell_log_path, output_notebook_path, output_html_path):
+    notebook = Notebook.from_path(notebook_path)
+    rebuilt = CellLog(cell_log_path).rebuild(notebook.jupyter_notebook)
+    notebook.save_notebook(output_notebook_path or notebook_path)
+    if output_html_path is not None:
+        notebook.write_html(output_html_path)
+    click.echo(f"Rebuilt {rebuilt} cells from {cell_log_path}")
+
+
+@click.command()
+@click.argument("queue-path", type=PathOrS3())
+@click.option("--status", type=click.Choice(jobs.JOB_STATUSES), help="Only jobs in this status.")
+def list_jobs(queue_path, status):
+    for job in jobs.JobQueue(jobs.job_store(queue_path)).jobs():
+        if status is None or job.status == status:
+            click.echo(json.dumps(dataclasses.asdict(job)))
+
+
+@click.command()
+@click.option("--host", default="127.0.0.1", help="Address to listen on.")
+@click.option("--port", type=int, default=8642)
+@click.option(
+    "-o",
+    "--output-path",
+    type=PathOrS3(),
+    default="firenze-results",
+    help="Directory or s3 prefix where the HTML and notebook of every job are saved.",
+)
+@click.option("-j", "--max-concurrency", type=int, default=2, help="Jobs executed at once.")
+@click.option(
+    "--max-queue", type=int, default=16, help="Jobs waiting to run before requests are refused."
+)
+@click.option("--timeout", type=float, help="Seconds a job may run, unless the request says so.")
+@click.option(
+    "-w",
+    "--warm-kernels",
+    is_flag=True,
+    help="Keep --max-concurrency kernels started and recycle them between jobs.",
+)
+@click.option("--kernel-max-uses", type=int, default=20, help="Jobs before a kernel is replaced.")
+@source_cache_options
+@click.option("-q", "--quiet", count=True, help="Decrease verbosity.")
+def serve_notebooks(
+    host,
+    port,
+    output_path,
+    max_concurrency,
+    max_queue,
+    timeout,
+    warm_kernels,
+    kernel_max_uses,
+    source_cache_path,
+    source_cache_max_size,
+    quiet,
+):
+    configure_logging(quiet)
+
+    async def serve(pool=None):
+        service = server.ExecutionService(
+            output_path,
+            max_concurrency=max_concurrency,
+            max_queue=max_queue,
+            timeout=timeout,
+            kernel_pool=pool,
+            source_cache=build_source_cache(source_cache_path, source_cache_max_size),
+        )
+        await server.serve(service, host, port)
+
+    async def serve_with_pool():
+        async with kernel_pool.KernelPool(size=max_concurrency, max_uses=kernel_max_uses) as pool:
+            await serve(pool)
+
+    with contextlib.suppress(KeyboardInterrupt):
+        asyncio.run(serve_with_pool() if warm_kernels else serve())
+
+
+def build_cache(cache_path, cache_max_size, cache_strategy):
+    if cache_path is None:
+        return None
+    max_size = cache_max_size * 1024 * 1024 if cache_max_size is not None else None
+    return CellCache(cache_store(cache_path, max_size), cache_strategy)
+
+
+def build_source_cache(source_cache_path, source_cache_max_size):
+    if source_cache_path is None:
+        return None
+    max_size = source_cache_max_size * 1024 * 1024 if source_cache_max_size is not None else None
+    return SourceCache(source_cache_path, max_size)
+
+
+def build_metrics(collect_metrics, metrics_log):
+    if not collect_metrics and metrics_log is None:
+        return None
+    return MetricsCollector()
+
+
+def build_streamer(stream_outputs, max_output_size):
+    if not stream_outputs and max_output_size is None:
+        return None
+    return OutputStreamer(log_outputs=stream_outputs, max_output_size=max_output_size)
+
+
+def build_compression(compress):
+    try:
+        compression.check(compress)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    return compress
+
+
+def build_limits(cell_timeout, run_timeout, max_memory, cpus):
+    if cell_timeout is None and run_timeout is None and max_memory is None and cpus is None:
+        return None
+    return ResourceLimits(
+        cell_timeout=cell_timeout,
+        run_timeout=run_timeout,
+        max_memory=max_memory * 1024 * 1024 if max_memory is not None else None,
+        cpus=parse_cpus(cpus) if cpus is not None else None,
+    )
+
+
+def parse_cpus(cpus):
+    parsed = set()
+    try:
+        for part in cpus.split(","):
+            first, _, last = part.partition("-")
+            parsed.update(range(int(first), int(last or first) + 1))
+    except ValueError:
+        raise click.BadParameter(f"{cpus} is not a list of CPUs like 0-3,8", param_hint="--cpus")
+    return frozenset(parsed)
+
+
+def configure_logging(quiet):
+    if quiet:
+        logging.basicConfig(level=logging.WARNING, format="%(message)s")
+    else:
+        logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+
 def parse_options(parameters):
     parsed_options = {}
     for option in parameters:
@@ -0,0 +1,59 @@
+import gzip
+import pathlib
+from typing import Optional
+
+CODECS = ("gzip", "zstd")
+EXTENSIONS = {".gz": "gzip", ".zst": "zstd"}
+MAGIC_BYTES = {b"\x1f\x8b": "gzip", b"\x28\xb5\x2f\xfd": "zstd"}
+CONTENT_TYPES = {".html": "text/html; charset=utf-8", ".ipynb": "application/x-ipynb+json"}
+# outputs are rewritten while the notebook runs, so speed matters more than the last few percent
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError("zstd compression needs the zstandard package") from None
+    return zstandard
+
+
+def check(codec: Optional[str]):
+    if codec not in (None, *CODECS):
+        raise ValueError(f"Unknown compression {codec}, use one of {', '.join(CODECS)}")
+    if codec == "zstd":
+        _zstandard()
+
+
+def compress(data: bytes, codec: str) -> bytes:
+    if codec == "gzip":
+        # without a timestamp, unchanged outputs compress to the same bytes and are not uploaded
+        return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+    if codec == "zstd":
+        return _zstandard().ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    raise ValueError(f"Unknown compression {codec}")
+
+
+def decompress(data: bytes) -> bytes:
+    codec = MAGIC_BYTES.get(data[:4]) or MAGIC_BYTES.get(data[:2])
+    if codec == "gzip":
+        return gzip.decompress(data)
+    if codec == "zstd":
+        return _zstandard().ZstdDecompressor().decompressobj().decompress(data)
+    return data
+
+
+def codec_for_path(path: str) -> Optional[str]:
+    return EXTENSIONS.get(pathlib.PurePosixPath(path).suffix)
+
+
+def with_extension(path: str, codec: str) -> str:
+    extension = next(extension for extension, name in EXTENSIONS.items() if name == codec)
+    return path if path.endswith(extension) else f"{path}{extension}"
+
+
+def content_type(path: str) -> Optional[str]:
+    for extension in EXTENSIONS:
+        path = path.removesuffix(extension)
+    return CONTENT_TYPES.get(pathlib.PurePosixPath(path).suffix)
@@ -0,0 +1,312 @@
+import ast
+import dataclasses
+from typing import Dict, List, Set
+
+# calls that can read or write any name, so cells using them are never reordered
+OPAQUE_CALLS = {"exec", "eval", "globals", "locals", "vars", "get_ipython", "__import__"}
+# builtins that never change the objects passed to them, any other call may
+PURE_CALLS = set(
+    "abs all any bool callable chr dict divmod enumerate float format frozenset hasattr hash id "
+    "int isinstance issubclass len list max min ord print range repr reversed round set sorted str "
+    "sum tuple type zip".split()
+)
+
+
+@dataclasses.dataclass
+class CellNames:
+    defines: Set[str] = dataclasses.field(default_factory=set)
+    uses: Set[str] = dataclasses.field(default_factory=set)
+    mutates: Set[str] = dataclasses.field(default_factory=set)
+    imports: Set[str] = dataclasses.field(default_factory=set)
+    # names bound to the same object, by b = a or a = b = []
+    aliases: List[Set[str]] = dataclasses.field(default_factory=list)
+    # globals read by the functions and classes the cell defines
+    functions: Dict[str, Set[str]] = dataclasses.field(default_factory=dict)
+    opaque: bool = False
+    # the cell changes state that copying names between kernels loses, like a module or an object
+    # bound to several names, so it only runs in the main kernel
+    main_only: bool = False
+
+
+class _NameCollector(ast.NodeVisitor):
+    def __init__(self):
+        self.names = CellNames()
+        self.depth = 0
+
+    def define(self, name: str):
+        if self.depth == 0:
+            self.names.defines.add(name)
+
+    def mutate(self, node):
+        # assigning to an attribute or an item, or calling a method as a statement, changes the
+        # object bound to the root name
+        while isinstance(node, (ast.Attribute, ast.Subscript, ast.Call)):
+            node = node.func if isinstance(node, ast.Call) else node.value
+        if isinstance(node, ast.Name):
+            self.names.mutates.add(node.id)
+            self.names.uses.add(node.id)
+
+    def visit_Name(self, node):
+        if isinstance(node.ctx, ast.Load):
+            self.names.uses.add(node.id)
+        else:
+            self.define(node.id)
+
+    def visit_Attribute(self, node):
+        if not isinstance(node.ctx, ast.Load):
+            self.mutate(node)
+        self.generic_visit(node)
+
+    visit_Subscript = visit_Attribute
+
+    def visit_Assign(self, node):
+        if self.depth == 0:
+            bound = {target.id for target in node.targets if isinstance(target, ast.Name)}
+            if isinstance(node.value, ast.Name):
+                bound.add(node.value.id)
+            if len(bound) > 1:
+                self.names.aliases.append(bound)
+        self.generic_visit(node)
+
+    def visit_AugAssign(self, node):
+        self.mutate(node.target)
+        if isinstance(node.target, ast.Name):
+            self.names.uses.add(node.target.id)
+        self.generic_visit(node)
+
+    def visit_Expr(self, node):
+        if isinstance(node.value, ast.Call) and isinstance(node.value.func, ast.Attribute):
+            self.mutate(node.value.func.value)
+        self.generic_visit(node)
+
+    def visit_Call(self, node):
+        builtin = node.func.id if isinstance(node.func, ast.Name) else None
+        if builtin in OPAQUE_CALLS:
+            self.names.opaque = True
+        # shuffle(xs) or model.fit(data) can change the objects they get, calls inside functions
+        # only run when the function is called
+        if self.depth == 0 and builtin not in PURE_CALLS:
+            for argument in [*node.args, *(keyword.value for keyword in node.keywords)]:
+                if isinstance(argument, ast.Starred):
+                    argument = argument.value
+                while isinstance(argument, (ast.Attribute, ast.Subscript)):
+                    argument = argument.value
+                if isinstance(argument, ast.Name):
+                    self.names.mutates.add(argument.id)
+                    self.names.uses.add(argument.id)
+        self.generic_visit(node)
+
+    def visit_Import(self, node):
+        for alias in node.names:
+            if alias.name == "*":
+                self.names.opaque = True
+            else:
+                name = alias.asname or alias.name.split(".")[0]
+                self.define(name)
+                self.names.imports.add(name)
+
+    visit_ImportFrom = visit_Import
+
+    def visit_ExceptHandler(self, node):
+        if node.name is not None:
+            self.define(node.name)
+        self.generic_visit(node)
+
+    visit_MatchAs = visit_ExceptHandler
+    visit_MatchStar = visit_ExceptHandler
+
+    def visit_Global(self, node):
+        self.names.defines.update(node.names)
+
+    visit_Nonlocal = visit_Global
+
+    def visit_NamedExpr(self, node):
+        # the target of := binds in the enclosing scope, even inside a comprehension
+        self.names.defines.add(node.target.id)
+        self.visit(node.value)
+
+    def _visit_scope(self, node, name=None):
+        if name is not None:
+            self.define(name)
+        for decorator in getattr(node, "decorator_list", []):
+            self.visit(decorator)
+        self.depth += 1
+        for field, value in ast.iter_fields(node):
+            if field == "decorator_list":
+                continue
+            for child in value if isinstance(value, list) else [value]:
+                if isinstance(child, ast.AST):
+                    self.visit(child)
+        self.depth -= 1
+
+    def visit_FunctionDef(self, node):
+        if self.depth == 0:
+            self.names.functions[node.name] = _reads(node)
+        self._visit_scope(node, node.name)
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+    visit_ClassDef = visit_FunctionDef
+
+    def visit_Lambda(self, node):
+        self._visit_scope(node)
+
+    visit_ListComp = visit_Lambda
+    visit_SetComp = visit_Lambda
+    visit_DictComp = visit_Lambda
+    visit_GeneratorExp = visit_Lambda
+
+
+def _reads(node) -> Set[str]:
+    loaded, bound, declared = set(), set(), set()
+    for child in ast.walk(node):
+        if isinstance(child, ast.Name):
+            (loaded if isinstance(child.ctx, ast.Load) else bound).add(child.id)
+        elif isinstance(child, ast.arg):
+            bound.add(child.arg)
+        elif isinstance(child, (ast.Global, ast.Nonlocal)):
+            declared.update(child.names)
+    return loaded - (bound - declared)
+
+
+def is_executable(cell) -> bool:
+    return cell["cell_type"] == "code" and bool(cell["source"].strip())
+
+
+def cell_names(source: str) -> CellNames:
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        # magics and shell commands are not python, so nothing is known about them
+        return CellNames(opaque=True)
+    collector = _NameCollector()
+    collector.visit(tree)
+    return collector.names
+
+
+def modules(names: Dict[int, CellNames]) -> Set[str]:
+    # imported names that are never bound to anything else
+    imported = set().union(*(cell.imports for cell in names.values()))
+    assigned = set().union(*(cell.defines - cell.imports - cell.mutates for cell in names.values()))
+    return imported - assigned
+
+
+def _function_reads(names: Dict[int, CellNames]) -> Dict[str, Set[str]]:
+    reads: Dict[str, Set[str]] = {}
+    for cell in names.values():
+        for function, used in cell.functions.items():
+            reads.setdefault(function, set()).update(used)
+    # a function also reads what the functions it calls read
+    changed = True
+    while changed:
+        changed = False
+        for used in reads.values():
+            called = set().union(*(reads[function] for function in used & reads.keys()))
+            if not called <= used:
+                used |= called
+                changed = True
+    return reads
+
+
+def _alias_groups(names: Dict[int, CellNames]) -> Dict[str, Set[str]]:
+    groups: Dict[str, Set[str]] = {}
+    for cell in names.values():
+        for bound in cell.aliases:
+            group = set(bound).union(*(groups.get(name, set()) for name in bound))
+            for name in group:
+                groups[name] = group
+    return groups
+
+
+def analyze(cells) -> Dict[int, CellNames]:
+    names = {i: cell_names(cell["source"]) for i, cell in enumerate(cells) if is_executable(cell)}
+    reads = _function_reads(names)
+    groups = _alias_groups(names)
+    for cell in names.values():
+        # calling a function of the notebook reads the globals it reads when it runs
+        for function in cell.uses & reads.keys():
+            cell.uses |= reads[function]
+        # changing an object changes it under every name bound to it
+        for name in cell.mutates & groups.keys():
+            cell.mutates |= groups[name]
+        cell.uses |= cell.mutates
+        cell.defines |= cell.mutates
+    changed_modules = modules(names) & set().union(*(cell.mutates for cell in names.values()))
+    for cell in names.values():
+        cell.main_only = bool(
+            (cell.uses | cell.defines) & changed_modules or cell.defines & groups.keys()
+        )
+    return names
+
+
+def dependencies(names: Dict[int, CellNames]) -> Dict[int, Set[int]]:
+    graph: Dict[int, Set[int]] = {}
+    for index, current in names.items():
+        graph[index] = {
+            earlier
+            for earlier, previous in names.items()
+            if earlier < index
+            and (
+                previous.opaque
+                or current.opaque
+                or previous.defines & (current.uses | current.defines)
+                or previous.uses & current.defines
+            )
+        }
+    return graph
+
+
+def data_dependencies(names: Dict[int, CellNames]) -> Dict[int, Set[int]]:
+    # only the cells whose names are read are needed, a cell that overwrites a name does not need
+    # the cells that defined it before
+    return {
+        index: {
+            earlier
+            for earlier, previous in names.items()
+            if earlier < index
+            and (previous.opaque or current.opaque or previous.defines & current.uses)
+        }
+        for index, current in names.items()
+    }
+
+
+def upstream(graph: Dict[int, Set[int]], targets: Set[int]) -> Set[int]:
+    selected: Set[int] = set()
+    pending = list(targets)
+    while pending:
+        index = pending.pop()
+        if index not in selected:
+            selected.add(index)
+            pending.extend(graph[index])
+    return selected
+
+
+def affected(names: Dict[int, CellNames], entries: Dict[str, int]) -> Set[int]:
+    tainted: Set[str] = set()
+    cells: Set[int] = set()
+    anything = False
+    for index, current in sorted(names.items()):
+        entering = {name for name, entry in entries.items() if entry == index}
+        tainted |= entering
+        reads_changed = (
+            anything or bool(current.uses & tainted) or (current.opaque and bool(tainted))
+        )
+        if entering or reads_changed:
+            cells.add(index)
+        # the other names assigned where a parameter enters only change if they read a changed one
+        if reads_changed:
+            tainted |= current.defines
+            # a cell that can change any name leaves every later cell affected
+            anything = anything or current.opaque
+    return cells
+
+
+def waves(graph: Dict[int, Set[int]], max_width: int) -> List[List[int]]:
+    done: Set[int] = set()
+    remaining = sorted(graph)
+    schedule = []
+    while remaining:
+        ready = [index for index in remaining if graph[index] <= done][:max_width]
+        schedule.append(ready)
+        done.update(ready)
+        remaining = [index for index in remaining if index not in done]
+    return schedule
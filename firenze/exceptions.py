@@ -1,2 +1,14 @@
 class VariableAssignmentError(Exception):
     pass
+
+
+class KernelStateError(Exception):
+    pass
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class ResourceLimitError(Exception):
+    pass
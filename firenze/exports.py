@@ -0,0 +1,66 @@
+import io
+import json
+import os
+import pathlib
+import pickle
+import tempfile
+from typing import Any, Dict, List
+
+from firenze import kernel_state, s3
+from firenze.cache import cache_store
+from firenze.dependencies import analyze, modules
+
+EXPORT_TAG = "export"
+
+
+class Exports:
+    def __init__(self, store, path: str):
+        self.store = store
+        self.path = str(path).rstrip("/")
+        self.artifacts: Dict[str, str] = {}
+
+    @classmethod
+    def from_path(cls, path: str) -> "Exports":
+        return cls(cache_store(path), path)
+
+    @staticmethod
+    def names(cells) -> List[str]:
+        # every name defined by a cell tagged for export, except modules
+        names = analyze(cells)
+        imported = modules(names)
+        return sorted(
+            name
+            for index, cell in names.items()
+            if EXPORT_TAG in cells[index]["metadata"].get("tags", [])
+            for name in cell.defines - cell.imports - imported
+        )
+
+    async def save(self, client, cells) -> Dict[str, str]:
+        names = self.names(cells)
+        if not names:
+            return self.artifacts
+        with tempfile.TemporaryDirectory() as directory:
+            files = await kernel_state.export(client, names, directory)
+            for name, file_name in files.items():
+                self.store.put(file_name, pathlib.Path(directory, file_name).read_bytes())
+                self.artifacts[name] = f"{self.path}/{file_name}"
+        return self.artifacts
+
+
+def load(path: str) -> Any:
+    data = s3.shared().read(path) if path.startswith("s3://") else pathlib.Path(path).read_bytes()
+    extension = os.path.splitext(path)[1]
+    if extension == ".json":
+        return json.loads(data)
+    if extension == ".npz":
+        import numpy
+
+        return numpy.load(io.BytesIO(data))["value"]
+    if extension == ".arrow":
+        import pyarrow
+        import pyarrow.feather
+
+        table = pyarrow.feather.read_table(pyarrow.BufferReader(data))
+        # tables that came from pandas come back as the same DataFrame
+        return table.to_pandas() if table.schema.pandas_metadata else table
+    return pickle.loads(data)
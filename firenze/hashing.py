@@ -0,0 +1,9 @@
+import hashlib
+import json
+
+
+def digest(*objects) -> str:
+    sha = hashlib.sha256()
+    for obj in objects:
+        sha.update(json.dumps(obj, sort_keys=True, default=repr).encode("utf_8"))
+    return sha.hexdigest()
@@ -0,0 +1,93 @@
+import asyncio
+import collections
+import json
+import logging
+import multiprocessing
+import uuid
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional, Tuple
+
+import nbformat
+
+from firenze import rendering
+from firenze.notebook import Notebook
+
+# notebooks rendered by this worker process, kept so unchanged cells are not rendered again
+MAX_NOTEBOOKS = 4
+_notebooks: "collections.OrderedDict[str, Notebook]" = collections.OrderedDict()
+
+
+def render(key: str, snapshot: str, file_path: str, threshold, assets_path) -> str:
+    jupyter_notebook = nbformat.from_dict(json.loads(snapshot))
+    notebook = _notebooks.pop(key, None)
+    if notebook is None:
+        notebook = Notebook(jupyter_notebook)
+    notebook.jupyter_notebook = jupyter_notebook
+    _notebooks[key] = notebook
+    while len(_notebooks) > MAX_NOTEBOOKS:
+        _notebooks.popitem(last=False)
+    notebook.externalize_assets(threshold, assets_path)
+    return notebook.html_for(file_path)
+
+
+def process_pool() -> Executor:
+    try:
+        # spawned rather than forked, as the parent process runs an event loop and threads
+        return ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn"))
+    except (OSError, NotImplementedError) as e:
+        logging.warning(f"Cannot start a process to render the HTML, using a thread: {e}")
+        return ThreadPoolExecutor(1, thread_name_prefix="firenze-html")
+
+
+class BackgroundHTMLWriter:
+    def __init__(self, notebook: Notebook, executor: Optional[Executor] = None):
+        self.notebook = notebook
+        self._owns_executor = executor is None
+        self.executor = executor if executor is not None else process_pool()
+        self._key = uuid.uuid4().hex
+        self._pending: Optional[Tuple[str, str]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def __aenter__(self):
+        # the process starts and loads nbconvert while the kernel starts
+        self.executor.submit(rendering.load_exporters)
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        try:
+            await self.flush()
+        finally:
+            if self._owns_executor:
+                self.executor.shutdown()
+
+    def submit(self, file_path: str):
+        # only the newest snapshot waits for the render in flight, older ones are dropped
+        self._pending = (str(file_path), json.dumps(self.notebook.jupyter_notebook))
+        if self._task is None or self._task.done():
+            if self._task is not None and not self._task.cancelled() and self._task.exception():
+                logging.warning(f"Could not write the HTML: {self._task.exception()}")
+            self._task = asyncio.create_task(self._drain())
+
+    async def flush(self):
+        if self._task is not None:
+            await self._task
+
+    async def write(self, file_path: str):
+        self.submit(file_path)
+        await self.flush()
+
+    async def _drain(self):
+        loop = asyncio.get_running_loop()
+        while self._pending is not None:
+            file_path, snapshot = self._pending
+            self._pending = None
+            html = await loop.run_in_executor(
+                self.executor,
+                render,
+                self._key,
+                snapshot,
+                file_path,
+                self.notebook.external_assets_threshold,
+                self.notebook.assets_path,
+            )
+            await self.notebook.async_save_output(file_path, html)
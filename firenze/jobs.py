@@ -0,0 +1,427 @@
+import asyncio
+import contextlib
+import dataclasses
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import signal
+import socket
+import sqlite3
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from firenze import s3
+from firenze.notebook import Notebook
+from firenze.sources import SourceCache
+
+JOB_STATUSES = ("queued", "running", "ok", "failed")
+FINISHED_STATUSES = ("ok", "failed")
+
+
+@dataclasses.dataclass
+class Job:
+    notebook_path: str
+    output_html_path: str
+    parameters: Dict[str, Any] = dataclasses.field(default_factory=dict)
+    output_notebook_path: Optional[str] = None
+    max_attempts: int = 3
+    id: str = dataclasses.field(default_factory=lambda: uuid.uuid4().hex)
+    status: str = "queued"
+    attempts: int = 0
+    worker: Optional[str] = None
+    error: Optional[str] = None
+    submitted_at: float = dataclasses.field(default_factory=time.time)
+    started_at: Optional[float] = None
+    heartbeat_at: Optional[float] = None
+    lease_expires_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    elapsed: Optional[float] = None
+
+
+# every store keeps one document per job and only replaces it if nobody changed it since it was
+# read, which is all the queue needs to hand each job to a single worker. finished jobs move to a
+# separate store, so workers looking for jobs only read the ones they could take
+
+
+class SQLiteJobStore:
+    def __init__(self, path, table: str = "jobs"):
+        self.path = str(path)
+        self.table = table
+        self._execute(
+            f"CREATE TABLE IF NOT EXISTS {table} "
+            "(name TEXT PRIMARY KEY, data BLOB NOT NULL, version INTEGER NOT NULL)"
+        )
+
+    def finished(self) -> "SQLiteJobStore":
+        return SQLiteJobStore(self.path, f"finished_{self.table}")
+
+    def _execute(self, sql: str, *parameters):
+        with contextlib.closing(sqlite3.connect(self.path, timeout=30)) as connection:
+            with connection:
+                cursor = connection.execute(sql, parameters)
+                return cursor.fetchall(), cursor.rowcount
+
+    def names(self) -> List[str]:
+        rows, _ = self._execute(f"SELECT name FROM {self.table} ORDER BY name")
+        return [name for name, in rows]
+
+    def read(self, name: str):
+        rows, _ = self._execute(f"SELECT data, version FROM {self.table} WHERE name = ?", name)
+        return (bytes(rows[0][0]), rows[0][1]) if rows else None
+
+    def create(self, name: str, data: bytes):
+        _, count = self._execute(
+            f"INSERT OR IGNORE INTO {self.table} (name, data, version) VALUES (?, ?, 0)", name, data
+        )
+        return 0 if count == 1 else None
+
+    def replace(self, name: str, data: bytes, version):
+        _, count = self._execute(
+            f"UPDATE {self.table} SET data = ?, version = version + 1 "
+            "WHERE name = ? AND version = ?",
+            data,
+            name,
+            version,
+        )
+        return version + 1 if count == 1 else None
+
+    def delete(self, name: str):
+        self._execute(f"DELETE FROM {self.table} WHERE name = ?", name)
+
+
+class DirectoryJobStore:
+    def __init__(self, directory):
+        self.directory = pathlib.Path(directory)
+
+    def finished(self) -> "DirectoryJobStore":
+        return DirectoryJobStore(self.directory / "finished")
+
+    @contextlib.contextmanager
+    def _locked(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # only directory queues lock, and fcntl only exists on unix
+        import fcntl
+
+        with open(self.directory / ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def names(self) -> List[str]:
+        return sorted(path.name for path in self.directory.glob("*.json"))
+
+    def read(self, name: str):
+        try:
+            data = (self.directory / name).read_bytes()
+        except FileNotFoundError:
+            return None
+        return data, hashlib.sha256(data).hexdigest()
+
+    def create(self, name: str, data: bytes):
+        with self._locked():
+            if (self.directory / name).exists():
+                return None
+            return self._write(name, data)
+
+    def replace(self, name: str, data: bytes, version):
+        with self._locked():
+            current = self.read(name)
+            if current is None or current[1] != version:
+                return None
+            return self._write(name, data)
+
+    def delete(self, name: str):
+        with self._locked():
+            (self.directory / name).unlink(missing_ok=True)
+
+    def _write(self, name: str, data: bytes) -> str:
+        # readers never take the lock, so they must never see a half written file
+        temporary = self.directory / f".{name}.tmp"
+        temporary.write_bytes(data)
+        os.replace(temporary, self.directory / name)
+        return hashlib.sha256(data).hexdigest()
+
+
+class S3JobStore:
+    def __init__(self, s3_prefix: str, s3_client=None):
+        self.bucket, _, prefix = s3_prefix.replace("s3://", "").partition("/")
+        self.prefix = prefix.rstrip("/")
+        self.s3_client = s3_client if s3_client is not None else s3.shared().client
+
+    def finished(self) -> "S3JobStore":
+        return S3JobStore(f"s3://{self.bucket}/{self._key('finished')}", self.s3_client)
+
+    def _key(self, name: str) -> str:
+        return f"{self.prefix}/{name}" if self.prefix else name
+
+    def names(self) -> List[str]:
+        prefix = self._key("")
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        return sorted(
+            entry["Key"].removeprefix(prefix)
+            # the delimiter leaves out the finished jobs below the prefix
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix, Delimiter="/")
+            for entry in page.get("Contents", [])
+            if entry["Key"].endswith(".json")
+        )
+
+    def read(self, name: str):
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=self._key(name))
+        except self.s3_client.exceptions.NoSuchKey:
+            return None
+        return response["Body"].read(), response["ETag"]
+
+    def create(self, name: str, data: bytes):
+        return self._put(name, data, IfNoneMatch="*")
+
+    def replace(self, name: str, data: bytes, version):
+        return self._put(name, data, IfMatch=version)
+
+    def delete(self, name: str):
+        self.s3_client.delete_object(Bucket=self.bucket, Key=self._key(name))
+
+    def _put(self, name: str, data: bytes, **condition):
+        try:
+            response = self.s3_client.put_object(
+                Bucket=self.bucket, Key=self._key(name), Body=data, **condition
+            )
+        except self.s3_client.exceptions.ClientError as e:
+            if e.response["Error"]["Code"] in ("PreconditionFailed", "ConditionalRequestConflict"):
+                return None
+            raise
+        return response["ETag"]
+
+
+def job_store(path: str):
+    if str(path).startswith("s3://"):
+        return S3JobStore(path)
+    if pathlib.Path(path).suffix in (".db", ".sqlite", ".sqlite3"):
+        return SQLiteJobStore(path)
+    return DirectoryJobStore(path)
+
+
+class JobQueue:
+    def __init__(self, store):
+        self.store = store
+        self.finished = store.finished()
+        self._versions: Dict[str, Any] = {}
+
+    def submit(self, job: Job):
+        version = self.store.create(f"{job.id}.json", self._encode(job))
+        if version is None:
+            raise ValueError(f"Job {job.id} already exists")
+        self._versions[job.id] = version
+
+    def get(self, job_id: str) -> Optional[Job]:
+        job = self._read(f"{job_id}.json")
+        return job if job is not None else self._read(f"{job_id}.json", self.finished)
+
+    def jobs(self) -> List[Job]:
+        # a job that is being moved to the finished store can be in both
+        jobs = {job.id: job for store in (self.store, self.finished) for job in self._jobs(store)}
+        return sorted(jobs.values(), key=lambda job: job.submitted_at)
+
+    def claim(self, worker: str, lease_timeout: float) -> Optional[Job]:
+        now = time.time()
+        for job in sorted(self._jobs(self.store), key=lambda job: job.submitted_at):
+            if job.status in FINISHED_STATUSES:
+                # its worker stopped before moving it
+                self._move_finished(job)
+                continue
+            if job.status == "running" and job.lease_expires_at < now:
+                # the worker running it stopped sending heartbeats
+                if job.attempts >= job.max_attempts:
+                    job.status = "failed"
+                    job.error = f"The lease of {job.worker} expired"
+                    job.finished_at = now
+                    if self._update(job):
+                        self._move_finished(job)
+                    continue
+                logging.warning(f"The lease of {job.worker} on job {job.id} expired, retrying it")
+            elif job.status != "queued":
+                continue
+            job.status = "running"
+            job.worker = worker
+            job.attempts += 1
+            job.started_at = job.heartbeat_at = now
+            job.lease_expires_at = now + lease_timeout
+            if self._update(job):
+                return job
+        return None
+
+    def heartbeat(self, job: Job, lease_timeout: float) -> bool:
+        job.heartbeat_at = time.time()
+        job.lease_expires_at = job.heartbeat_at + lease_timeout
+        return self._update(job)
+
+    def finish(self, job: Job, error: Optional[str] = None) -> bool:
+        job.finished_at = time.time()
+        job.elapsed = job.finished_at - job.started_at
+        job.lease_expires_at = None
+        job.error = error
+        if error is None:
+            job.status = "ok"
+        else:
+            job.status = "queued" if job.attempts < job.max_attempts else "failed"
+        if not self._update(job):
+            return False
+        if job.status in FINISHED_STATUSES:
+            self._move_finished(job)
+        return True
+
+    def release(self, job: Job) -> bool:
+        # a worker that is stopped does not spend one of the attempts of its job
+        job.status = "queued"
+        job.attempts -= 1
+        job.worker = job.lease_expires_at = None
+        return self._update(job)
+
+    def _jobs(self, store) -> List[Job]:
+        jobs = [self._read(name, store) for name in store.names()]
+        return [job for job in jobs if job is not None]
+
+    def _move_finished(self, job: Job):
+        # finished jobs never change, so a copy left by an interrupted move is the same job
+        name = f"{job.id}.json"
+        self.finished.create(name, self._encode(job))
+        self.store.delete(name)
+
+    def _read(self, name: str, store=None) -> Optional[Job]:
+        entry = (store if store is not None else self.store).read(name)
+        if entry is None:
+            return None
+        data, version = entry
+        job = Job(**json.loads(data))
+        self._versions[job.id] = version
+        return job
+
+    def _update(self, job: Job) -> bool:
+        version = self.store.replace(
+            f"{job.id}.json", self._encode(job), self._versions.get(job.id)
+        )
+        if version is None:
+            return False
+        self._versions[job.id] = version
+        return True
+
+    @staticmethod
+    def _encode(job: Job) -> bytes:
+        return json.dumps(dataclasses.asdict(job)).encode("utf_8")
+
+
+class Worker:
+    def __init__(
+        self,
+        queue: JobQueue,
+        name: Optional[str] = None,
+        lease_timeout: float = 300,
+        poll_interval: float = 5,
+        handle_signals: bool = False,
+        source_cache: Optional[SourceCache] = None,
+    ):
+        self.queue = queue
+        self.name = name if name is not None else f"{socket.gethostname()}-{os.getpid()}"
+        self.lease_timeout = lease_timeout
+        self.poll_interval = poll_interval
+        self._stopping = False
+        self._stop_requested: Optional[asyncio.Event] = None
+        self._execution: Optional[asyncio.Task] = None
+        self.handle_signals = handle_signals
+        self.source_cache = source_cache
+
+    def stop(self):
+        # the running job goes back to the queue, for this or another worker to run it again
+        self._stopping = True
+        if self._stop_requested is not None:
+            self._stop_requested.set()
+        if self._execution is not None:
+            self._execution.cancel()
+
+    async def run(self, max_jobs: Optional[int] = None, exit_when_empty: bool = False) -> int:
+        self._stop_requested = asyncio.Event()
+        processed = 0
+        while not self._stopping and (max_jobs is None or processed < max_jobs):
+            self._install_signal_handlers()
+            job = await asyncio.to_thread(self.queue.claim, self.name, self.lease_timeout)
+            if job is None:
+                if exit_when_empty:
+                    break
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._stop_requested.wait(), self.poll_interval)
+                continue
+            await self.process(job)
+            processed += 1
+        return processed
+
+    async def process(self, job: Job):
+        logging.info(
+            f"{self.name} started job {job.id}: {job.notebook_path} "
+            f"(attempt {job.attempts}/{job.max_attempts})"
+        )
+        self._execution = asyncio.create_task(self.execute(job))
+        finished = asyncio.Event()
+        lease_lost = asyncio.Event()
+        heartbeat = asyncio.create_task(self._heartbeat(job, self._execution, finished, lease_lost))
+        error = None
+        try:
+            await self._execution
+        except asyncio.CancelledError:
+            if not lease_lost.is_set():
+                self.stop()
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        finally:
+            self._execution = None
+        finished.set()
+        await heartbeat
+        if lease_lost.is_set():
+            logging.warning(f"{self.name} lost the lease on job {job.id}, another worker has it")
+        elif self._stopping:
+            # a cancelled execution may fail with any error, which is not the job's fault
+            await asyncio.to_thread(self.queue.release, job)
+            logging.info(f"{self.name} stopped, job {job.id} is back in the queue")
+        elif not await asyncio.to_thread(self.queue.finish, job, error):
+            logging.warning(f"{self.name} lost the lease on job {job.id}, another worker has it")
+        else:
+            logging.info(f"Job {job.id} {job.status} in {job.elapsed:0.1f} seconds")
+
+    async def execute(self, job: Job):
+        notebook = await asyncio.to_thread(
+            Notebook.from_path, job.notebook_path, source_cache=self.source_cache
+        )
+        notebook.name = f"Job {job.id}"
+        notebook.client.on_notebook_start = self._install_signal_handlers
+        notebook.clean()
+        try:
+            notebook.set_parameters(**job.parameters)
+            await notebook.async_execute()
+        except Exception:
+            await self._write(notebook, job)
+            raise
+        await self._write(notebook, job)
+
+    def _install_signal_handlers(self, **kwargs):
+        # nbclient replaces the handlers while a kernel is running and removes them afterwards
+        if self.handle_signals:
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                asyncio.get_running_loop().add_signal_handler(signum, self.stop)
+
+    @staticmethod
+    async def _write(notebook: Notebook, job: Job):
+        await notebook.async_write_html(job.output_html_path)
+        if job.output_notebook_path:
+            await notebook.async_save_notebook(job.output_notebook_path)
+
+    async def _heartbeat(self, job, execution, finished, lease_lost):
+        # heartbeats stop before the job is finished, so both never update it at the same time
+        while not finished.is_set():
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(finished.wait(), timeout=self.lease_timeout / 3)
+                return
+            if not await asyncio.to_thread(self.queue.heartbeat, job, self.lease_timeout):
+                lease_lost.set()
+                execution.cancel()
+                return
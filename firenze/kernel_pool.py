@@ -0,0 +1,323 @@
+import asyncio
+import contextlib
+import getpass
+import json
+import logging
+import os
+import socket
+import tempfile
+from typing import TYPE_CHECKING, Dict, Optional, Set
+
+from firenze.limits import kernel_pid
+
+if TYPE_CHECKING:
+    from jupyter_client import AsyncKernelClient, AsyncKernelManager
+
+# one pool per user, windows has no user ids
+_USER = os.getuid() if hasattr(os, "getuid") else getpass.getuser()
+DEFAULT_SOCKET_PATH = os.path.join(tempfile.gettempdir(), f"firenze-pool-{_USER}.sock")
+# seconds between checks that a leased kernel is still alive
+LEASE_CHECK_INTERVAL = 1.0
+# a kernel that cannot be replaced is tried again after 1, 2, 4... seconds before its slot is lost
+REPLACE_ATTEMPTS = 4
+REPLACE_BACKOFF = 1.0
+
+
+class PooledKernel:
+    def __init__(self, km: "AsyncKernelManager"):
+        self.km = km
+        self.uses = 0
+
+
+class KernelPool:
+    def __init__(
+        self,
+        size: int = 4,
+        max_uses: int = 20,
+        kernel_name: str = "python3",
+        startup_timeout: float = 60,
+        health_check_interval: Optional[float] = 30,
+        health_check_timeout: float = 10,
+    ):
+        self.size = size
+        self.max_uses = max_uses
+        self.kernel_name = kernel_name
+        self.startup_timeout = startup_timeout
+        self.health_check_interval = health_check_interval
+        self.health_check_timeout = health_check_timeout
+        self._ready: Optional[asyncio.Queue] = None
+        # slots whose kernel could be replaced, the pool fails when none is left
+        self._slots = size
+        self._kernels: Set[PooledKernel] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def start(self):
+        self._ready = asyncio.Queue()
+        await asyncio.gather(*(self._add_kernel() for _ in range(self.size)))
+        if self.health_check_interval:
+            self._spawn(self._health_check_loop())
+
+    async def close(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await asyncio.gather(
+            *(self._retire(kernel) for kernel in list(self._kernels)), return_exceptions=True
+        )
+
+    async def acquire(self, cwd: Optional[str] = None) -> PooledKernel:
+        assert self._ready is not None, "KernelPool must be started before acquiring kernels"
+        while True:
+            if not self._slots:
+                raise RuntimeError(f"No kernel {self.kernel_name} could be started for the pool")
+            kernel = await self._ready.get()
+            if kernel is None:
+                # the last slot was lost, the other waiting acquires need to see it too
+                self._ready.put_nowait(None)
+                continue
+            if await kernel.km.is_alive():
+                break
+            logging.warning("Discarding dead kernel from the pool")
+            self._spawn(self._replace(kernel))
+        kernel.uses += 1
+        if cwd is not None:
+            await self._change_directory(kernel, cwd)
+        return kernel
+
+    def release(self, kernel: PooledKernel):
+        self._spawn(self._recycle(kernel))
+
+    @contextlib.asynccontextmanager
+    async def kernel(self, cwd: Optional[str] = None):
+        kernel = await self.acquire(cwd)
+        try:
+            yield kernel.km
+        finally:
+            self.release(kernel)
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        task.add_done_callback(_log_failure)
+
+    async def _add_kernel(self):
+        from jupyter_client import AsyncKernelManager
+
+        km = AsyncKernelManager(kernel_name=self.kernel_name)
+        await km.start_kernel(extra_arguments=["--HistoryManager.hist_file=:memory:"])
+        kernel = PooledKernel(km)
+        self._kernels.add(kernel)
+        if not await self._is_healthy(kernel, self.startup_timeout):
+            await self._retire(kernel)
+            raise RuntimeError(f"Kernel {self.kernel_name} did not become ready")
+        await self._ready.put(kernel)
+
+    async def _retire(self, kernel: PooledKernel):
+        self._kernels.discard(kernel)
+        if await kernel.km.is_alive():
+            await kernel.km.shutdown_kernel(now=True)
+        await kernel.km.cleanup_resources()
+
+    async def _replace(self, kernel: PooledKernel):
+        await self._retire(kernel)
+        for attempt in range(REPLACE_ATTEMPTS):
+            try:
+                await self._add_kernel()
+                return
+            except Exception as e:
+                error = e
+                logging.warning(f"Could not replace a kernel of the pool: {e!r}")
+            if attempt + 1 < REPLACE_ATTEMPTS:
+                await asyncio.sleep(REPLACE_BACKOFF * 2**attempt)
+        self._slots -= 1
+        if not self._slots:
+            self._ready.put_nowait(None)
+        raise error
+
+    async def _recycle(self, kernel: PooledKernel):
+        if kernel.uses >= self.max_uses or not await kernel.km.is_alive():
+            await self._replace(kernel)
+            return
+        try:
+            await kernel.km.restart_kernel(now=True)
+            healthy = await self._is_healthy(kernel, self.startup_timeout)
+        except Exception as e:
+            logging.warning(f"Could not restart a kernel of the pool: {e!r}")
+            healthy = False
+        if healthy:
+            await self._ready.put(kernel)
+        else:
+            await self._replace(kernel)
+
+    async def _is_healthy(self, kernel: PooledKernel, timeout: float) -> bool:
+        kc = kernel.km.client()
+        kc.start_channels()
+        try:
+            await kc.wait_for_ready(timeout=timeout)
+            return True
+        except RuntimeError:
+            return False
+        finally:
+            kc.stop_channels()
+
+    async def _health_check_loop(self):
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            idle = []
+            while not self._ready.empty():
+                idle.append(self._ready.get_nowait())
+            for kernel in idle:
+                if await self._is_healthy(kernel, self.health_check_timeout):
+                    await self._ready.put(kernel)
+                else:
+                    logging.warning("Replacing unresponsive kernel in the pool")
+                    self._spawn(self._replace(kernel))
+
+    async def _change_directory(self, kernel: PooledKernel, cwd: str):
+        kc = kernel.km.client()
+        kc.start_channels()
+        try:
+            await kc.wait_for_ready(timeout=self.startup_timeout)
+            await kc.execute_interactive(
+                f"__import__('os').chdir({cwd!r})",
+                silent=True,
+                store_history=False,
+                timeout=self.startup_timeout,
+            )
+        finally:
+            kc.stop_channels()
+
+
+def _log_failure(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        logging.error(f"Kernel pool task failed: {task.exception()!r}")
+
+
+def connection_info(km) -> Dict:
+    return {
+        key: value.decode() if isinstance(value, bytes) else value
+        for key, value in km.get_connection_info().items()
+    }
+
+
+async def serve(pool: KernelPool, socket_path: str = DEFAULT_SOCKET_PATH):
+    async def watch(kernel: PooledKernel, writer):
+        # closing the lease is how a client learns that its kernel died
+        while await kernel.km.is_alive():
+            await asyncio.sleep(LEASE_CHECK_INTERVAL)
+        logging.warning("A leased kernel died, closing its lease")
+        writer.close()
+
+    async def lease(reader, writer):
+        kernel = None
+        watcher = None
+        try:
+            line = await reader.readline()
+            if not line:
+                # availability checks connect and leave without asking for a kernel
+                return
+            request = json.loads(line)
+            try:
+                kernel = await pool.acquire(cwd=request.get("cwd"))
+            except RuntimeError as e:
+                # closing the connection without a response tells the client
+                logging.error(f"Could not lease a kernel: {e}")
+                return
+            # the pid lets clients on the same host watch the memory of the kernel
+            response = {
+                "connection_info": connection_info(kernel.km),
+                "pid": kernel_pid(kernel.km),
+            }
+            writer.write(json.dumps(response).encode() + b"\n")
+            await writer.drain()
+            watcher = asyncio.create_task(watch(kernel, writer))
+            # the lease lasts as long as the connection is open
+            while line := await reader.readline():
+                if json.loads(line).get("op") == "interrupt":
+                    await kernel.km.interrupt_kernel()
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+            if kernel is not None:
+                pool.release(kernel)
+            writer.close()
+
+    server = await asyncio.start_unix_server(lease, path=socket_path)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(socket_path)
+
+
+class RemoteKernelManager:
+    has_kernel = True
+
+    def __init__(
+        self,
+        connection_info: Dict,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        pid: Optional[int] = None,
+    ):
+        self.connection_info = connection_info
+        self.reader = reader
+        self.writer = writer
+        self.pid = pid
+
+    def client(self) -> "AsyncKernelClient":
+        from jupyter_client import AsyncKernelClient
+
+        kc = AsyncKernelClient()
+        kc.load_connection_info(self.connection_info)
+        return kc
+
+    async def is_alive(self) -> bool:
+        # the daemon closes the lease when the kernel dies
+        return not self.writer.is_closing() and not self.reader.at_eof()
+
+    async def interrupt_kernel(self):
+        self.writer.write(json.dumps({"op": "interrupt"}).encode() + b"\n")
+        await self.writer.drain()
+
+
+class RemoteKernelPool:
+    def __init__(self, socket_path: str = DEFAULT_SOCKET_PATH):
+        self.socket_path = socket_path
+
+    def is_available(self) -> bool:
+        # a daemon that was killed leaves its socket behind, refusing connections
+        with socket.socket(socket.AF_UNIX) as probe:
+            try:
+                probe.connect(self.socket_path)
+            except OSError:
+                return False
+        return True
+
+    @contextlib.asynccontextmanager
+    async def kernel(self, cwd: Optional[str] = None):
+        reader, writer = await asyncio.open_unix_connection(self.socket_path)
+        try:
+            writer.write(json.dumps({"op": "acquire", "cwd": cwd}).encode() + b"\n")
+            await writer.drain()
+            line = await reader.readline()
+            if not line:
+                raise RuntimeError(
+                    f"The kernel pool at {self.socket_path} could not lease a kernel"
+                )
+            response = json.loads(line)
+            yield RemoteKernelManager(
+                response["connection_info"], reader, writer, response.get("pid")
+            )
+        finally:
+            writer.close()
+            await writer.wait_closed()
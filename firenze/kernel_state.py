@@ -0,0 +1,152 @@
+import ast
+import os
+import tempfile
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Tuple
+
+from firenze.exceptions import KernelStateError
+
+if TYPE_CHECKING:
+    from nbclient import NotebookClient
+
+# runs inside the kernel, skipping IPython's own history variables. cloudpickle, when available,
+# also serializes functions and classes defined in the notebook
+SNAPSHOT_CODE = r"""
+def __firenze_snapshot(path, names=None):
+    import pickle
+    import re
+    import types
+    try:
+        import cloudpickle as pickler
+    except ImportError:
+        pickler = pickle
+    ip = get_ipython()
+    hidden = set(ip.user_ns_hidden)
+    history = re.compile(r"_+|_i+\d*|_\d+|_[dio]h")
+    state, modules, skipped = {}, {}, []
+    for name, value in list(ip.user_ns.items()):
+        if name in hidden or name.startswith("__") or history.fullmatch(name):
+            continue
+        if names is not None and name not in names:
+            continue
+        if isinstance(value, types.ModuleType):
+            modules[name] = value.__name__
+            continue
+        try:
+            state[name] = pickler.dumps(value)
+        except Exception:
+            skipped.append(name)
+    with open(path, "wb") as f:
+        pickle.dump({"state": state, "modules": modules}, f)
+    return skipped
+"""
+
+RESTORE_CODE = """
+def __firenze_restore(path):
+    import importlib
+    import pickle
+    ip = get_ipython()
+    with open(path, "rb") as f:
+        snapshot = pickle.load(f)
+    for name, module in snapshot["modules"].items():
+        ip.user_ns[name] = importlib.import_module(module)
+    skipped = []
+    for name, value in snapshot["state"].items():
+        try:
+            ip.user_ns[name] = pickle.loads(value)
+        except Exception:
+            skipped.append(name)
+    return skipped
+"""
+
+# runs inside the kernel. tables go to Arrow and arrays to npz only when their libraries are
+# there, anything else that is not JSON is pickled
+EXPORT_CODE = r"""
+def __firenze_export(directory, names):
+    import json
+    import os
+    import pickle
+    try:
+        import cloudpickle as pickler
+    except ImportError:
+        pickler = pickle
+    ip = get_ipython()
+    files = {}
+    for name in names:
+        if name not in ip.user_ns:
+            continue
+        value = ip.user_ns[name]
+        path = os.path.join(directory, name)
+        module = type(value).__module__.split(".")[0]
+        try:
+            if module in ("pandas", "pyarrow"):
+                import pyarrow
+                import pyarrow.feather
+                table = value if module == "pyarrow" else pyarrow.Table.from_pandas(value)
+                pyarrow.feather.write_feather(table, path + ".arrow")
+                files[name] = name + ".arrow"
+                continue
+            if module == "numpy" and type(value).__name__ == "ndarray":
+                import numpy
+                numpy.savez_compressed(path + ".npz", value=value)
+                files[name] = name + ".npz"
+                continue
+        except Exception:
+            pass
+        try:
+            data, extension = json.dumps(value).encode(), ".json"
+        except (TypeError, ValueError):
+            data, extension = pickler.dumps(value), ".pickle"
+        with open(path + extension, "wb") as f:
+            f.write(data)
+        files[name] = name + extension
+    return files
+"""
+
+
+async def run_silently(
+    client: "NotebookClient", code: str, user_expressions: Optional[Dict[str, str]] = None
+) -> Dict:
+    msg_id = client.kc.execute(
+        code, silent=True, store_history=False, user_expressions=user_expressions or {}
+    )
+    reply = await client.async_wait_for_reply(msg_id)
+    content = reply["content"]
+    if content["status"] != "ok":
+        raise KernelStateError(f"{content.get('ename')}: {content.get('evalue')}")
+    return content.get("user_expressions", {})
+
+
+async def _call(client: "NotebookClient", definition: str, call: str) -> Any:
+    await run_silently(client, definition)
+    result = (await run_silently(client, "", {"result": call}))["result"]
+    if result["status"] != "ok":
+        raise KernelStateError(f"{result.get('ename')}: {result.get('evalue')}")
+    return ast.literal_eval(result["data"]["text/plain"])
+
+
+async def snapshot(
+    client: "NotebookClient", names: Optional[Iterable[str]] = None
+) -> Tuple[bytes, List[str]]:
+    fd, path = tempfile.mkstemp(suffix=".pickle")
+    os.close(fd)
+    names = sorted(names) if names is not None else None
+    try:
+        skipped = await _call(client, SNAPSHOT_CODE, f"__firenze_snapshot({path!r}, {names!r})")
+        with open(path, "rb") as f:
+            return f.read(), skipped
+    finally:
+        os.remove(path)
+
+
+async def export(client: "NotebookClient", names: Iterable[str], directory: str) -> Dict[str, str]:
+    return await _call(client, EXPORT_CODE, f"__firenze_export({directory!r}, {sorted(names)!r})")
+
+
+async def restore(client: "NotebookClient", data: bytes) -> List[str]:
+    fd, path = tempfile.mkstemp(suffix=".pickle")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        return await _call(client, RESTORE_CODE, f"__firenze_restore({path!r})")
+    finally:
+        os.remove(path)
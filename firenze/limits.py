@@ -0,0 +1,185 @@
+import asyncio
+import contextlib
+import dataclasses
+import glob
+import html
+import inspect
+import logging
+import os
+import signal
+import time
+from typing import FrozenSet, List, Optional, Set, Tuple
+
+import nbformat
+
+from firenze.exceptions import ResourceLimitError
+
+# seconds an interrupted cell gets to stop before its kernel is killed
+INTERRUPT_GRACE = 5.0
+STYLE = (
+    ".firenze-breaches{margin:1em 0;padding:0.5em 1em;border:1px solid #c62828;"
+    "background:#ffebee;color:#b71c1c;font:13px sans-serif}"
+)
+
+
+@dataclasses.dataclass(frozen=True)
+class ResourceLimits:
+    cell_timeout: Optional[float] = None
+    run_timeout: Optional[float] = None
+    # bytes of memory the kernel and its subprocesses may use
+    max_memory: Optional[int] = None
+    cpus: Optional[FrozenSet[int]] = None
+    check_interval: float = 1.0
+
+
+class ResourceGuard:
+    def __init__(self, limits: ResourceLimits):
+        self.limits = limits
+        # the run timeout counts from when the run starts, queued time is not included
+        self.started = time.monotonic()
+        self._pinned: Set[int] = set()
+
+    async def watch(self, client, cell, index: int, execution):
+        task = asyncio.ensure_future(execution)
+        pid = kernel_pid(client.km)
+        self._pin(pid)
+        started = time.monotonic()
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=self._next_check(started))
+            if done:
+                return task.result()
+            breach = self._check(pid, started)
+            if breach is not None:
+                break
+        limit, message = breach
+        logging.error(f"Cell {index + 1}: {message}")
+        await self._stop(client, pid, task, kill=limit == "max_memory")
+        record(cell, limit, message)
+        raise ResourceLimitError(f"Cell {index + 1}: {message}")
+
+    def _next_check(self, started: float) -> float:
+        now = time.monotonic()
+        deadlines = [now + self.limits.check_interval]
+        if self.limits.cell_timeout is not None:
+            deadlines.append(started + self.limits.cell_timeout)
+        if self.limits.run_timeout is not None:
+            deadlines.append(self.started + self.limits.run_timeout)
+        return max(min(deadlines) - now, 0)
+
+    def _check(self, pid: Optional[int], started: float) -> Optional[Tuple[str, str]]:
+        now = time.monotonic()
+        cell_timeout, run_timeout = self.limits.cell_timeout, self.limits.run_timeout
+        if cell_timeout is not None and now - started >= cell_timeout:
+            return "cell_timeout", f"stopped after the cell timeout of {cell_timeout:g} seconds"
+        if run_timeout is not None and now - self.started >= run_timeout:
+            return "run_timeout", f"stopped after the run timeout of {run_timeout:g} seconds"
+        if self.limits.max_memory is not None and pid is not None:
+            usage = memory_usage(pid)
+            if usage is not None and usage > self.limits.max_memory:
+                return (
+                    "max_memory",
+                    f"kernel killed using {usage / 2**20:0.0f} MiB of memory, over the limit of "
+                    f"{self.limits.max_memory / 2**20:0.0f} MiB",
+                )
+        return None
+
+    def _pin(self, pid: Optional[int]):
+        if self.limits.cpus is None or pid is None or pid in self._pinned:
+            return
+        self._pinned.add(pid)
+        if not hasattr(os, "sched_setaffinity"):
+            logging.warning("Pinning kernels to CPUs is only supported on linux")
+            return
+        # processes the kernel starts later inherit the affinity
+        try:
+            os.sched_setaffinity(pid, self.limits.cpus)
+        except OSError as e:
+            logging.warning(f"Could not pin the kernel to CPUs {sorted(self.limits.cpus)}: {e}")
+
+    @staticmethod
+    async def _stop(client, pid: Optional[int], task: asyncio.Future, kill: bool):
+        if not kill:
+            with contextlib.suppress(Exception):
+                interrupted = client.km.interrupt_kernel()
+                if inspect.isawaitable(interrupted):
+                    await interrupted
+            done, _ = await asyncio.wait({task}, timeout=INTERRUPT_GRACE)
+            if done:
+                # the interrupted cell fails with a KeyboardInterrupt, the breach is what is raised
+                task.exception()
+                return
+        if pid is not None:
+            # the kernel is replaced when it goes back to a pool, or shut down with the run
+            kill_process_tree(pid)
+            # nbclient notices the dead kernel and stops its own tasks, cancelling would leak them
+            done, _ = await asyncio.wait({task}, timeout=INTERRUPT_GRACE)
+            if done:
+                task.exception()
+                return
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError, Exception):
+            await task
+
+
+def kernel_pid(km) -> Optional[int]:
+    # kernels leased from a pool daemon carry the pid it gave, local ones have a provisioner
+    if km is None:
+        return None
+    pid = getattr(km, "pid", None)
+    if pid is None:
+        pid = getattr(getattr(km, "provisioner", None), "pid", None)
+    return pid
+
+
+def process_tree(pid: int) -> List[int]:
+    pids, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        pids.append(current)
+        for children in glob.glob(f"/proc/{current}/task/*/children"):
+            with contextlib.suppress(OSError):
+                with open(children) as f:
+                    pending.extend(int(child) for child in f.read().split())
+    return pids
+
+
+def memory_usage(pid: int) -> Optional[int]:
+    # resident memory of the kernel and everything it started, from /proc, so only on linux
+    if not os.path.exists(f"/proc/{pid}/statm"):
+        return None
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    total = 0
+    for process in process_tree(pid):
+        with contextlib.suppress(OSError, IndexError, ValueError):
+            with open(f"/proc/{process}/statm") as f:
+                total += int(f.read().split()[1]) * page_size
+    return total
+
+
+def kill_process_tree(pid: int):
+    for process in reversed(process_tree(pid)):
+        with contextlib.suppress(ProcessLookupError, PermissionError):
+            os.kill(process, signal.SIGKILL)
+
+
+def record(cell, limit: str, message: str):
+    cell.setdefault("outputs", []).append(
+        nbformat.v4.new_output(
+            "error", ename="ResourceLimitError", evalue=message, traceback=[message]
+        )
+    )
+    cell["metadata"].setdefault("firenze", {})["breach"] = {"limit": limit, "message": message}
+
+
+def breaches_summary(cells) -> str:
+    items = []
+    for index, cell in enumerate(cells):
+        breach = cell.get("metadata", {}).get("firenze", {}).get("breach")
+        if breach is not None:
+            items.append(f"<li>Cell {index + 1}: {html.escape(breach['message'])}</li>")
+    if not items:
+        return ""
+    return (
+        f'<div class="firenze-breaches"><style>{STYLE}</style>'
+        f"<strong>Resource limits exceeded</strong><ul>{''.join(items)}</ul></div>"
+    )
@@ -0,0 +1,158 @@
+import ast
+import datetime
+import html
+import json
+import time
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from firenze import kernel_state
+from firenze.exceptions import KernelStateError
+
+if TYPE_CHECKING:
+    from nbclient import NotebookClient
+
+# runs inside the kernel. On linux the peak RSS is reset before every cell, elsewhere it is the
+# peak of the whole kernel process
+USAGE_CODE = r"""
+def __firenze_usage(reset):
+    import resource
+    import sys
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu_time = usage.ru_utime + usage.ru_stime + children.ru_utime + children.ru_stime
+    peak_rss = usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    peak_rss = int(line.split()[1]) * 1024
+        if reset:
+            with open("/proc/self/clear_refs", "w") as f:
+                f.write("5")
+    except OSError:
+        pass
+    return cpu_time, peak_rss
+"""
+
+COLUMNS = {
+    "cell": "Cell",
+    "wall_time": "Wall time (s)",
+    "queue_time": "Queued (s)",
+    "execution_time": "Executing (s)",
+    "cpu_time": "CPU time (s)",
+    "peak_rss": "Peak RSS (MB)",
+    "output_size": "Output size (kB)",
+}
+SCALES = {"peak_rss": 1024 * 1024, "output_size": 1024}
+
+STYLE = (
+    ".firenze-metrics table { border-collapse: collapse; margin: 1em 0; }"
+    ".firenze-metrics th { cursor: pointer; }"
+    ".firenze-metrics th, .firenze-metrics td { padding: 0.2em 0.8em; text-align: right; }"
+)
+SORT_SCRIPT = """
+document.querySelectorAll(".firenze-metrics th").forEach((th, column) => {
+  th.addEventListener("click", () => {
+    const body = th.closest("table").tBodies[0];
+    const descending = th.dataset.order !== "descending";
+    th.dataset.order = descending ? "descending" : "ascending";
+    const value = (row) => parseFloat(row.cells[column].dataset.value);
+    Array.from(body.rows)
+      .sort((a, b) => (descending ? -1 : 1) * ((value(a) || 0) - (value(b) || 0)))
+      .forEach((row) => body.appendChild(row));
+  });
+});
+"""
+
+
+class MetricsCollector:
+    def __init__(self):
+        self.records: List[Dict] = []
+        self._kernel_usage = True
+
+    async def measure(self, client: "NotebookClient", cell, index: int, execution, **fields):
+        before = await self._usage(client, reset=True)
+        submitted = datetime.datetime.now(datetime.timezone.utc)
+        started = time.monotonic()
+        try:
+            await execution
+        finally:
+            wall_time = time.monotonic() - started
+            after = await self._usage(client, reset=False)
+            metrics = {
+                "wall_time": wall_time,
+                **queue_and_execution_times(cell, submitted),
+                "cpu_time": after[0] - before[0] if after and before else None,
+                "peak_rss": after[1] if after else None,
+                "output_size": len(json.dumps(cell.get("outputs", []))),
+            }
+            cell["metadata"].setdefault("firenze", {})["metrics"] = metrics
+            self.records.append({**fields, "cell": index + 1, **metrics})
+
+    async def _usage(self, client: "NotebookClient", reset: bool) -> Optional[tuple]:
+        if not self._kernel_usage or client.kc is None:
+            return None
+        try:
+            result = await kernel_state.run_silently(
+                client, USAGE_CODE, {"usage": f"__firenze_usage({reset})"}
+            )
+        except KernelStateError:
+            # not a python kernel, so only the times measured from here are available
+            self._kernel_usage = False
+            return None
+        if result["usage"]["status"] != "ok":
+            self._kernel_usage = False
+            return None
+        return ast.literal_eval(result["usage"]["data"]["text/plain"])
+
+    def jsonl(self) -> str:
+        return "".join(json.dumps(record) + "\n" for record in self.records)
+
+
+def queue_and_execution_times(cell, submitted: datetime.datetime) -> Dict:
+    # nbclient records when the kernel started and finished executing the cell
+    timing = cell.get("metadata", {}).get("execution", {})
+    try:
+        started = parse_timestamp(timing["iopub.execute_input"])
+        finished = parse_timestamp(timing["shell.execute_reply"])
+    except (KeyError, ValueError):
+        return {"queue_time": None, "execution_time": None}
+    return {
+        "queue_time": max((started - submitted).total_seconds(), 0.0),
+        "execution_time": (finished - started).total_seconds(),
+    }
+
+
+def parse_timestamp(timestamp: str) -> datetime.datetime:
+    return datetime.datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+
+
+def summary_table(cells) -> str:
+    rows = []
+    for index, cell in enumerate(cells):
+        metrics = cell.get("metadata", {}).get("firenze", {}).get("metrics")
+        if metrics is None:
+            continue
+        values = {"cell": index + 1, **metrics}
+        row = "".join(
+            f'<td data-value="{"" if values.get(name) is None else values[name]}">'
+            f"{format_value(name, values.get(name))}</td>"
+            for name in COLUMNS
+        )
+        rows.append(f"<tr>{row}</tr>")
+    if not rows:
+        return ""
+    header = "".join(f"<th>{html.escape(title)}</th>" for title in COLUMNS.values())
+    return (
+        f'<div class="firenze-metrics"><style>{STYLE}</style><table>'
+        f"<thead><tr>{header}</tr></thead><tbody>{''.join(rows)}</tbody></table>"
+        f"<script>{SORT_SCRIPT}</script></div>"
+    )
+
+
+def format_value(name: str, value) -> str:
+    if value is None:
+        return ""
+    if name == "cell":
+        return str(value)
+    return f"{value / SCALES.get(name, 1):0.2f}"
@@ -1,44 +1,265 @@
 import ast
 import asyncio
+import contextlib
+import copy
+import hashlib
 import logging
+import os
 import pathlib
-from typing import Any, Optional
+import stat
+import tempfile
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Set
 
-import boto3
 import nbformat
-from nbclient import NotebookClient
-from nbconvert import HTMLExporter
 
-from firenze import progress
-from firenze.exceptions import VariableAssignmentError
+from firenze import batch, compression, limits, metrics, parallel, progress, s3, sources
+from firenze.assets import AssetStore
+from firenze.cache import CellCache
+from firenze.cell_log import CellLog
+from firenze.checkpoint import Checkpoint
+from firenze.dependencies import is_executable
+from firenze.exports import Exports
+from firenze.parameters import AssignmentIndex
+from firenze.rendering import IncrementalHTMLRenderer
+from firenze.selection import Selection
+from firenze.serialization import IncrementalNotebookSerializer
+from firenze.streaming import OutputStreamer
+
+if TYPE_CHECKING:
+    from nbclient import NotebookClient
+
+# temporary files are private, the files they become get the permissions open() would give them
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+FILE_MODE = 0o666 & ~_UMASK
 
 
 class Notebook:
     def __init__(
         self,
         notebook: nbformat.notebooknode.NotebookNode,
-        client: Optional[NotebookClient] = None,
+        client: Optional["NotebookClient"] = None,
     ):
-        if client is None:
-            client = NotebookClient(notebook, timeout=None)
-        self.client = client
+        self._client = client
         self.jupyter_notebook = notebook
+        self.renderer = IncrementalHTMLRenderer()
+        self.name: Optional[str] = None
+        self.parameters: Dict[str, Any] = {}
+        self.external_assets_threshold: Optional[int] = None
+        self.assets_path: Optional[str] = None
+        self.metrics: Optional[metrics.MetricsCollector] = None
+        self.streamer: Optional[OutputStreamer] = None
+        self.compression: Optional[str] = None
+        self.serializer = IncrementalNotebookSerializer()
+        self.cell_log: Optional[CellLog] = None
+        self.limits: Optional[limits.ResourceLimits] = None
+        self._guard: Optional[limits.ResourceGuard] = None
+        self._saved: Dict[str, str] = {}
+        self._assignment_index: Optional[AssignmentIndex] = None
+
+    @property
+    def client(self) -> "NotebookClient":
+        # notebooks that are only rendered never need a client
+        if self._client is None:
+            from nbclient import NotebookClient
+
+            self._client = NotebookClient(self.jupyter_notebook, timeout=None)
+        return self._client
+
+    @client.setter
+    def client(self, client: "NotebookClient"):
+        self._client = client
+
+    def execute(self, **kwargs):
+        asyncio.run(self.async_execute(**kwargs))
 
-    def execute(self):
-        asyncio.run(self.async_execute())
+    async def async_execute(
+        self,
+        kernel_pool=None,
+        on_cell_executed: Optional[Callable[[], Any]] = None,
+        cache: Optional[CellCache] = None,
+        parallel_workers: int = 0,
+        checkpoint: Optional[Checkpoint] = None,
+        selection: Optional[Selection] = None,
+        exports: Optional[Exports] = None,
+    ):
+        if parallel_workers and cache is not None:
+            raise ValueError("Parallel execution cannot be combined with the execution cache")
+        if checkpoint is not None and (cache is not None or parallel_workers):
+            raise ValueError("Checkpoints cannot be combined with the cache or parallel execution")
+        if selection is not None and (cache is not None or parallel_workers or checkpoint):
+            raise ValueError(
+                "Selective execution cannot be combined with the cache, parallel execution or "
+                "checkpoints"
+            )
+        if exports is not None and (cache is not None or parallel_workers):
+            raise ValueError("Exports cannot be combined with the cache or parallel execution")
+        if kernel_pool is None:
+            await self._async_execute_cells(
+                on_cell_executed, cache, parallel_workers, checkpoint, selection, exports
+            )
+            return
+        async with kernel_pool.kernel(cwd=os.getcwd()) as km:
+            self.client.km = km
+            self.client.owns_km = False
+            try:
+                await self._async_execute_cells(
+                    on_cell_executed, cache, parallel_workers, checkpoint, selection, exports
+                )
+            finally:
+                if self.client.kc is not None:
+                    self.client.kc.stop_channels()
+                self.client.kc = None
+                self.client.km = None
+
+    async def _async_execute_cells(
+        self,
+        on_cell_executed=None,
+        cache=None,
+        parallel_workers=0,
+        checkpoint=None,
+        selection=None,
+        exports=None,
+    ):
+        self._guard = limits.ResourceGuard(self.limits) if self.limits is not None else None
+        completed = checkpoint.load(self.cells) if checkpoint is not None else 0
+        # a resumed run adds to the log of the run it resumes, which holds the cells it keeps
+        if self.cell_log is not None and not completed:
+            self.cell_log.start()
+        if parallel_workers:
+            await parallel.run_parallel(self, parallel_workers, on_cell_executed)
+            return
+        keys, hits = self._cached_outputs(cache)
+        executable = {i for i, cell in enumerate(self.cells) if is_executable(cell)}
+        selected = (
+            selection.cells(self.cells, self.assignment_index)
+            if selection is not None
+            else executable
+        )
+        needs_kernel = any(i not in hits and i >= completed for i in executable & selected)
+        # a cached or checkpointed prefix leaves the kernel behind the notebook until the state is
+        # rebuilt
+        state_rebuilt = not hits and not completed
+        kernel = self.client.async_setup_kernel() if needs_kernel else contextlib.AsyncExitStack()
+        async with kernel:
+            for index, cell in enumerate(progress.with_logging(self.cells, self.logs_outputs)):
+                if index < completed:
+                    pass
+                elif index in hits:
+                    cache.apply(hits[index], cell)
+                elif index in executable and index not in selected:
+                    # the cell keeps the outputs of the run it comes from
+                    cell["metadata"].setdefault("firenze", {})["skipped"] = True
+                elif needs_kernel:
+                    cell["metadata"].get("firenze", {}).pop("skipped", None)
+                    if not state_rebuilt and index in executable:
+                        if completed:
+                            await checkpoint.rebuild_state(self.client, self.cells[:completed])
+                        else:
+                            await cache.rebuild_state(self.client, self.cells[:index], keys[:index])
+                        state_rebuilt = True
+                    await self._execute_cell(cell, index)
+                    if cache is not None and keys[index] is not None:
+                        cache.put(keys[index], cell)
+                        if cache.strategy == "restore":
+                            await cache.save_state(self.client, keys[index])
+                    if checkpoint is not None and index in executable:
+                        await checkpoint.save(self.client, self.cells, index)
+                if on_cell_executed is not None:
+                    on_cell_executed()
+            # the values are read from the kernel, so they are exported before it shuts down
+            if exports is not None and needs_kernel:
+                await exports.save(self.client, self.cells)
+        if cache is not None:
+            cache.report(len(hits), len(executable) - len(hits))
 
-    async def async_execute(self):
-        async with self.client.async_setup_kernel():
-            for index, cell in enumerate(progress.with_logging(self.cells)):
-                execution = self.client.async_execute_cell(cell, index)
-                if logging.getLogger().isEnabledFor(logging.INFO):
-                    await progress.add_elapsed(execution)
-                else:
-                    await execution
+    async def _execute_cell(self, cell, index, client: Optional["NotebookClient"] = None):
+        client = client if client is not None else self.client
+        if self.streamer is not None:
+            self.streamer.attach(client, self.name)
+        execution = client.async_execute_cell(cell, index)
+        if self.metrics is not None:
+            execution = self.metrics.measure(client, cell, index, execution, notebook=self.name)
+        if self._guard is not None:
+            execution = self._guard.watch(client, cell, index, execution)
+        try:
+            if logging.getLogger().isEnabledFor(logging.INFO):
+                label = f"Cell {index + 1}/{len(self.cells)}"
+                if self.name is not None:
+                    label = f"{self.name} {label.lower()}"
+                await progress.add_elapsed(
+                    execution, label, notebook=self.name, cell=index + 1, total=len(self.cells)
+                )
+            else:
+                await execution
+        finally:
+            if self.cell_log is not None:
+                self.cell_log.append(index, cell)
+
+    @property
+    def logs_outputs(self) -> bool:
+        # streamed outputs were already logged as they arrived
+        return self.streamer is None or not self.streamer.log_outputs
+
+    def _cached_outputs(self, cache):
+        if cache is None:
+            return [None] * len(self.cells), {}
+        keys = cache.keys(self.jupyter_notebook, self.parameters)
+        hits = {}
+        for index, (cell, key) in enumerate(zip(self.cells, keys)):
+            if not is_executable(cell):
+                continue
+            entry = cache.get(key) if key is not None else None
+            if entry is None:
+                break
+            hits[index] = entry
+        return keys, hits
+
+    def execute_batch(self, *args, **kwargs) -> List[batch.BatchRun]:
+        return asyncio.run(self.async_execute_batch(*args, **kwargs))
+
+    async def async_execute_batch(
+        self,
+        parameter_sets: Iterable[Dict[str, Any]],
+        output_html_path: str,
+        output_notebook_path: Optional[str] = None,
+        max_concurrency: int = 4,
+        summary_path: Optional[str] = None,
+        client_factory: Optional[Callable[..., "NotebookClient"]] = None,
+        kernel_pool=None,
+        cache: Optional[CellCache] = None,
+        exports_path: Optional[str] = None,
+    ) -> List[batch.BatchRun]:
+        return await batch.run_batch(
+            self,
+            parameter_sets,
+            output_html_path,
+            output_notebook_path=output_notebook_path,
+            max_concurrency=max_concurrency,
+            summary_path=summary_path,
+            client_factory=client_factory,
+            kernel_pool=kernel_pool,
+            cache=cache,
+            exports_path=exports_path,
+        )
+
+    def copy(self, client_factory: Optional[Callable[..., "NotebookClient"]] = None) -> "Notebook":
+        jupyter_notebook = copy.deepcopy(self.jupyter_notebook)
+        client = client_factory(jupyter_notebook) if client_factory is not None else None
+        notebook = type(self)(jupyter_notebook, client)
+        notebook.parameters = dict(self.parameters)
+        # the copy has the same sources, so it can reuse the parsed cells
+        notebook._assignment_index = self.assignment_index
+        notebook.externalize_assets(self.external_assets_threshold, self.assets_path)
+        notebook.metrics = self.metrics
+        notebook.streamer = self.streamer
+        notebook.compression = self.compression
+        notebook.limits = self.limits
+        return notebook
 
     def set_parameters(self, **kwargs):
-        for key, value in kwargs.items():
-            self.set_first_assignment_of_variable(key, value)
+        self._assign(kwargs)
+        self.parameters.update(kwargs)
 
     @property
     def cells(self):
@@ -50,7 +271,28 @@ class Notebook:
 
     @property
     def html(self) -> str:
-        return HTMLExporter().from_notebook_node(self.jupyter_notebook)[0]
+        return self.renderer.render(self.jupyter_notebook, prologue=self.prologue)
+
+    @property
+    def prologue(self) -> str:
+        # breached limits come first, so a run that was stopped is obvious at the top
+        return limits.breaches_summary(self.cells) + self.metrics_table
+
+    @property
+    def metrics_table(self) -> str:
+        return metrics.summary_table(self.cells)
+
+    def externalize_assets(self, threshold: Optional[int], assets_path: Optional[str] = None):
+        self.external_assets_threshold = threshold
+        self.assets_path = assets_path
+
+    def html_for(self, file_path: str) -> str:
+        if self.external_assets_threshold is None:
+            return self.html
+        assets = AssetStore.for_html(
+            str(file_path), self.external_assets_threshold, self.assets_path
+        )
+        return self.renderer.render(self.jupyter_notebook, assets, self.prologue)
 
     def is_clean(self) -> bool:
         return all([c["outputs"] == [] for c in self.cells]) and all(
@@ -62,55 +304,61 @@ class Notebook:
             cell["outputs"] = []
             if cell["cell_type"] == "code":
                 cell["execution_count"] = None
+            cell["metadata"].get("firenze", {}).pop("metrics", None)
+            cell["metadata"].get("firenze", {}).pop("skipped", None)
+            cell["metadata"].get("firenze", {}).pop("breach", None)
 
     @classmethod
-    def from_path(cls, notebook_path, client: Optional[NotebookClient] = None):
+    def from_path(
+        cls,
+        notebook_path,
+        client: Optional["NotebookClient"] = None,
+        source_cache: Optional[sources.SourceCache] = None,
+    ):
         if str(notebook_path).startswith("s3://"):
-            return cls.from_s3(notebook_path)
+            return cls.from_s3(notebook_path, source_cache=source_cache)
         return cls.from_local(client, notebook_path)
 
     @classmethod
     def from_local(cls, client, notebook_path):
-        with open(notebook_path) as f:
-            jupyter_notebook = nbformat.read(f, as_version=4)
-        return cls(jupyter_notebook, client)
+        content = compression.decompress(pathlib.Path(notebook_path).read_bytes())
+        return cls(nbformat.reads(content.decode("utf_8"), as_version=4), client)
+
+    @property
+    def assignment_index(self) -> AssignmentIndex:
+        if self._assignment_index is None or not self._assignment_index.matches(self.cells):
+            self._assignment_index = AssignmentIndex(self.cells)
+        return self._assignment_index
 
     def get_first_assignment_of_variable(self, variable_name: str):
-        for cell in self.code_cells:
-            tree = ast.parse(cell["source"])
-            for node in ast.walk(tree):
-                if not isinstance(node, ast.Assign):
-                    continue
-                for target in node.targets:
-                    if isinstance(target, ast.Name) and target.id == variable_name:
-                        return ast.literal_eval(node.value)
+        index = self.assignment_index
+        if variable_name in index.assignments:
+            return ast.literal_eval(index.get(variable_name).value)
 
-    def set_first_assignment_of_variable(self, variable_name: str, variable_value: Any):
-        for cell in self.code_cells:
+    def changed_parameters(self, **kwargs) -> Set[str]:
+        changed = set()
+        for name, value in kwargs.items():
             try:
-                tree = ast.parse(cell["source"])
-            except SyntaxError:
-                continue
-            for node in ast.walk(tree):
-                if not isinstance(node, ast.Assign):
+                if self.get_first_assignment_of_variable(name) == value:
                     continue
-                for target in node.targets:
-                    if isinstance(target, ast.Name) and target.id == variable_name:
-                        node.value = ast.Constant(variable_value)
-                        cell["source"] = ast.unparse(tree)
-                        return
-        raise VariableAssignmentError(
-            f"Variable {variable_name} not found. Maybe in a cell with a magic command?"
-        )
+            except ValueError:
+                # an assignment that is not a literal cannot be compared, so it counts as changed
+                pass
+            changed.add(name)
+        return changed
+
+    def set_first_assignment_of_variable(self, variable_name: str, variable_value: Any):
+        self._assign({variable_name: variable_value})
+
+    def _assign(self, values: Dict[str, Any]):
+        for index, source in self.assignment_index.apply(values).items():
+            self.cells[index]["source"] = source
 
     @classmethod
-    def from_s3(cls, s3_path, s3_client=None):
-        if s3_client is None:
-            s3_client = boto3.client("s3")
-        bucket, key = s3_path.replace("s3://", "").split("/", 1)
-        data = s3_client.get_object(Bucket=bucket, Key=key)
-        jupyter_notebook = nbformat.reads(data["Body"].read().decode("utf_8"), as_version=4)
-        return cls(jupyter_notebook)
+    def from_s3(cls, s3_path, s3_client=None, source_cache: Optional[sources.SourceCache] = None):
+        storage = s3.S3(s3_client) if s3_client is not None else s3.shared()
+        source_cache = source_cache if source_cache is not None else sources.shared()
+        return cls(source_cache.read(s3_path, storage))
 
     def save(self, file_path, content):
         if file_path.startswith("s3://"):
@@ -118,22 +366,94 @@ class Notebook:
         else:
             self.save_to_local(file_path, content)
 
+    async def async_save(self, file_path, content):
+        if file_path.startswith("s3://"):
+            await s3.shared().async_write(file_path, content)
+        else:
+            self.save_to_local(file_path, content)
+
+    def save_output(self, file_path, content):
+        key = self._unsaved_key(str(file_path), content)
+        if key is None:
+            return
+        path, content, s3_args = self._compress(str(file_path), content)
+        if path.startswith("s3://"):
+            s3.shared().write(path, content, **s3_args)
+        else:
+            self.save_to_local(path, content)
+        self._saved[str(file_path)] = key
+
+    async def async_save_output(self, file_path, content):
+        key = await asyncio.to_thread(self._unsaved_key, str(file_path), content)
+        if key is None:
+            return
+        path, content, s3_args = await asyncio.to_thread(self._compress, str(file_path), content)
+        if path.startswith("s3://"):
+            await s3.shared().async_write(path, content, **s3_args)
+        else:
+            self.save_to_local(path, content)
+        self._saved[str(file_path)] = key
+
+    def _unsaved_key(self, file_path: str, content: str) -> Optional[str]:
+        # outputs are saved again every few seconds while a cell runs, mostly without changes
+        key = hashlib.sha256(content.encode("utf_8")).hexdigest()
+        return None if self._saved.get(file_path) == key else key
+
+    def _compress(self, file_path: str, content: str):
+        codec = compression.codec_for_path(file_path)
+        if codec is None and self.compression is None:
+            return file_path, content, {}
+        data = compression.compress(content.encode("utf_8"), codec or self.compression)
+        if codec is not None:
+            # the extension already says how the file is compressed, so it is stored as it is
+            return file_path, data, {}
+        if file_path.startswith("s3://"):
+            # browsers decompress the object themselves, so it keeps its name
+            return (
+                file_path,
+                data,
+                {
+                    "content_encoding": self.compression,
+                    "content_type": compression.content_type(file_path),
+                },
+            )
+        return compression.with_extension(file_path, self.compression), data, {}
+
     def write_html(self, file_path):
-        self.save(file_path, self.html)
+        self.save_output(file_path, self.html_for(file_path))
+
+    async def async_write_html(self, file_path):
+        await self.async_save_output(file_path, self.html_for(file_path))
 
     def save_notebook(self, file_path):
         # Serialize the notebook to a string
-        notebook_str = nbformat.writes(self.jupyter_notebook)
-        self.save(file_path, notebook_str)
+        notebook_str = self.serializer.serialize(self.jupyter_notebook)
+        self.save_output(file_path, notebook_str)
+
+    async def async_save_notebook(self, file_path):
+        notebook_str = await asyncio.to_thread(self.serializer.serialize, self.jupyter_notebook)
+        await self.async_save_output(file_path, notebook_str)
 
     @staticmethod
     def save_to_local(file_path, content):
-        pathlib.Path(file_path).parent.mkdir(parents=True, exist_ok=True)
-        with open(file_path, "w") as f:
-            f.write(content)
+        # a symlink is written through, replacing it would detach it from the file it points to
+        path = pathlib.Path(file_path).resolve()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # the content goes to a file next to the target that replaces it at once, so a crash never
+        # leaves a truncated file behind
+        fd, temporary_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+        try:
+            with os.fdopen(fd, "wb" if isinstance(content, bytes) else "w") as f:
+                f.write(content)
+            os.chmod(
+                temporary_path, stat.S_IMODE(path.stat().st_mode) if path.exists() else FILE_MODE
+            )
+            os.replace(temporary_path, path)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(temporary_path)
+            raise
 
     @staticmethod
     def _save_to_s3(s3_path, content):
-        bucket, key = s3_path.replace("s3://", "").split("/", 1)
-        s3_client = boto3.client("s3")
-        s3_client.put_object(Bucket=bucket, Key=key, Body=content)
+        s3.shared().write(s3_path, content)
@@ -0,0 +1,134 @@
+import asyncio
+import contextlib
+import itertools
+import logging
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Set
+
+from firenze import kernel_state, progress
+from firenze.dependencies import CellNames, analyze, dependencies, is_executable, waves
+
+if TYPE_CHECKING:
+    from nbclient import NotebookClient
+
+
+async def run_parallel(
+    notebook,
+    max_workers: int,
+    on_cell_executed: Optional[Callable[[], None]] = None,
+    client_factory: Optional[Callable[..., "NotebookClient"]] = None,
+):
+    cells = notebook.cells
+    names = analyze(cells)
+    schedule = waves(dependencies(names), max_workers + 1)
+    if client_factory is None:
+        client_factory = worker_factory(notebook.client)
+    workers = [
+        client_factory(notebook.jupyter_notebook)
+        for _ in range(min(max_workers, max((len(wave) for wave in schedule), default=1) - 1))
+    ]
+
+    logged_cells = progress.with_logging(cells, notebook.logs_outputs)
+    done = {i for i, cell in enumerate(cells) if not is_executable(cell)}
+    logged = 0
+    execution_counts = itertools.count(1)
+
+    def log_finished_cells():
+        # cells are logged in notebook order, as soon as all the ones above them finished
+        nonlocal logged
+        while logged < len(cells) and logged in done:
+            if logged in names:
+                renumber(cells[logged], next(execution_counts))
+            next(logged_cells)
+            logged += 1
+            if on_cell_executed is not None:
+                on_cell_executed()
+
+    async with contextlib.AsyncExitStack() as stack:
+        await asyncio.gather(
+            *(
+                stack.enter_async_context(client.async_setup_kernel())
+                for client in [notebook.client, *workers]
+            )
+        )
+        log_finished_cells()
+        for wave in schedule:
+            await _run_wave(notebook, wave, workers, names)
+            done.update(wave)
+            log_finished_cells()
+    for _ in logged_cells:
+        pass
+
+
+def worker_factory(client: "NotebookClient") -> Callable[..., "NotebookClient"]:
+    from nbclient import NotebookClient
+
+    def factory(jupyter_notebook):
+        return NotebookClient(
+            jupyter_notebook, timeout=client.timeout, kernel_name=client.kernel_name
+        )
+
+    return factory
+
+
+def renumber(cell, execution_count: int):
+    # every kernel counts its own executions, so the notebook gets them in order of appearance
+    cell["execution_count"] = execution_count
+    for output in cell["outputs"]:
+        if output["output_type"] == "execute_result":
+            output["execution_count"] = execution_count
+
+
+async def _run_wave(notebook, wave: List[int], workers, names: Dict[int, CellNames]):
+    cells = notebook.cells
+    main_only = [index for index in wave if names[index].main_only]
+    main_index = main_only[0] if main_only else wave[0]
+    others = [index for index in wave if not names[index].main_only and index != main_index]
+    started = []
+    deferred = main_only[1:]
+    for index, worker in zip(others, workers):
+        if await _transfer(notebook.client, worker, names[index].uses):
+            started.append((index, worker))
+        else:
+            deferred.append(index)
+
+    results = await asyncio.gather(
+        notebook._execute_cell(cells[main_index], main_index),
+        *(notebook._execute_cell(cells[index], index, worker) for index, worker in started),
+        return_exceptions=True,
+    )
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+
+    for index, worker in started:
+        needed = _needed_after(index, names)
+        defined = names[index].defines if needed is None else names[index].defines & needed
+        if not await _transfer(worker, notebook.client, defined):
+            logging.warning(f"Could not transfer the names of cell {index + 1}, executing it again")
+            deferred.append(index)
+    # cells in the same wave are independent, so the ones that could not run in a worker run in
+    # the main kernel afterwards
+    for index in sorted(deferred):
+        await notebook._execute_cell(cells[index], index)
+
+
+async def _transfer(
+    source: "NotebookClient", target: "NotebookClient", variables: Set[str]
+) -> bool:
+    if not variables:
+        return True
+    data, skipped = await kernel_state.snapshot(source, variables)
+    if skipped:
+        return False
+    return not await kernel_state.restore(target, data)
+
+
+def _needed_after(index: int, names: Dict[int, CellNames]) -> Optional[Set[str]]:
+    needed: Set[str] = set()
+    for later, cell in names.items():
+        if later <= index:
+            continue
+        if cell.opaque:
+            return None
+        needed |= cell.uses
+    return needed
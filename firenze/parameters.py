@@ -0,0 +1,64 @@
+import ast
+from typing import Any, Dict, List, Tuple
+
+from firenze.exceptions import VariableAssignmentError
+
+
+class AssignmentIndex:
+    def __init__(self, cells: List):
+        self.sources: Dict[int, str] = {}
+        self.trees: Dict[int, ast.Module] = {}
+        self.assignments: Dict[str, Tuple[int, ast.Assign]] = {}
+        for index, cell in enumerate(cells):
+            if cell["cell_type"] != "code":
+                continue
+            try:
+                tree = ast.parse(cell["source"])
+            except SyntaxError:
+                continue
+            self.sources[index] = cell["source"]
+            self.trees[index] = tree
+            for node in ast.walk(tree):
+                if not isinstance(node, ast.Assign):
+                    continue
+                for target in node.targets:
+                    if isinstance(target, ast.Name):
+                        self.assignments.setdefault(target.id, (index, node))
+
+    def matches(self, cells: List) -> bool:
+        return all(
+            index < len(cells) and cells[index]["source"] == source
+            for index, source in self.sources.items()
+        )
+
+    def get(self, variable_name: str) -> ast.Assign:
+        return self._assignment(variable_name)[1]
+
+    def cell(self, variable_name: str) -> int:
+        return self._assignment(variable_name)[0]
+
+    def _assignment(self, variable_name: str) -> Tuple[int, ast.Assign]:
+        if variable_name not in self.assignments:
+            raise VariableAssignmentError(
+                f"Variable {variable_name} not found. Maybe in a cell with a magic command?"
+            )
+        return self.assignments[variable_name]
+
+    def apply(self, values: Dict[str, Any]) -> Dict[int, str]:
+        by_cell: Dict[int, Dict[ast.Assign, Any]] = {}
+        for variable_name, value in values.items():
+            index, node = self._assignment(variable_name)
+            by_cell.setdefault(index, {})[node] = value
+        sources = {}
+        for index, assignments in by_cell.items():
+            # the trees are shared by every notebook built from the same template, so the
+            # original values are put back once the cell is unparsed
+            original_values = {node: node.value for node in assignments}
+            try:
+                for node, value in assignments.items():
+                    node.value = ast.Constant(value)
+                sources[index] = ast.unparse(self.trees[index])
+            finally:
+                for node, value in original_values.items():
+                    node.value = value
+        return sources
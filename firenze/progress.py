@@ -1,31 +1,89 @@
 import asyncio
 import itertools
 import logging
+import shutil
+import sys
 import time
+from typing import Dict, Optional
 
+logger = logging.getLogger("firenze.progress")
 
-async def add_elapsed(coro):
-    done_event = asyncio.Event()
 
-    async def execute(coro):
-        await coro
-        done_event.set()
+class ProgressReporter:
+    def __init__(self, stream=None, interval: float = 0.2):
+        self._stream = stream
+        self.interval = interval
+        self._running: Dict[int, tuple] = {}
+        self._tokens = itertools.count()
+        self._ticker: Optional[asyncio.Task] = None
+        self._last_line = ""
+
+    @property
+    def stream(self):
+        return self._stream if self._stream is not None else sys.stdout
+
+    def is_interactive(self) -> bool:
+        return self.stream.isatty()
 
-    async def print_elapsed():
-        now = asyncio.get_running_loop().time()
-        msg = ""
+    def start(self, label: str, **fields) -> int:
+        token = next(self._tokens)
+        self._running[token] = (label, time.monotonic(), fields)
+        if self.is_interactive():
+            # a single ticker redraws every running cell, however many notebooks are executing
+            loop = asyncio.get_running_loop()
+            if self._ticker is None or self._ticker.done() or self._ticker.get_loop() is not loop:
+                self._ticker = loop.create_task(self._tick())
+        else:
+            logger.info(f"{label} started", extra={"event": "cell_started", **fields})
+        return token
+
+    def finish(self, token: int):
+        label, started, fields = self._running.pop(token)
+        elapsed = time.monotonic() - started
+        if not self.is_interactive():
+            logger.info(
+                f"{label} finished in {elapsed:0.1f} seconds",
+                extra={"event": "cell_finished", "elapsed": elapsed, **fields},
+            )
+        elif not self._running:
+            self._clear()
+
+    async def _tick(self):
         for char in itertools.cycle("|/-\\"):
-            msg = f"...{asyncio.get_running_loop().time() - now:0.1f}s {char}"
-            print(msg, end="\r")
-            await asyncio.sleep(0.1)
-            if done_event.is_set():
+            if not self._running:
                 break
-        print(" " * len(msg), end="\r")
+            now = time.monotonic()
+            running = ", ".join(
+                f"{label} ...{now - started:0.1f}s" for label, started, _ in self._running.values()
+            )
+            width = shutil.get_terminal_size().columns - 3
+            self._draw(f"{running[:width]} {char}")
+            await asyncio.sleep(self.interval)
+        self._clear()
+
+    def _draw(self, line: str):
+        padding = " " * max(len(self._last_line) - len(line), 0)
+        self.stream.write(f"{line}{padding}\r")
+        self.stream.flush()
+        self._last_line = line
 
-    await asyncio.gather(execute(coro), asyncio.create_task(print_elapsed()))
+    def _clear(self):
+        if self._last_line:
+            self._draw("")
+
+
+reporter = ProgressReporter()
+
+
+async def add_elapsed(coro, label: str = "", **fields):
+    token = reporter.start(label, **fields)
+    try:
+        await coro
+    finally:
+        reporter.finish(token)
 
 
-def with_logging(cells):
+def with_logging(cells, log_outputs: bool = True):
     starting_time = time.time()
     total = len(cells)
     for i, cell in enumerate(cells, 1):
@@ -34,8 +92,9 @@ def with_logging(cells):
         logging.info("Input:")
         logging.info(cell["source"])
         yield cell
-        logging.info("Output:")
-        logging.info("".join(output.get("text", "") for output in cell["outputs"]))
+        if log_outputs:
+            logging.info("Output:")
+            logging.info("".join(output.get("text", "") for output in cell["outputs"]))
     logging.info("==========")
     finishing_time = time.time()
     logging.info(f"Execution finished in {finishing_time - starting_time:0.1f} seconds")
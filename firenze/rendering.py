@@ -0,0 +1,94 @@
+import functools
+from typing import Dict, Optional, Tuple
+
+import nbformat
+
+from firenze.hashing import digest
+
+CELLS_PLACEHOLDER = "FIRENZE_CELLS_PLACEHOLDER"
+# cells are wrapped in a .jp-Notebook div so HTMLExporter post-processes them like a full document
+CELLS_PREFIX = '<div class="jp-Notebook">'
+CELLS_SUFFIX = "</div>"
+SKIPPED_NOTE = (
+    '<div class="firenze-skipped" style="font-size: small; color: #8a6d3b; margin-left: 8em">'
+    "Not executed in this run, the outputs are from an earlier one.</div>"
+)
+
+TEMPLATES = {
+    "firenze_cells.html.j2": (
+        "{%- extends 'index.html.j2' -%}\n"
+        "{%- block header -%}{%- endblock header -%}\n"
+        "{%- block body_header -%}" + CELLS_PREFIX + "{%- endblock body_header -%}\n"
+        "{%- block body_footer -%}" + CELLS_SUFFIX + "{%- endblock body_footer -%}\n"
+        "{%- block footer -%}{%- endblock footer -%}\n"
+        "{%- block any_cell scoped -%}\n"
+        "{%- if cell.metadata.get('firenze', {}).get('skipped') -%}"
+        + SKIPPED_NOTE
+        + "{%- endif -%}\n"
+        "{{ super() }}\n"
+        "{%- endblock any_cell -%}\n"
+    ),
+    "firenze_skeleton.html.j2": (
+        "{%- extends 'index.html.j2' -%}\n"
+        "{%- block body_loop -%}" + CELLS_PLACEHOLDER + "{%- endblock body_loop -%}\n"
+    ),
+}
+
+
+@functools.lru_cache(maxsize=None)
+def exporter(template_file: str):
+    # nbconvert and its templates take a while to load, so they wait for the first render
+    import jinja2
+    from nbconvert import HTMLExporter
+
+    return HTMLExporter(extra_loaders=[jinja2.DictLoader(TEMPLATES)], template_file=template_file)
+
+
+def load_exporters():
+    for template_file in TEMPLATES:
+        exporter(template_file)
+
+
+class IncrementalHTMLRenderer:
+    def __init__(self):
+        self._skeleton: Tuple[Optional[str], str] = (None, "")
+        self._fragments: Dict[str, str] = {}
+
+    @property
+    def cells_exporter(self):
+        return exporter("firenze_cells.html.j2")
+
+    @property
+    def skeleton_exporter(self):
+        return exporter("firenze_skeleton.html.j2")
+
+    def render(self, jupyter_notebook: nbformat.NotebookNode, assets=None, prologue="") -> str:
+        metadata = jupyter_notebook.metadata
+        metadata_key = digest(metadata)
+        if self._skeleton[0] != metadata_key:
+            skeleton = self.skeleton_exporter.from_notebook_node(
+                nbformat.v4.new_notebook(metadata=metadata)
+            )[0]
+            self._skeleton = (metadata_key, skeleton)
+
+        fragments = {}
+        keys = []
+        for cell in jupyter_notebook.cells:
+            key = digest(metadata_key, cell, assets.key if assets is not None else None)
+            if key in self._fragments:
+                fragments[key] = self._fragments[key]
+            elif key not in fragments:
+                if assets is not None:
+                    cell = assets.externalize(cell)
+                fragments[key] = self._render_cell(cell, metadata)
+            keys.append(key)
+        # only the fragments of the current cells are kept, so the cache never outgrows the notebook
+        self._fragments = fragments
+
+        before, after = self._skeleton[1].split(CELLS_PLACEHOLDER, 1)
+        return before + prologue + "".join(fragments[key] for key in keys) + after
+
+    def _render_cell(self, cell: nbformat.NotebookNode, metadata) -> str:
+        single_cell_notebook = nbformat.v4.new_notebook(metadata=metadata, cells=[cell])
+        html = self.cells_exporter.from_notebook_node(single_cell_notebook)[0]
+        return html.removeprefix(CELLS_PREFIX).removesuffix(CELLS_SUFFIX)
@@ -0,0 +1,113 @@
+import asyncio
+import functools
+import hashlib
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple, Union
+
+MULTIPART_THRESHOLD = 8 * 1024 * 1024
+
+
+def split_path(s3_path: str) -> Tuple[str, str]:
+    bucket, key = s3_path.replace("s3://", "").split("/", 1)
+    return bucket, key
+
+
+class S3:
+    def __init__(
+        self,
+        s3_client=None,
+        max_workers: int = 4,
+        multipart_threshold: int = MULTIPART_THRESHOLD,
+    ):
+        # boto3 takes a while to import, so it is only loaded for s3 paths
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+        from botocore.config import Config
+
+        if s3_client is None:
+            # one connection per worker thread, plus the ones used by multipart uploads
+            config = Config(max_pool_connections=max_workers * 10)
+            s3_client = boto3.client("s3", config=config)
+        self.client = s3_client
+        self.max_workers = max_workers
+        self.transfer_config = TransferConfig(
+            multipart_threshold=multipart_threshold, multipart_chunksize=multipart_threshold
+        )
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._written: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    self.max_workers, thread_name_prefix="firenze-s3"
+                )
+            return self._executor
+
+    def read(self, s3_path: str) -> bytes:
+        bucket, key = split_path(s3_path)
+        return self.client.get_object(Bucket=bucket, Key=key)["Body"].read()
+
+    def read_if_modified(
+        self, s3_path: str, etag: Optional[str] = None
+    ) -> Optional[Tuple[bytes, str]]:
+        bucket, key = split_path(s3_path)
+        condition = {"IfNoneMatch": etag} if etag is not None else {}
+        try:
+            response = self.client.get_object(Bucket=bucket, Key=key, **condition)
+        except self.client.exceptions.ClientError as e:
+            if e.response["Error"]["Code"] in ("304", "NotModified"):
+                return None
+            raise
+        return response["Body"].read(), response["ETag"]
+
+    def write(
+        self,
+        s3_path: str,
+        content: Union[str, bytes],
+        content_encoding: Optional[str] = None,
+        content_type: Optional[str] = None,
+    ) -> bool:
+        if isinstance(content, str):
+            content = content.encode("utf_8")
+        content_hash = hashlib.sha256(content).hexdigest()
+        with self._lock:
+            if self._written.get(s3_path) == content_hash:
+                return False
+        bucket, key = split_path(s3_path)
+        extra_args = {}
+        if content_encoding is not None:
+            extra_args["ContentEncoding"] = content_encoding
+        if content_type is not None:
+            extra_args["ContentType"] = content_type
+        # upload_fileobj switches to a multipart upload above the threshold
+        self.client.upload_fileobj(
+            io.BytesIO(content), bucket, key, ExtraArgs=extra_args, Config=self.transfer_config
+        )
+        with self._lock:
+            self._written[s3_path] = content_hash
+        return True
+
+    def write_if_missing(self, s3_path: str, content: bytes) -> bool:
+        bucket, key = split_path(s3_path)
+        try:
+            self.client.head_object(Bucket=bucket, Key=key)
+            return False
+        except self.client.exceptions.ClientError as e:
+            if e.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+                raise
+        return self.write(s3_path, content)
+
+    async def async_write(self, s3_path: str, content: Union[str, bytes], **kwargs) -> bool:
+        loop = asyncio.get_running_loop()
+        write = functools.partial(self.write, s3_path, content, **kwargs)
+        return await loop.run_in_executor(self.executor, write)
+
+
+@functools.lru_cache(maxsize=None)
+def shared() -> S3:
+    return S3()
@@ -0,0 +1,23 @@
+import dataclasses
+from typing import FrozenSet, Optional, Set
+
+from firenze.dependencies import affected, analyze, data_dependencies, upstream
+from firenze.parameters import AssignmentIndex
+
+
+@dataclasses.dataclass(frozen=True)
+class Selection:
+    tags: FrozenSet[str] = frozenset()
+    # the parameters whose value changed, None runs the selected cells whatever changed
+    parameters: Optional[FrozenSet[str]] = None
+
+    def cells(self, cells, assignment_index: AssignmentIndex) -> Set[int]:
+        names = analyze(cells)
+        targets = set(names)
+        if self.tags:
+            targets = {i for i in targets if self.tags & set(cells[i]["metadata"].get("tags", []))}
+        if self.parameters is not None:
+            entries = {name: assignment_index.cell(name) for name in self.parameters}
+            targets &= affected(names, entries)
+        # the kernel starts empty, so every cell that the targets read from runs too
+        return upstream(data_dependencies(names), targets)
@@ -0,0 +1,57 @@
+import copy
+import json
+from typing import Dict, List
+
+import nbformat
+from nbformat.v4.nbjson import BytesEncoder
+from nbformat.v4.rwbase import split_lines, strip_transient
+
+CELLS_PLACEHOLDER = "FIRENZE_CELLS_PLACEHOLDER"
+# the same options nbformat writes notebooks with, so the files are byte for byte the same
+JSON_OPTIONS = dict(
+    cls=BytesEncoder, indent=1, sort_keys=True, separators=(",", ": "), ensure_ascii=False
+)
+
+
+def fingerprint(value) -> int:
+    # strings cache their hash, so only the outputs that changed are read again. the class keeps 1
+    # and 1.0 apart, as they are written differently
+    if isinstance(value, dict):
+        return hash(tuple(sorted((key, fingerprint(item)) for key, item in value.items())))
+    if isinstance(value, list):
+        return hash(tuple(fingerprint(item) for item in value))
+    return hash((value.__class__, value))
+
+
+class IncrementalNotebookSerializer:
+    def __init__(self):
+        self._fragments: Dict[int, str] = {}
+
+    def serialize(self, jupyter_notebook: nbformat.NotebookNode) -> str:
+        fragments = {}
+        cells: List[str] = []
+        for cell in jupyter_notebook.cells:
+            key = fingerprint(cell)
+            if key not in fragments:
+                fragments[key] = self._fragments.get(key) or self._serialize_cell(cell)
+            cells.append(fragments[key])
+        # only the fragments of the current cells are kept, so the cache never outgrows the notebook
+        self._fragments = fragments
+
+        skeleton = nbformat.NotebookNode(
+            {key: copy.deepcopy(value) for key, value in jupyter_notebook.items() if key != "cells"}
+        )
+        skeleton["cells"] = []
+        strip_transient(skeleton)
+        skeleton["cells"] = CELLS_PLACEHOLDER
+        # cells sit two levels deep in the document, so their lines get two more spaces
+        body = "[\n  " + ",\n  ".join(cells) + "\n ]" if cells else "[]"
+        return json.dumps(skeleton, **JSON_OPTIONS).replace(f'"{CELLS_PLACEHOLDER}"', body, 1)
+
+    @staticmethod
+    def _serialize_cell(cell: nbformat.NotebookNode) -> str:
+        single_cell_notebook = nbformat.NotebookNode(
+            {"cells": [copy.deepcopy(cell)], "metadata": nbformat.NotebookNode()}
+        )
+        cell = strip_transient(split_lines(single_cell_notebook)).cells[0]
+        return json.dumps(cell, **JSON_OPTIONS).replace("\n", "\n  ")
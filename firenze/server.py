@@ -0,0 +1,241 @@
+import asyncio
+import dataclasses
+import http
+import json
+import logging
+import pathlib
+import time
+import uuid
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional, Tuple
+
+from firenze import s3
+from firenze.exceptions import QueueFullError
+from firenze.notebook import Notebook
+from firenze.sources import SourceCache
+
+if TYPE_CHECKING:
+    from nbclient import NotebookClient
+
+MAX_REQUEST_SIZE = 1024 * 1024
+FINISHED_STATUSES = ("ok", "failed", "timeout", "cancelled")
+CONTENT_TYPES = {"html": "text/html; charset=utf-8", "ipynb": "application/x-ipynb+json"}
+
+
+@dataclasses.dataclass
+class ServiceJob:
+    notebook_path: str
+    parameters: Dict[str, Any]
+    timeout: Optional[float] = None
+    id: str = dataclasses.field(default_factory=lambda: uuid.uuid4().hex)
+    status: str = "queued"
+    error: Optional[str] = None
+    submitted_at: float = dataclasses.field(default_factory=time.time)
+    started_at: Optional[float] = None
+    elapsed: Optional[float] = None
+    html_path: Optional[str] = None
+    ipynb_path: Optional[str] = None
+
+
+class ExecutionService:
+    def __init__(
+        self,
+        output_path: str,
+        max_concurrency: int = 2,
+        max_queue: int = 16,
+        timeout: Optional[float] = None,
+        kernel_pool=None,
+        source_cache: Optional[SourceCache] = None,
+        client_factory: Optional[Callable[..., "NotebookClient"]] = None,
+        max_finished_jobs: int = 1000,
+    ):
+        self.output_path = str(output_path).rstrip("/")
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.kernel_pool = kernel_pool
+        self.source_cache = source_cache
+        self.client_factory = client_factory
+        self.max_finished_jobs = max_finished_jobs
+        self.jobs: Dict[str, ServiceJob] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def count(self, status: str) -> int:
+        return sum(job.status == status for job in self.jobs.values())
+
+    def submit(
+        self, notebook_path: str, parameters: Dict[str, Any], timeout: Optional[float] = None
+    ) -> ServiceJob:
+        # jobs beyond the queue are refused, rather than piling up in memory
+        if self.count("queued") >= self.max_queue:
+            raise QueueFullError(f"{self.max_queue} jobs are already waiting")
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        job = ServiceJob(
+            notebook_path, parameters, timeout if timeout is not None else self.timeout
+        )
+        self.jobs[job.id] = job
+        self._tasks[job.id] = asyncio.create_task(self._run(job))
+        self._forget_finished_jobs()
+        return job
+
+    def cancel(self, job_id: str) -> ServiceJob:
+        job = self.jobs[job_id]
+        task = self._tasks.get(job_id)
+        if task is not None and not task.done():
+            task.cancel()
+        return job
+
+    async def close(self):
+        for task in self._tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    async def _run(self, job: ServiceJob):
+        notebook = None
+        status = "ok"
+        try:
+            async with self._semaphore:
+                job.status = "running"
+                job.started_at = time.time()
+                notebook = await asyncio.to_thread(
+                    Notebook.from_path, job.notebook_path, source_cache=self.source_cache
+                )
+                if self.client_factory is not None:
+                    notebook.client = self.client_factory(notebook.jupyter_notebook)
+                notebook.name = f"Job {job.id}"
+                notebook.clean()
+                notebook.set_parameters(**job.parameters)
+                await asyncio.wait_for(notebook.async_execute(self.kernel_pool), job.timeout)
+        except asyncio.TimeoutError:
+            status = "timeout"
+            job.error = f"Not finished after {job.timeout} seconds"
+        except asyncio.CancelledError:
+            status = "cancelled"
+        except Exception as e:
+            status = "failed"
+            job.error = f"{type(e).__name__}: {e}"
+        finally:
+            if job.started_at is not None:
+                job.elapsed = time.time() - job.started_at
+            self._tasks.pop(job.id, None)
+        # a finished job always has its result, if it got to run at all
+        if notebook is not None:
+            await self._save(notebook, job)
+        job.status = status
+        logging.info(f"Job {job.id} {job.status}: {job.notebook_path}")
+
+    async def _save(self, notebook: Notebook, job: ServiceJob):
+        html_path = f"{self.output_path}/{job.id}.html"
+        ipynb_path = f"{self.output_path}/{job.id}.ipynb"
+        try:
+            await notebook.async_write_html(html_path)
+            await notebook.async_save_notebook(ipynb_path)
+        except Exception as e:
+            logging.warning(f"Could not save the result of job {job.id}: {e}")
+            return
+        job.html_path, job.ipynb_path = html_path, ipynb_path
+
+    def _forget_finished_jobs(self):
+        finished = [job for job in self.jobs.values() if job.status in FINISHED_STATUSES]
+        for job in finished[: max(len(finished) - self.max_finished_jobs, 0)]:
+            del self.jobs[job.id]
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            method, path, body = await read_request(reader)
+            status, content_type, content, headers = await self.route(method, path, body)
+        except (ValueError, asyncio.IncompleteReadError) as e:
+            status, content_type, content, headers = error(http.HTTPStatus.BAD_REQUEST, str(e))
+        except Exception as e:
+            logging.exception(f"Could not handle a request: {e}")
+            status, content_type, content, headers = error(
+                http.HTTPStatus.INTERNAL_SERVER_ERROR, str(e)
+            )
+        head = [f"HTTP/1.1 {status.value} {status.phrase}", f"Content-Type: {content_type}"]
+        head += [f"Content-Length: {len(content)}", "Connection: close"]
+        head += [f"{name}: {value}" for name, value in headers.items()]
+        writer.write("\r\n".join(head).encode("latin-1") + b"\r\n\r\n" + content)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def route(self, method: str, path: str, body: bytes):
+        parts = path.strip("/").split("/")
+        if method == "GET" and parts == ["health"]:
+            return respond({"running": self.count("running"), "queued": self.count("queued")})
+        if parts[0] != "jobs" or len(parts) > 3:
+            return error(http.HTTPStatus.NOT_FOUND, f"No such resource {path}")
+        if len(parts) == 1:
+            if method == "GET":
+                return respond([dataclasses.asdict(job) for job in self.jobs.values()])
+            if method == "POST":
+                return self._submit_request(body)
+        elif parts[1] not in self.jobs:
+            return error(http.HTTPStatus.NOT_FOUND, f"No job {parts[1]}")
+        elif len(parts) == 2 and method == "GET":
+            return respond(dataclasses.asdict(self.jobs[parts[1]]))
+        elif len(parts) == 2 and method == "DELETE":
+            return respond(dataclasses.asdict(self.cancel(parts[1])))
+        elif len(parts) == 3 and method == "GET" and parts[2] in CONTENT_TYPES:
+            return await self._result(self.jobs[parts[1]], parts[2])
+        return error(http.HTTPStatus.METHOD_NOT_ALLOWED, f"{method} {path} is not supported")
+
+    def _submit_request(self, body: bytes):
+        request = json.loads(body)
+        if not isinstance(request, dict) or "notebook" not in request:
+            raise ValueError("The request must be a JSON object with a notebook path")
+        try:
+            job = self.submit(
+                request["notebook"], request.get("parameters", {}), request.get("timeout")
+            )
+        except QueueFullError as e:
+            return error(http.HTTPStatus.TOO_MANY_REQUESTS, str(e), {"Retry-After": "5"})
+        return respond(dataclasses.asdict(job), http.HTTPStatus.ACCEPTED)
+
+    async def _result(self, job: ServiceJob, kind: str):
+        path = job.html_path if kind == "html" else job.ipynb_path
+        if path is None:
+            return error(
+                http.HTTPStatus.CONFLICT, f"Job {job.id} has no result, it is {job.status}"
+            )
+        content = await asyncio.to_thread(read_result, path)
+        return http.HTTPStatus.OK, CONTENT_TYPES[kind], content, {}
+
+
+async def read_request(reader: asyncio.StreamReader) -> Tuple[str, str, bytes]:
+    request_line = await reader.readline()
+    method, target, _ = request_line.decode("latin-1").split(" ", 2)
+    headers = {}
+    while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    if length > MAX_REQUEST_SIZE:
+        raise ValueError(f"Requests are limited to {MAX_REQUEST_SIZE} bytes")
+    return method, target.partition("?")[0], await reader.readexactly(length)
+
+
+def respond(payload, status: http.HTTPStatus = http.HTTPStatus.OK, headers=None):
+    return status, "application/json", json.dumps(payload).encode("utf_8"), headers or {}
+
+
+def error(status: http.HTTPStatus, message: str, headers=None):
+    return respond({"error": message}, status, headers)
+
+
+def read_result(path: str) -> bytes:
+    if path.startswith("s3://"):
+        return s3.shared().read(path)
+    return pathlib.Path(path).read_bytes()
+
+
+async def serve(service: ExecutionService, host: str = "127.0.0.1", port: int = 8642):
+    server = await asyncio.start_server(service.handle, host, port)
+    logging.info(f"Serving notebooks at http://{host}:{port}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.close()
@@ -0,0 +1,79 @@
+import collections
+import copy
+import functools
+import json
+import logging
+import threading
+from typing import Optional, Tuple
+
+import nbformat
+
+from firenze import compression, s3
+from firenze.cache import LocalCacheStore
+from firenze.hashing import digest
+
+
+class SourceCache:
+    def __init__(self, directory=None, max_size: Optional[int] = None, max_notebooks: int = 16):
+        self.store = LocalCacheStore(directory, max_size) if directory is not None else None
+        self.max_notebooks = max_notebooks
+        self.hits = 0
+        self.misses = 0
+        self._notebooks: "collections.OrderedDict[str, Tuple[str, nbformat.NotebookNode]]" = (
+            collections.OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def read(self, s3_path: str, storage: s3.S3) -> nbformat.NotebookNode:
+        cached = self._get(s3_path)
+        # the notebook is only downloaded when its ETag is not the one already parsed
+        response = storage.read_if_modified(s3_path, cached[0] if cached is not None else None)
+        if response is None:
+            self.hits += 1
+            jupyter_notebook = cached[1]
+        else:
+            self.misses += 1
+            content, etag = response
+            content = compression.decompress(content)
+            jupyter_notebook = nbformat.reads(content.decode("utf_8"), as_version=4)
+            self._put(s3_path, etag, jupyter_notebook)
+        # every run changes its notebook, so none of them gets the cached one
+        return copy.deepcopy(jupyter_notebook)
+
+    def _get(self, s3_path: str) -> Optional[Tuple[str, nbformat.NotebookNode]]:
+        with self._lock:
+            if s3_path in self._notebooks:
+                self._notebooks.move_to_end(s3_path)
+                return self._notebooks[s3_path]
+        if self.store is None:
+            return None
+        etag = self.store.get(f"{digest(s3_path)}.etag")
+        data = self.store.get(f"{digest(s3_path, etag.decode())}.json") if etag else None
+        if data is None:
+            return None
+        # only notebooks that passed validation are written to disk, so they are not validated again
+        jupyter_notebook = nbformat.from_dict(json.loads(data))
+        self._remember(s3_path, etag.decode(), jupyter_notebook)
+        return etag.decode(), jupyter_notebook
+
+    def _put(self, s3_path: str, etag: str, jupyter_notebook: nbformat.NotebookNode):
+        self._remember(s3_path, etag, jupyter_notebook)
+        if self.store is None:
+            return
+        try:
+            self.store.put(f"{digest(s3_path, etag)}.json", json.dumps(jupyter_notebook).encode())
+            self.store.put(f"{digest(s3_path)}.etag", etag.encode())
+        except OSError as e:
+            logging.warning(f"Could not cache {s3_path}: {e}")
+
+    def _remember(self, s3_path: str, etag: str, jupyter_notebook: nbformat.NotebookNode):
+        with self._lock:
+            self._notebooks[s3_path] = (etag, jupyter_notebook)
+            self._notebooks.move_to_end(s3_path)
+            while len(self._notebooks) > self.max_notebooks:
+                self._notebooks.popitem(last=False)
+
+
+@functools.lru_cache(maxsize=None)
+def shared() -> SourceCache:
+    return SourceCache()
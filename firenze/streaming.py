@@ -0,0 +1,85 @@
+import logging
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+if TYPE_CHECKING:
+    from nbclient import NotebookClient
+
+logger = logging.getLogger("firenze.output")
+
+TRUNCATION_MARKER = "\n... [{} characters truncated] ...\n"
+
+
+class StreamBuffer:
+    # keeps the first and the last characters of a stream, so its size is bounded however much
+    # the cell prints
+    def __init__(self, max_size: int):
+        self.head_size = max_size // 2
+        self.tail_size = max_size - self.head_size
+        self.head = ""
+        self.tail = ""
+        self.truncated = 0
+
+    def append(self, text: str):
+        if len(self.head) < self.head_size:
+            room = self.head_size - len(self.head)
+            self.head += text[:room]
+            text = text[room:]
+        tail = self.tail + text
+        start = max(len(tail) - self.tail_size, 0)
+        self.truncated += start
+        self.tail = tail[start:]
+
+    @property
+    def text(self) -> str:
+        if not self.truncated:
+            return self.head + self.tail
+        return self.head + TRUNCATION_MARKER.format(self.truncated) + self.tail
+
+
+class OutputStreamer:
+    def __init__(self, log_outputs: bool = True, max_output_size: Optional[int] = None):
+        self.log_outputs = log_outputs
+        self.max_output_size = max_output_size
+
+    def attach(self, client: "NotebookClient", name: Optional[str] = None):
+        if getattr(client, "_firenze_streamer", None) is self:
+            return
+        client._firenze_streamer = self
+        output = client.output
+        # the stream output that the next chunk of the same stream is merged into
+        current: Dict[str, Tuple[dict, StreamBuffer]] = {}
+
+        def streaming_output(outs, msg, display_id, cell_index):
+            out = output(outs, msg, display_id, cell_index)
+            if out is None:
+                return out
+            if self.log_outputs:
+                self._log(out, cell_index, name)
+            if self.max_output_size is not None and out["output_type"] == "stream":
+                out = self._merge(outs, out, current)
+            return out
+
+        client.output = streaming_output
+
+    def _merge(self, outs, out, current):
+        previous, buffer = current.get(out["name"], (None, None))
+        if len(outs) < 2 or outs[-2] is not previous:
+            buffer = StreamBuffer(self.max_output_size)
+            current[out["name"]] = (out, buffer)
+            previous = out
+        else:
+            outs.pop()
+        buffer.append(out["text"])
+        previous["text"] = buffer.text
+        return previous
+
+    @staticmethod
+    def _log(out, cell_index: int, name: Optional[str]):
+        label = f"Cell {cell_index + 1}" if name is None else f"{name} cell {cell_index + 1}"
+        extra = {"event": "cell_output", "notebook": name, "cell": cell_index + 1}
+        if out["output_type"] == "stream":
+            level = logging.WARNING if out["name"] == "stderr" else logging.INFO
+            for line in out["text"].splitlines():
+                logger.log(level, f"{label}: {line}", extra=extra)
+        elif out["output_type"] == "error":
+            logger.error(f"{label}: {out['ename']}: {out['evalue']}", extra=extra)
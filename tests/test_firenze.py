@@ -1,17 +1,56 @@
+import ast
+import asyncio
+import base64
+import copy
+import gzip
+import io
+import json
 import logging
+import os
 import pathlib
 import re
+import signal
+import socket
+import subprocess
+import sys
 import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
+import jupyter_client
 import nbclient.exceptions
 import nbformat
 import pytest
+from botocore.stub import Stubber
+from jupyter_client import AsyncKernelManager
 from moto import mock_s3
 from nbclient import NotebookClient, client
-
-from firenze.exceptions import VariableAssignmentError
+from nbconvert import HTMLExporter
+
+from benchmarks import suite
+from firenze import batch, html_writer, kernel_pool, limits, progress, s3, sources
+from firenze.assets import AssetStore
+from firenze.cache import CellCache, LocalCacheStore, cache_store
+from firenze.cell_log import CellLog
+from firenze.checkpoint import Checkpoint
+from firenze.dependencies import analyze, cell_names, dependencies, waves
+from firenze.exceptions import ResourceLimitError, VariableAssignmentError
+from firenze.exports import Exports
+from firenze.jobs import Job, JobQueue, S3JobStore, Worker, job_store
+from firenze.kernel_pool import KernelPool
+from firenze.limits import ResourceLimits
+from firenze.metrics import MetricsCollector
 from firenze.notebook import Notebook
+from firenze.selection import Selection
+from firenze.server import ExecutionService
+from firenze.streaming import TRUNCATION_MARKER, OutputStreamer, StreamBuffer
+
+# seconds to import the command line interface, which every run pays
+IMPORT_TIME_BUDGET = 0.5
 
 
 class DummyClient(NotebookClient):
@@ -216,6 +255,8 @@ def mock_bucket(one_cell_notebook_path):
     moto_fake = mock_s3()
     try:
         moto_fake.start()
+        s3.shared.cache_clear()
+        sources.shared.cache_clear()
         conn = boto3.client("s3")
         conn.create_bucket(Bucket="notebooks")
         conn.upload_file(
@@ -226,6 +267,7 @@ def mock_bucket(one_cell_notebook_path):
         yield
     finally:
         moto_fake.stop()
+        s3.shared.cache_clear()
 
 
 def test_can_load_notebook_from_s3(mock_bucket, one_cell_notebook_path):
@@ -244,7 +286,8 @@ def test_can_write_notebook_html_to_local_file(one_cell_notebook_path):
 
     with tempfile.NamedTemporaryFile(delete=True) as tmp:
         notebook.write_html(tmp.name)
-        assert "Dummy text" in tmp.read().decode("utf-8")
+        # the html replaces the file, so it is read again from its path
+        assert "Dummy text" in pathlib.Path(tmp.name).read_text()
 
 
 @pytest.mark.slow
@@ -295,6 +338,8 @@ def test_notebook_execution_logs_input_and_output(caplog, one_cell_notebook_path
         "---------",
         "Input:",
         re.escape('print("Starting Cell 1...")\nprint("Finished Cell 1")\n'),
+        "Cell 1/1 started",
+        re.compile(r"^Cell 1/1 finished in [0-9\.]+ seconds$"),
         "Output:",
         "Dummy text\n",
         "==========",
@@ -319,6 +364,8 @@ def test_execute_notebook_without_outputs(caplog, one_cell_notebook_path):
         "---------",
         "Input:",
         re.escape('print("Starting Cell 1...")\nprint("Finished Cell 1")\n'),
+        "Cell 1/1 started",
+        re.compile(r"^Cell 1/1 finished in [0-9\.]+ seconds$"),
         "Output:",
         "",
         "==========",
@@ -327,3 +374,1264 @@ def test_execute_notebook_without_outputs(caplog, one_cell_notebook_path):
     assert len(expected_patterns) == len(log_records)
     for expected_pattern, record in zip(expected_patterns, log_records):
         assert re.match(expected_pattern, record)
+
+
+def test_parameter_grid_expands_every_combination():
+    assert batch.parameter_grid({"a": [1, 2], "b": ["x", "y"]}) == [
+        {"a": 1, "b": "x"},
+        {"a": 1, "b": "y"},
+        {"a": 2, "b": "x"},
+        {"a": 2, "b": "y"},
+    ]
+
+
+def test_combine_parameter_sets_with_grid_and_fixed_parameters():
+    parameter_sets = batch.combine_parameter_sets(
+        [{"a": 1}, {"a": 2}], grid={"b": [3, 4]}, fixed={"c": 5}
+    )
+    assert parameter_sets == [
+        {"a": 1, "b": 3, "c": 5},
+        {"a": 1, "b": 4, "c": 5},
+        {"a": 2, "b": 3, "c": 5},
+        {"a": 2, "b": 4, "c": 5},
+    ]
+
+
+def test_batch_run_that_cannot_write_its_outputs_fails_alone(
+    tmp_path, notebook_with_variables_path
+):
+    (tmp_path / "blocked").write_text("a file, not a directory")
+    notebook = Notebook.from_path(notebook_with_variables_path)
+    runs = notebook.execute_batch(
+        [{"my_variable": "ok"}, {"my_variable": "blocked"}],
+        str(tmp_path / "{my_variable}" / "output.html"),
+        summary_path=str(tmp_path / "summary.json"),
+        client_factory=DummyClient,
+    )
+    assert [run.status for run in runs] == ["ok", "failed"]
+    assert runs[1].error.startswith("Could not write the outputs: FileExistsError")
+    assert (tmp_path / "ok" / "output.html").exists()
+    assert json.loads((tmp_path / "summary.json").read_text())["failed"] == 1
+    with pytest.raises(ValueError, match="cannot be named index"):
+        notebook.execute_batch([{"index": 1}], str(tmp_path / "output_{index}.html"))
+
+
+def test_read_parameter_sets_from_jsonl(tmp_path):
+    path = tmp_path / "parameters.jsonl"
+    path.write_text('{"my_variable": 1}\n\n{"my_variable": [2, 3]}\n')
+    assert batch.read_parameter_sets(path) == [{"my_variable": 1}, {"my_variable": [2, 3]}]
+
+
+@pytest.mark.slow
+def test_execute_batch_writes_one_output_per_parameter_set(tmp_path, notebook_with_variables_path):
+    notebook = Notebook.from_path(notebook_with_variables_path)
+    runs = notebook.execute_batch(
+        [{"my_variable": 1}, {"my_variable": 2}, {"non_existing_variable": 3}],
+        str(tmp_path / "output_{index}.html"),
+        output_notebook_path=str(tmp_path / "output_{index}.ipynb"),
+        max_concurrency=2,
+        summary_path=str(tmp_path / "summary.json"),
+        client_factory=DummyClient,
+    )
+    assert [run.status for run in runs] == ["ok", "ok", "failed"]
+    assert "VariableAssignmentError" in runs[2].error
+    assert all((tmp_path / f"output_{i}.html").exists() for i in range(3))
+    executed = Notebook.from_path(tmp_path / "output_1.ipynb")
+    assert executed.get_first_assignment_of_variable("my_variable") == 2
+    assert notebook.get_first_assignment_of_variable("my_variable") == 4
+    summary = json.loads((tmp_path / "summary.json").read_text())
+    assert (summary["total"], summary["ok"], summary["failed"]) == (3, 2, 1)
+    assert all(run["elapsed"] is not None for run in summary["runs"])
+
+
+@pytest.mark.slow
+def test_kernel_pool_replaces_kernels_after_max_uses():
+    async def acquire_twice():
+        async with KernelPool(size=1, max_uses=1, health_check_interval=None) as pool:
+            async with pool.kernel() as first:
+                pass
+            async with pool.kernel() as second:
+                pass
+            return first, second
+
+    first, second = asyncio.run(acquire_twice())
+    assert first is not second
+
+
+@pytest.mark.slow
+def test_execute_notebooks_with_kernel_pool(notebook_with_variables_path):
+    async def execute_twice():
+        async with KernelPool(size=1, max_uses=2, health_check_interval=None) as pool:
+            notebooks = []
+            for value in [5, 6]:
+                notebook = Notebook.from_path(notebook_with_variables_path)
+                notebook.set_parameters(my_variable=value)
+                await notebook.async_execute(kernel_pool=pool)
+                notebooks.append(notebook)
+            return notebooks
+
+    notebooks = asyncio.run(execute_twice())
+    assert notebooks[0].cells[0]["outputs"][0]["text"] == "My variable is 5\n"
+    assert notebooks[1].cells[0]["outputs"][0]["text"] == "My variable is 6\n"
+
+
+@pytest.mark.slow
+def test_execute_notebook_with_kernel_pool_daemon(tmp_path, notebook_with_variables_path):
+    socket_path = str(tmp_path / "pool.sock")
+
+    async def execute_through_daemon():
+        async with KernelPool(size=1, health_check_interval=None) as pool:
+            server = asyncio.create_task(kernel_pool.serve(pool, socket_path))
+            while not os.path.exists(socket_path):
+                await asyncio.sleep(0.01)
+            notebook = Notebook.from_path(notebook_with_variables_path)
+            await notebook.async_execute(kernel_pool=kernel_pool.RemoteKernelPool(socket_path))
+            server.cancel()
+            return notebook
+
+    notebook = asyncio.run(execute_through_daemon())
+    assert notebook.cells[0]["outputs"][0]["text"] == "My variable is 4\n"
+
+
+class FailingKernelManager(AsyncKernelManager):
+    async def start_kernel(self, **kwargs):
+        raise RuntimeError("The kernel did not start")
+
+
+@pytest.mark.slow
+def test_kernel_pool_fails_acquires_once_no_kernel_can_be_started(monkeypatch, tmp_path, caplog):
+    monkeypatch.setattr(kernel_pool, "REPLACE_BACKOFF", 0.01)
+    socket_path = str(tmp_path / "pool.sock")
+
+    async def use_up_the_only_kernel():
+        async with KernelPool(size=1, max_uses=1, health_check_interval=None) as pool:
+            monkeypatch.setattr(jupyter_client, "AsyncKernelManager", FailingKernelManager)
+            server = asyncio.create_task(kernel_pool.serve(pool, socket_path))
+            waiting = asyncio.create_task(pool.acquire())
+            async with pool.kernel():
+                pass
+            try:
+                with pytest.raises(RuntimeError):
+                    await asyncio.wait_for(waiting, timeout=30)
+                with pytest.raises(RuntimeError):
+                    await pool.acquire()
+                with pytest.raises(RuntimeError, match="could not lease a kernel"):
+                    async with kernel_pool.RemoteKernelPool(socket_path).kernel():
+                        pass
+            finally:
+                server.cancel()
+
+    asyncio.run(use_up_the_only_kernel())
+    assert (
+        caplog.text.count("Could not replace a kernel of the pool") == kernel_pool.REPLACE_ATTEMPTS
+    )
+
+
+@pytest.mark.slow
+def test_kernel_pool_daemon_closes_the_lease_of_a_kernel_that_died(tmp_path):
+    socket_path = str(tmp_path / "pool.sock")
+
+    async def kill_leased_kernel():
+        async with KernelPool(size=1, health_check_interval=None) as pool:
+            server = asyncio.create_task(kernel_pool.serve(pool, socket_path))
+            while not os.path.exists(socket_path):
+                await asyncio.sleep(0.01)
+            try:
+                async with kernel_pool.RemoteKernelPool(socket_path).kernel() as km:
+                    alive_before = await km.is_alive()
+                    os.kill(km.pid, signal.SIGKILL)
+                    for _ in range(50):
+                        if not await km.is_alive():
+                            break
+                        await asyncio.sleep(0.1)
+                    return alive_before, await km.is_alive()
+            finally:
+                server.cancel()
+
+    assert asyncio.run(kill_leased_kernel()) == (True, False)
+
+
+def test_remote_kernel_pool_is_not_available_behind_a_stale_socket(tmp_path):
+    socket_path = str(tmp_path / "pool.sock")
+    # a socket file nobody listens on, like the one a killed daemon leaves behind
+    with socket.socket(socket.AF_UNIX) as stale:
+        stale.bind(socket_path)
+    assert os.path.exists(socket_path)
+    assert not kernel_pool.RemoteKernelPool(socket_path).is_available()
+    assert not kernel_pool.RemoteKernelPool(str(tmp_path / "missing.sock")).is_available()
+
+
+@pytest.mark.slow
+def test_incremental_html_matches_full_export(notebook_with_variables_path):
+    notebook = Notebook.from_path(notebook_with_variables_path)
+    notebook.jupyter_notebook.cells.append(nbformat.v4.new_markdown_cell("# A *title*"))
+    notebook.jupyter_notebook.cells[0]["outputs"] = [
+        nbformat.v4.new_output("stream", name="stdout", text="My variable is 4\n"),
+        nbformat.v4.new_output("error", ename="NameError", evalue="x", traceback=["NameError"]),
+    ]
+    assert notebook.html == HTMLExporter().from_notebook_node(notebook.jupyter_notebook)[0]
+
+
+@pytest.mark.slow
+def test_incremental_html_only_renders_changed_cells(notebook_with_variables_path):
+    notebook = Notebook.from_path(notebook_with_variables_path)
+    notebook.jupyter_notebook.cells.append(nbformat.v4.new_markdown_cell("# Unchanged"))
+    rendered = []
+    render_cell = notebook.renderer._render_cell
+
+    def counting_render_cell(cell, metadata):
+        rendered.append(cell["cell_type"])
+        return render_cell(cell, metadata)
+
+    notebook.renderer._render_cell = counting_render_cell
+    notebook.html
+    assert rendered == ["code", "markdown"]
+    notebook.cells[0]["outputs"] = [nbformat.v4.new_output("stream", text="Changed\n")]
+    html = notebook.html
+    assert rendered == ["code", "markdown", "code"]
+    assert "Changed" in html
+    notebook.html
+    assert rendered == ["code", "markdown", "code"]
+
+
+class CountingDummyClient(DummyClient):
+    executed: list = []
+
+    async def async_execute_cell(self, cell, index, **kwargs):
+        self.executed.append(index)
+        await super().async_execute_cell(cell, index, **kwargs)
+
+
+def test_cell_cache_reuses_outputs_of_unchanged_cells(tmp_path, notebook_with_variables_path):
+    cache = CellCache(LocalCacheStore(tmp_path))
+    CountingDummyClient.executed = []
+    for _ in range(2):
+        with open(notebook_with_variables_path) as f:
+            jupyter_notebook = nbformat.read(f, as_version=4)
+        notebook = Notebook(jupyter_notebook, CountingDummyClient(jupyter_notebook))
+        notebook.set_parameters(my_variable=5)
+        notebook.execute(cache=cache)
+    assert CountingDummyClient.executed == [0]
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert notebook.cells[0]["outputs"][0]["text"] == "Dummy text\n"
+
+
+def test_cell_cache_treats_unreadable_entries_as_misses(tmp_path, notebook_with_variables_path):
+    cache = CellCache(LocalCacheStore(tmp_path))
+    notebook = Notebook.from_path(notebook_with_variables_path)
+    notebook.client = DummyClient(notebook.jupyter_notebook)
+    notebook.execute(cache=cache)
+    [entry] = tmp_path.iterdir()
+    entry.write_bytes(entry.read_bytes()[:10])
+
+    notebook = Notebook.from_path(notebook_with_variables_path)
+    notebook.client = DummyClient(notebook.jupyter_notebook)
+    notebook.execute(cache=cache)
+    assert (cache.hits, cache.misses) == (0, 2)
+    assert [path.name for path in tmp_path.iterdir()] == [entry.name]
+    assert json.loads(entry.read_bytes())["outputs"] == notebook.cells[0]["outputs"]
+
+
+def test_cell_cache_keys_depend_on_parameters_and_upstream_cells(notebook_with_variables_path):
+    notebook = Notebook.from_path(notebook_with_variables_path)
+    notebook.jupyter_notebook.cells.append(nbformat.v4.new_code_cell("print(my_variable)"))
+    cache = CellCache(LocalCacheStore("unused"))
+    keys = cache.keys(notebook.jupyter_notebook, {})
+    notebook.set_parameters(my_variable=5)
+    keys_with_parameters = cache.keys(notebook.jupyter_notebook, notebook.parameters)
+    assert keys[0] != keys_with_parameters[0]
+    assert keys[1] != keys_with_parameters[1]
+    notebook.cells[1]["source"] = "print(my_variable * 2)"
+    assert cache.keys(notebook.jupyter_notebook, notebook.parameters)[0] == keys_with_parameters[0]
+
+
+def test_local_cache_store_evicts_least_recently_used_entries(tmp_path):
+    store = LocalCacheStore(tmp_path, max_size=20)
+    store.put("first", b"0123456789")
+    store.put("second", b"0123456789")
+    os.utime(tmp_path / "first", (0, 0))
+    os.utime(tmp_path / "second", (1, 1))
+    store.get("first")
+    store.put("third", b"0123456789")
+    assert store.get("second") is None
+    assert store.get("first") == store.get("third") == b"0123456789"
+
+
+def test_s3_cache_store(mock_bucket):
+    store = cache_store("s3://notebooks/cache")
+    assert store.get("missing.json") is None
+    store.put("entry.json", b"{}")
+    assert store.get("entry.json") == b"{}"
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize("strategy", ["replay", "restore"])
+def test_cell_cache_rebuilds_kernel_state_after_cached_cells(tmp_path, strategy):
+    cache = CellCache(LocalCacheStore(tmp_path), strategy)
+    jupyter_notebook = nbformat.v4.new_notebook(
+        cells=[
+            nbformat.v4.new_code_cell("a = 1"),
+            nbformat.v4.new_code_cell("b = a + 1\nprint(b)"),
+            nbformat.v4.new_code_cell("print(b * 10)"),
+        ]
+    )
+    Notebook(copy.deepcopy(jupyter_notebook)).execute(cache=cache)
+    jupyter_notebook.cells[2]["source"] = "print(b * 100)"
+    notebook = Notebook(jupyter_notebook)
+    notebook.execute(cache=cache)
+    assert (cache.hits, cache.misses) == (2, 4)
+    assert notebook.cells[1]["outputs"][0]["text"] == "2\n"
+    assert notebook.cells[2]["outputs"][0]["text"] == "200\n"
+
+
+def test_s3_write_skips_unchanged_content(mock_bucket):
+    storage = s3.S3()
+    assert storage.write("s3://notebooks/output.html", "first")
+    assert not storage.write("s3://notebooks/output.html", "first")
+    assert storage.write("s3://notebooks/output.html", "second")
+    assert storage.read("s3://notebooks/output.html") == b"second"
+
+
+def test_s3_write_uses_multipart_upload_for_large_content(mock_bucket):
+    storage = s3.S3(multipart_threshold=5 * 1024 * 1024)
+    storage.write("s3://notebooks/large.html", "x" * 11 * 1024 * 1024)
+    head = storage.client.head_object(Bucket="notebooks", Key="large.html")
+    assert head["ETag"].endswith('-3"')
+
+
+@pytest.mark.slow
+def test_can_write_notebook_html_to_s3_path_off_the_event_loop(mock_bucket, one_cell_notebook_path):
+    notebook = Notebook.from_path(one_cell_notebook_path)
+    notebook.cells[0]["outputs"] = [nbformat.v4.new_output("stream", text="Dummy text\n")]
+    asyncio.run(notebook.async_write_html("s3://notebooks/async/one_cell_notebook.html"))
+    html = s3.shared().read("s3://notebooks/async/one_cell_notebook.html").decode("utf-8")
+    assert "Dummy text" in html
+
+
+def image_output(content: bytes):
+    return nbformat.v4.new_output(
+        "display_data",
+        data={"image/png": base64.b64encode(content).decode(), "text/plain": "<Figure>"},
+    )
+
+
+@pytest.mark.slow
+def test_write_html_with_external_assets(tmp_path, notebook_with_variables_path):
+    notebook = Notebook.from_path(notebook_with_variables_path)
+    large, small = b"\x89PNG" + b"1" * 2000, b"\x89PNG" + b"2" * 10
+    notebook.cells[0]["outputs"] = [image_output(large), image_output(small)]
+    notebook.jupyter_notebook.cells.append(copy.deepcopy(notebook.cells[0]))
+    notebook.externalize_assets(1000)
+    notebook.write_html(str(tmp_path / "output.html"))
+
+    assets = list((tmp_path / "assets").iterdir())
+    assert [asset.read_bytes() for asset in assets] == [large]
+    html = (tmp_path / "output.html").read_text()
+    assert html.count(f'src="assets/{assets[0].name}"') == 2
+    assert base64.b64encode(large).decode() not in html
+    assert base64.b64encode(small).decode() in html
+
+
+def test_external_assets_are_linked_relative_to_the_html():
+    assert AssetStore.for_html("output.html", 10).link_prefix == "assets"
+    assert AssetStore.for_html("reports/a.html", 10, "shared").link_prefix == "../shared"
+    store = AssetStore.for_html("s3://notebooks/reports/a.html", 10)
+    assert (store.path, store.link_prefix) == ("s3://notebooks/reports/assets", "assets")
+    store = AssetStore.for_html("s3://notebooks/reports/a.html", 10, "s3://notebooks/assets")
+    assert store.link_prefix == "../assets"
+    with pytest.raises(ValueError):
+        AssetStore.for_html("s3://notebooks/a.html", 10, "s3://other/assets")
+
+
+def test_external_assets_are_uploaded_once_to_s3(mock_bucket):
+    store = AssetStore.for_html("s3://notebooks/reports/a.html", 10)
+    cell = nbformat.v4.new_code_cell(outputs=[image_output(b"\x89PNG" + b"1" * 100)])
+    externalized = store.externalize(cell)
+    name = externalized["outputs"][0]["data"]["text/html"].split('"')[1].split("/")[1]
+    assert not s3.shared().write_if_missing(f"s3://notebooks/reports/assets/{name}", b"")
+    assert "image/png" in cell["outputs"][0]["data"]
+
+
+@pytest.fixture
+def notebook_with_many_variables():
+    return Notebook(
+        nbformat.v4.new_notebook(
+            cells=[
+                nbformat.v4.new_code_cell("a = 1\nb = 2"),
+                nbformat.v4.new_markdown_cell("c = 3"),
+                nbformat.v4.new_code_cell("%matplotlib inline\nc = 3"),
+                nbformat.v4.new_code_cell("c = 4\nprint(a, b, c)"),
+            ]
+        )
+    )
+
+
+def test_set_parameters_parses_each_cell_once(monkeypatch, notebook_with_many_variables):
+    parsed = []
+    parse = ast.parse
+
+    def counting_parse(source, *args, **kwargs):
+        parsed.append(source)
+        return parse(source, *args, **kwargs)
+
+    monkeypatch.setattr(ast, "parse", counting_parse)
+    notebook_with_many_variables.set_parameters(a=10, b=[1, 2], c="x")
+    assert len(parsed) == 3
+    assert notebook_with_many_variables.cells[0]["source"] == "a = 10\nb = [1, 2]"
+    assert notebook_with_many_variables.cells[3]["source"] == "c = 'x'\nprint(a, b, c)"
+
+
+def test_set_parameters_with_missing_variable_changes_nothing(notebook_with_many_variables):
+    with pytest.raises(VariableAssignmentError, match="Variable d not found"):
+        notebook_with_many_variables.set_parameters(a=10, d=1)
+    assert notebook_with_many_variables.get_first_assignment_of_variable("a") == 1
+
+
+def test_copies_reuse_the_assignment_index(notebook_with_many_variables):
+    index = notebook_with_many_variables.assignment_index
+    first, second = notebook_with_many_variables.copy(), notebook_with_many_variables.copy()
+    first.set_parameters(a=10)
+    second.set_parameters(a=20)
+    assert second.assignment_index is not index
+    assert first.get_first_assignment_of_variable("a") == 10
+    assert second.get_first_assignment_of_variable("a") == 20
+    assert notebook_with_many_variables.assignment_index is index
+    assert notebook_with_many_variables.get_first_assignment_of_variable("a") == 1
+
+
+class FakeTerminal(io.StringIO):
+    def isatty(self):
+        return True
+
+
+def test_progress_reporter_draws_one_line_for_concurrent_cells():
+    terminal = FakeTerminal()
+    reporter = progress.ProgressReporter(terminal, interval=0.01)
+
+    async def run_cells():
+        first = reporter.start("Run 1 cell 1/2")
+        second = reporter.start("Run 2 cell 1/2")
+        await asyncio.sleep(0.05)
+        reporter.finish(first)
+        reporter.finish(second)
+
+    asyncio.run(run_cells())
+    frames = terminal.getvalue().split("\r")
+    assert any("Run 1 cell 1/2 ...0.0s, Run 2 cell 1/2 ...0.0s" in frame for frame in frames)
+    assert frames[-2].strip() == ""
+
+
+def test_progress_reporter_logs_events_when_not_interactive(caplog):
+    reporter = progress.ProgressReporter(io.StringIO())
+
+    async def run_cell():
+        reporter.finish(reporter.start("Cell 1/1", cell=1, total=1))
+
+    with caplog.at_level(logging.INFO):
+        asyncio.run(run_cell())
+    assert [record.event for record in caplog.records] == ["cell_started", "cell_finished"]
+    assert caplog.records[1].cell == 1
+    assert caplog.records[1].elapsed >= 0
+
+
+def test_benchmark_comparison_reports_slower_stages():
+    case = {"cells": 10}
+    baseline = {"results": [{"stage": "html", "case": case, "min": 1.0}]}
+    current = {
+        "results": [
+            {"stage": "html", "case": case, "min": 1.5},
+            {"stage": "html", "case": {"cells": 100}, "min": 5.0},
+        ]
+    }
+    assert len(suite.compare(current, baseline, tolerance=0.25)) == 1
+    assert suite.compare(current, baseline, tolerance=0.6) == []
+
+
+@pytest.mark.slow
+def test_benchmark_suite_times_every_stage():
+    cases = {"cells": [3], "source_lines": [2], "output_bytes": [100], "parameters": [1]}
+    results = suite.run(cases, repeat=1)["results"]
+    assert {result["stage"] for result in results} >= {"from_local", "execute", "write_html"}
+    assert all(result["min"] >= 0 for result in results)
+
+
+def test_metrics_are_stored_in_cells_and_shown_in_html(notebook_with_variables_path):
+    with open(notebook_with_variables_path) as f:
+        jupyter_notebook = nbformat.read(f, as_version=4)
+    notebook = Notebook(jupyter_notebook, DummyClient(jupyter_notebook))
+    notebook.metrics = MetricsCollector()
+    notebook.execute()
+    recorded = [cell["metadata"]["firenze"]["metrics"] for cell in notebook.code_cells]
+    assert all(metrics["wall_time"] >= 0 for metrics in recorded)
+    assert all(metrics["output_size"] > 0 for metrics in recorded)
+    assert all(metrics["peak_rss"] is None for metrics in recorded)
+    records = [json.loads(line) for line in notebook.metrics.jsonl().splitlines()]
+    assert [record["cell"] for record in records] == [
+        index + 1 for index, cell in enumerate(notebook.cells) if cell["cell_type"] == "code"
+    ]
+    assert notebook.html.count('<div class="firenze-metrics">') == 1
+
+    notebook.clean()
+    assert "firenze-metrics" not in notebook.html
+
+
+@pytest.mark.slow
+def test_metrics_measure_the_kernel():
+    jupyter_notebook = nbformat.v4.new_notebook(
+        cells=[nbformat.v4.new_code_cell("data = bytearray(50_000_000)\nsum(range(10**6))")]
+    )
+    notebook = Notebook(jupyter_notebook)
+    notebook.metrics = MetricsCollector()
+    notebook.execute()
+    metrics = notebook.cells[0]["metadata"]["firenze"]["metrics"]
+    assert metrics["peak_rss"] > 50_000_000
+    assert metrics["cpu_time"] > 0
+    assert metrics["execution_time"] <= metrics["wall_time"]
+    assert metrics["queue_time"] >= 0
+
+
+def test_cell_names_track_definitions_uses_and_mutations():
+    names = cell_names(
+        "import numpy as np\n"
+        "data = load(path)\n"
+        "data['total'] = np.sum(values)\n"
+        "results.append(data)\n"
+        "def f(x):\n    local = x\n    return local + offset\n"
+    )
+    assert names.defines == {"np", "data", "f"}
+    assert {"load", "path", "values", "offset"} <= names.uses
+    # objects passed to a call may be changed by it, unless it is a builtin that never does
+    assert names.mutates == {"data", "results", "path", "values"}
+    assert not names.opaque
+    assert cell_names("random.shuffle(xs)\nprint(len(ys))").mutates == {"random", "xs"}
+
+
+@pytest.mark.parametrize(
+    "source", ["%time x = 1", "!ls", "from os import *", "exec('x = 1')", "globals()['x'] = 1"]
+)
+def test_cells_the_analysis_cannot_handle_are_opaque(source):
+    assert cell_names(source).opaque
+
+
+def test_independent_cells_are_scheduled_in_the_same_wave():
+    cells = [
+        nbformat.v4.new_code_cell(source)
+        for source in [
+            "import time\nbase = 1",
+            "time.sleep(1)\na = base",
+            "b = base + 1\nresults.append(b)",
+            "c = a + b",
+            "%who",
+            "d = 4",
+        ]
+    ]
+    cells.insert(1, nbformat.v4.new_markdown_cell("# Title"))
+    schedule = waves(dependencies(analyze(cells)), max_width=4)
+    assert schedule == [[0], [2, 3], [4], [5], [6]]
+
+
+SHARED_STATE_SOURCES = [
+    ["a = []", "b = a", "b.append(1)", "print(a)"],
+    ["g = 1", "def f():\n    return g", "g = 2", "print(f())"],
+    ["import os", "os.environ['A'] = '1'", "y = os.environ['A']", "print(y)"],
+]
+
+
+@pytest.mark.parametrize("sources", SHARED_STATE_SOURCES)
+def test_cells_sharing_state_outside_their_names_are_ordered(sources):
+    names = analyze([nbformat.v4.new_code_cell(source) for source in sources])
+    assert waves(dependencies(names), max_width=4) == [[0], [1], [2], [3]]
+
+
+@pytest.mark.parametrize("sources", [SHARED_STATE_SOURCES[0], SHARED_STATE_SOURCES[2]])
+def test_cells_changing_shared_objects_run_in_the_main_kernel(sources):
+    names = analyze([nbformat.v4.new_code_cell(source) for source in sources])
+    assert [cell.main_only for cell in names.values()] == [True, True, True, False]
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize(
+    "sources",
+    [
+        *SHARED_STATE_SOURCES,
+        # the cell changing the module runs next to an independent one
+        ["import os\nx = 1", "y = x + 1", "os.environ['B'] = str(x)", "print(os.environ['B'], y)"],
+    ],
+)
+def test_parallel_execution_matches_sequential_execution(sources):
+    jupyter_notebook = nbformat.v4.new_notebook(
+        cells=[nbformat.v4.new_code_cell(source) for source in sources]
+    )
+    sequential = Notebook(copy.deepcopy(jupyter_notebook))
+    sequential.execute()
+    notebook = Notebook(jupyter_notebook)
+    notebook.execute(parallel_workers=2)
+    assert [cell["outputs"] for cell in notebook.cells] == [
+        cell["outputs"] for cell in sequential.cells
+    ]
+
+
+@pytest.mark.slow
+def test_parallel_execution_transfers_names_to_the_main_kernel(caplog):
+    sources = [
+        "from time import sleep\nbase = 10",
+        "sleep(1)\na = base + 1",
+        "sleep(1)\nnumbers = (i for i in range(base))",
+        "def double(x):\n    return 2 * x",
+        "total = double(a) + sum(numbers)",
+        "total",
+    ]
+    jupyter_notebook = nbformat.v4.new_notebook(
+        cells=[nbformat.v4.new_code_cell(source) for source in sources]
+    )
+    notebook = Notebook(jupyter_notebook)
+    notebook.execute(parallel_workers=2)
+    assert notebook.cells[-1]["outputs"][0]["data"]["text/plain"] == "67"
+    # generators cannot be pickled, so that cell is executed again in the main kernel
+    assert "Could not transfer the names of cell 3" in caplog.text
+    assert [cell["execution_count"] for cell in notebook.cells] == [1, 2, 3, 4, 5, 6]
+
+
+@pytest.mark.slow
+def test_parallel_execution_copies_back_objects_changed_by_calls():
+    sources = [
+        "import random\nxs = [1, 2, 3, 4, 5]\nys = []",
+        "ys.extend([9])",
+        "random.seed(0)\nrandom.shuffle(xs)",
+        "print(xs, ys)",
+    ]
+    jupyter_notebook = nbformat.v4.new_notebook(
+        cells=[nbformat.v4.new_code_cell(source) for source in sources]
+    )
+    sequential = Notebook(copy.deepcopy(jupyter_notebook))
+    sequential.execute()
+    notebook = Notebook(jupyter_notebook)
+    notebook.execute(parallel_workers=2)
+    assert notebook.cells[-1]["outputs"] == sequential.cells[-1]["outputs"]
+
+
+def test_parallel_execution_is_not_combined_with_the_cache(tmp_path, one_cell_notebook_path):
+    notebook = Notebook.from_path(one_cell_notebook_path)
+    cache = CellCache(LocalCacheStore(tmp_path))
+    with pytest.raises(ValueError):
+        notebook.execute(parallel_workers=2, cache=cache)
+
+
+def test_cli_imports_heavy_dependencies_lazily():
+    code = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        "import firenze.cli\n"
+        "print(time.perf_counter() - start)\n"
+        "print(*sorted(m for m in ('boto3', 'nbconvert', 'nbclient') if m in sys.modules))\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    elapsed, loaded = result.stdout.split("\n")[:2]
+    assert loaded == ""
+    assert float(elapsed) < IMPORT_TIME_BUDGET
+
+
+def test_background_html_writer_renders_only_the_newest_pending_snapshot(monkeypatch, tmp_path):
+    rendered = []
+    started = threading.Event()
+
+    def render(key, snapshot, file_path, threshold, assets_path):
+        started.set()
+        time.sleep(0.2)
+        rendered.append(json.loads(snapshot)["metadata"]["version"])
+        return f"<p>{rendered[-1]}</p>"
+
+    monkeypatch.setattr(html_writer, "render", render)
+    notebook = Notebook(nbformat.v4.new_notebook())
+
+    async def write():
+        with ThreadPoolExecutor(1) as executor:
+            async with html_writer.BackgroundHTMLWriter(notebook, executor) as writer:
+                for version in range(3):
+                    notebook.jupyter_notebook.metadata["version"] = version
+                    writer.submit(tmp_path / "output.html")
+                    await asyncio.get_running_loop().run_in_executor(None, started.wait)
+
+    asyncio.run(write())
+    assert rendered == [0, 2]
+    assert (tmp_path / "output.html").read_text() == "<p>2</p>"
+
+
+@pytest.mark.slow
+def test_background_html_writer_matches_the_notebook_html(tmp_path, notebook_with_variables_path):
+    notebook = Notebook.from_path(notebook_with_variables_path)
+    notebook.execute()
+
+    async def write():
+        async with html_writer.BackgroundHTMLWriter(notebook) as writer:
+            await writer.write(tmp_path / "output.html")
+
+    asyncio.run(write())
+    assert (tmp_path / "output.html").read_text() == notebook.html
+
+
+def test_checkpoint_resumes_only_an_unchanged_notebook(tmp_path, notebook_with_variables_path):
+    notebook = Notebook.from_path(notebook_with_variables_path)
+    notebook.client = DummyClient(notebook.jupyter_notebook)
+    notebook.execute(checkpoint=Checkpoint.from_path(tmp_path, save_state=False))
+
+    resumed = Notebook.from_path(notebook_with_variables_path)
+    assert Checkpoint.from_path(tmp_path, resume=True).load(resumed.cells) == len(resumed.cells)
+    assert resumed.cells[0]["outputs"][0]["text"] == "Dummy text\n"
+
+    resumed.set_parameters(my_variable=2)
+    assert Checkpoint.from_path(tmp_path, resume=True).load(resumed.cells) == 0
+
+
+@pytest.mark.slow
+def test_checkpoint_restores_the_kernel_and_replays_what_it_could_not_save(tmp_path, caplog):
+    sources = [
+        "base = 10\nresults = [1]",
+        "numbers = (i for i in range(base))",
+        "results.append(2)",
+        "raise ValueError('preempted')",
+    ]
+    jupyter_notebook = nbformat.v4.new_notebook(
+        cells=[nbformat.v4.new_code_cell(source) for source in sources]
+    )
+    with pytest.raises(nbclient.exceptions.CellExecutionError):
+        Notebook(copy.deepcopy(jupyter_notebook)).execute(
+            checkpoint=Checkpoint.from_path(tmp_path / "checkpoint")
+        )
+
+    jupyter_notebook.cells[-1]["source"] = "base + sum(numbers) + sum(results)"
+    notebook = Notebook(jupyter_notebook)
+    with caplog.at_level(logging.INFO):
+        notebook.execute(checkpoint=Checkpoint.from_path(tmp_path / "checkpoint", resume=True))
+    assert "Replaying 1 cells to define numbers" in caplog.text
+    assert notebook.cells[-1]["outputs"][0]["data"]["text/plain"] == "58"
+    assert notebook.cells[2]["execution_count"] == 3
+
+
+class StoreFailingOnThirdManifest(LocalCacheStore):
+    def put(self, name, data):
+        if name == "checkpoint.json" and json.loads(data)["completed"] == 3:
+            raise OSError("preempted")
+        super().put(name, data)
+
+
+@pytest.mark.slow
+def test_checkpoint_interrupted_while_saving_resumes_from_the_previous_cell(tmp_path):
+    sources = ["x = 0", "x += 1", "x += 1", "print(x)"]
+    jupyter_notebook = nbformat.v4.new_notebook(
+        cells=[nbformat.v4.new_code_cell(source) for source in sources]
+    )
+    with pytest.raises(OSError):
+        Notebook(copy.deepcopy(jupyter_notebook)).execute(
+            checkpoint=Checkpoint(StoreFailingOnThirdManifest(tmp_path))
+        )
+
+    notebook = Notebook(jupyter_notebook)
+    notebook.execute(checkpoint=Checkpoint.from_path(tmp_path, resume=True))
+    assert notebook.cells[-1]["outputs"][0]["text"] == "2\n"
+    assert sorted(path.name for path in tmp_path.glob("state-*")) == ["state-3.pickle"]
+
+
+class DummyClientWithStreams(DummyClient):
+    async def async_execute_cell(self, cell, index, **kwargs):
+        cell["outputs"] = []
+        self.clear_before_next_output = False
+        for name, text in [("stdout", "a" * 30), ("stdout", "b" * 30), ("stderr", "oops\n")]:
+            message = {
+                "msg_type": "stream",
+                "header": {"msg_type": "stream"},
+                "content": {"name": name, "text": text},
+                "parent_header": {"msg_id": "dummy"},
+            }
+            self.output(cell["outputs"], message, None, index)
+
+
+def test_stream_buffer_keeps_head_and_tail():
+    buffer = StreamBuffer(10)
+    for chunk in ["0123", "4567", "89ab", "cdef"]:
+        buffer.append(chunk)
+    assert buffer.text == "01234" + TRUNCATION_MARKER.format(6) + "bcdef"
+
+
+def test_streamed_outputs_are_logged_and_truncated(caplog, one_cell_notebook_path):
+    notebook = Notebook.from_path(one_cell_notebook_path)
+    notebook.client = DummyClientWithStreams(notebook.jupyter_notebook)
+    notebook.streamer = OutputStreamer(max_output_size=20)
+    with caplog.at_level(logging.INFO):
+        notebook.execute()
+    stdout, stderr = notebook.cells[0]["outputs"]
+    assert stdout["text"] == "a" * 10 + TRUNCATION_MARKER.format(40) + "b" * 10
+    assert stderr["text"] == "oops\n"
+    assert "Cell 1: " + "b" * 30 in caplog.text
+    assert "Output:" not in caplog.text
+
+
+@pytest.fixture(params=["sqlite", "directory"])
+def job_queue(request, tmp_path):
+    path = tmp_path / "jobs.db" if request.param == "sqlite" else tmp_path / "jobs"
+    return JobQueue(job_store(path))
+
+
+def test_job_queue_hands_each_job_to_one_worker(job_queue):
+    job = Job("notebook.ipynb", "output.html", {"a": 1})
+    job_queue.submit(job)
+    claimed = job_queue.claim("worker-1", lease_timeout=60)
+    assert (claimed.id, claimed.status, claimed.attempts) == (job.id, "running", 1)
+    assert job_queue.claim("worker-2", lease_timeout=60) is None
+    assert job_queue.heartbeat(claimed, lease_timeout=60)
+    assert job_queue.finish(claimed)
+    assert job_queue.get(job.id).status == "ok"
+    # workers looking for jobs no longer read it
+    assert job_queue.store.names() == []
+    assert [job.id for job in job_queue.jobs()] == [job.id]
+
+
+def test_job_queue_moves_finished_jobs_left_by_a_stopped_worker(job_queue):
+    finished = Job("notebook.ipynb", "output.html", status="ok")
+    job_queue.store.create(f"{finished.id}.json", JobQueue._encode(finished))
+    queued = Job("notebook.ipynb", "output.html")
+    job_queue.submit(queued)
+    assert job_queue.claim("worker-1", lease_timeout=60).id == queued.id
+    assert job_queue.store.names() == [f"{queued.id}.json"]
+    assert job_queue.finished.names() == [f"{finished.id}.json"]
+    assert job_queue.get(finished.id).status == "ok"
+
+
+def test_job_queue_retries_failed_jobs_and_expired_leases(job_queue):
+    job_queue.submit(Job("notebook.ipynb", "output.html", max_attempts=3))
+    claimed = job_queue.claim("worker-1", lease_timeout=60)
+    job_queue.finish(claimed, "ValueError: boom")
+    assert job_queue.get(claimed.id).status == "queued"
+
+    dead = job_queue.claim("worker-1", lease_timeout=0)
+    # the lease expired, so another worker takes the job and the first one loses it
+    other_queue = JobQueue(job_queue.store)
+    retried = other_queue.claim("worker-2", lease_timeout=0)
+    assert (retried.worker, retried.attempts) == ("worker-2", 3)
+    assert not job_queue.heartbeat(dead, lease_timeout=60)
+
+    assert other_queue.claim("worker-3", lease_timeout=60) is None
+    failed = job_queue.get(dead.id)
+    assert failed.status == "failed"
+    assert failed.error == "The lease of worker-2 expired"
+    assert job_queue.store.names() == []
+
+
+def test_s3_job_store(mock_bucket):
+    # moto accepts the conditional writes but does not enforce them, see the test below
+    store = job_store("s3://notebooks/jobs")
+    version = store.create("job.json", b"{}")
+    assert store.read("job.json") == (b"{}", version)
+    assert store.replace("job.json", b"[]", version) is not None
+    assert store.finished().create("done.json", b"{}") is not None
+    assert store.names() == ["job.json"]
+    assert store.finished().names() == ["done.json"]
+    store.delete("job.json")
+    assert store.read("job.json") is None
+
+
+def test_s3_job_store_writes_conditionally():
+    s3_client = boto3.client("s3", region_name="us-east-1")
+    store = S3JobStore("s3://notebooks/jobs", s3_client)
+    put = {"Bucket": "notebooks", "Key": "jobs/job.json", "Body": b"{}"}
+    # the stubber checks the requests against the botocore model, which must know the conditions
+    with Stubber(s3_client) as stubber:
+        stubber.add_response("put_object", {"ETag": '"1"'}, {**put, "IfNoneMatch": "*"})
+        stubber.add_client_error(
+            "put_object",
+            "PreconditionFailed",
+            http_status_code=412,
+            expected_params={**put, "IfNoneMatch": "*"},
+        )
+        stubber.add_client_error(
+            "put_object",
+            "PreconditionFailed",
+            http_status_code=412,
+            expected_params={**put, "IfMatch": '"1"'},
+        )
+        assert store.create("job.json", b"{}") == '"1"'
+        assert store.create("job.json", b"{}") is None
+        assert store.replace("job.json", b"{}", '"1"') is None
+        stubber.assert_no_pending_responses()
+
+
+@pytest.mark.slow
+def test_worker_executes_queued_jobs(tmp_path, notebook_with_variables_path):
+    queue = JobQueue(job_store(tmp_path / "jobs.db"))
+    job = Job(str(notebook_with_variables_path), str(tmp_path / "output.html"), {"my_variable": 7})
+    queue.submit(job)
+    worker = Worker(queue, name="test-worker", lease_timeout=3)
+    assert asyncio.run(worker.run(exit_when_empty=True)) == 1
+    finished = queue.get(job.id)
+    assert (finished.status, finished.worker, finished.attempts) == ("ok", "test-worker", 1)
+    assert finished.elapsed > 0
+    assert "My variable is 7" in (tmp_path / "output.html").read_text()
+
+
+def test_source_cache_downloads_only_changed_notebooks(mock_bucket, tmp_path):
+    s3_path = "s3://notebooks/one_cell_notebook.ipynb"
+    cache = sources.SourceCache(tmp_path)
+    first = Notebook.from_s3(s3_path, source_cache=cache)
+    first.cells[0]["source"] = "print('changed')"
+    second = Notebook.from_s3(s3_path, source_cache=cache)
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert second.cells[0]["source"] != first.cells[0]["source"]
+
+    # a new process finds the notebook on disk
+    other_process = sources.SourceCache(tmp_path)
+    assert Notebook.from_s3(s3_path, source_cache=other_process).cells == second.cells
+    assert (other_process.hits, other_process.misses) == (1, 0)
+
+    s3.shared().write(s3_path, nbformat.writes(first.jupyter_notebook))
+    changed = Notebook.from_s3(s3_path, source_cache=other_process)
+    assert changed.cells[0]["source"] == first.cells[0]["source"]
+    assert (other_process.hits, other_process.misses) == (1, 1)
+
+
+class SlowDummyClient(DummyClient):
+    async def async_execute_cell(self, cell, index, **kwargs):
+        await asyncio.sleep(0.5)
+        await super().async_execute_cell(cell, index, **kwargs)
+
+
+def request(port, method, path, payload=None):
+    data = json.dumps(payload).encode() if payload is not None else None
+    http_request = urllib.request.Request(f"http://127.0.0.1:{port}{path}", data, method=method)
+    try:
+        with urllib.request.urlopen(http_request) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+def test_execution_service_limits_the_queue(tmp_path, one_cell_notebook_path):
+    async def scenario():
+        service = ExecutionService(
+            tmp_path, max_concurrency=1, max_queue=1, client_factory=SlowDummyClient
+        )
+        server = await asyncio.start_server(service.handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        payload = {"notebook": str(one_cell_notebook_path)}
+        statuses = []
+        for _ in range(3):
+            status, _ = await asyncio.to_thread(request, port, "POST", "/jobs", payload)
+            statuses.append(status)
+            await asyncio.sleep(0.05)
+        jobs = json.loads((await asyncio.to_thread(request, port, "GET", "/jobs"))[1])
+        first, queued = jobs[0]["id"], jobs[1]["id"]
+        status, _ = await asyncio.to_thread(request, port, "GET", f"/jobs/{first}/html")
+        assert status == 409
+        await asyncio.to_thread(request, port, "DELETE", f"/jobs/{queued}")
+        while service.count("running"):
+            await asyncio.sleep(0.05)
+        status, html = await asyncio.to_thread(request, port, "GET", f"/jobs/{first}/html")
+        server.close()
+        await service.close()
+        return statuses, service.jobs[first], service.jobs[queued], status, html
+
+    statuses, first, queued, status, html = asyncio.run(scenario())
+    assert statuses == [202, 202, 429]
+    assert (first.status, queued.status) == ("ok", "cancelled")
+    assert status == 200 and b"Dummy text" in html
+
+
+def test_execution_service_stops_jobs_after_their_timeout(tmp_path, one_cell_notebook_path):
+    async def scenario():
+        service = ExecutionService(tmp_path, client_factory=SlowDummyClient)
+        job = service.submit(str(one_cell_notebook_path), {}, timeout=0.1)
+        while job.status not in ("ok", "timeout") or job.html_path is None:
+            await asyncio.sleep(0.05)
+        return job
+
+    job = asyncio.run(scenario())
+    assert job.status == "timeout"
+    assert pathlib.Path(job.html_path).exists()
+
+
+def test_compressed_outputs_are_read_back_transparently(tmp_path, one_cell_notebook_path):
+    notebook = Notebook.from_path(one_cell_notebook_path)
+    notebook.client = DummyClient(notebook.jupyter_notebook)
+    notebook.execute()
+    notebook.compression = "gzip"
+    notebook.write_html(str(tmp_path / "output.html"))
+    notebook.save_notebook(str(tmp_path / "output.ipynb"))
+    # an extension asks for compression even without the option
+    notebook.compression = None
+    notebook.save_notebook(str(tmp_path / "copy.ipynb.gz"))
+
+    assert not (tmp_path / "output.html").exists()
+    assert "Dummy text" in gzip.decompress((tmp_path / "output.html.gz").read_bytes()).decode()
+    for name in ("output.ipynb.gz", "copy.ipynb.gz"):
+        assert (tmp_path / name).read_bytes()[:2] == b"\x1f\x8b"
+        assert Notebook.from_path(tmp_path / name).cells == notebook.cells
+
+
+def test_compressed_outputs_on_s3_keep_their_name(mock_bucket, one_cell_notebook_path):
+    notebook = Notebook.from_path(one_cell_notebook_path)
+    notebook.compression = "gzip"
+    asyncio.run(notebook.async_write_html("s3://notebooks/compressed/output.html"))
+    notebook.save_notebook("s3://notebooks/compressed/output.ipynb")
+
+    response = boto3.client("s3").get_object(Bucket="notebooks", Key="compressed/output.html")
+    # moto keeps the aws-chunked encoding of the upload, which S3 itself strips
+    assert response["ContentEncoding"].split(",")[0] == "gzip"
+    assert response["ContentType"] == "text/html; charset=utf-8"
+    assert "print" in gzip.decompress(response["Body"].read()).decode()
+    loaded = Notebook.from_s3("s3://notebooks/compressed/output.ipynb")
+    assert loaded.cells == notebook.cells
+
+
+def selective_notebook():
+    cells = [
+        nbformat.v4.new_code_cell("a = 1\nb = 2"),
+        nbformat.v4.new_code_cell("import math\nx = math.sqrt(a)"),
+        nbformat.v4.new_code_cell("y = b * 10"),
+        nbformat.v4.new_code_cell("print(x)", metadata={"tags": ["summary"]}),
+        nbformat.v4.new_code_cell("print(x, y)", metadata={"tags": ["table"]}),
+    ]
+    return Notebook(nbformat.v4.new_notebook(cells=cells))
+
+
+def test_selection_takes_the_upstream_slice_of_the_targets():
+    notebook = selective_notebook()
+    cells, index = notebook.cells, notebook.assignment_index
+    assert Selection(frozenset({"summary"})).cells(cells, index) == {0, 1, 3}
+    assert Selection(parameters=frozenset({"b"})).cells(cells, index) == {0, 1, 2, 4}
+    assert Selection(frozenset({"summary"}), frozenset({"b"})).cells(cells, index) == set()
+    assert Selection(parameters=frozenset()).cells(cells, index) == set()
+
+
+def test_selection_takes_the_cells_changing_aliases_of_the_names_targets_read():
+    sources = ["a = []", "b = a", "b.append(1)", "c = 2", "print(a)"]
+    cells = [nbformat.v4.new_code_cell(source) for source in sources]
+    cells[-1]["metadata"]["tags"] = ["summary"]
+    assert Selection(frozenset({"summary"})).cells(cells, None) == {0, 1, 2, 4}
+
+
+def test_selective_execution_keeps_the_outputs_of_skipped_cells():
+    notebook = selective_notebook()
+    notebook.client = DummyClient(notebook.jupyter_notebook)
+    notebook.execute()
+    for cell in notebook.cells:
+        cell["outputs"][0]["text"] = "Earlier run\n"
+
+    changed = notebook.changed_parameters(a=1, b=3)
+    notebook.set_parameters(a=1, b=3)
+    notebook.execute(selection=Selection(parameters=frozenset(changed)))
+
+    assert changed == {"b"}
+    texts = [cell["outputs"][0]["text"] for cell in notebook.cells]
+    assert texts == [
+        "Dummy text\n",
+        "Dummy text\n",
+        "Dummy text\n",
+        "Earlier run\n",
+        "Dummy text\n",
+    ]
+    assert [
+        cell["metadata"].get("firenze", {}).get("skipped", False) for cell in notebook.cells
+    ] == [
+        False,
+        False,
+        False,
+        True,
+        False,
+    ]
+    assert notebook.html.count('class="firenze-skipped"') == 1
+
+
+def test_exports_are_the_names_defined_in_tagged_cells():
+    cells = [
+        nbformat.v4.new_code_cell("region = 'north'"),
+        nbformat.v4.new_code_cell(
+            "import json\ntotal = len(region)", metadata={"tags": ["export"]}
+        ),
+        nbformat.v4.new_code_cell("other = 1"),
+    ]
+    assert Exports.names(cells) == ["total"]
+
+
+@pytest.mark.slow
+def test_batch_runs_export_values_to_a_reduce_notebook(tmp_path):
+    mapped = Notebook(
+        nbformat.v4.new_notebook(
+            cells=[
+                nbformat.v4.new_code_cell("region = 'north'"),
+                nbformat.v4.new_code_cell(
+                    "total = len(region)\nlabels = {region: object}", metadata={"tags": ["export"]}
+                ),
+            ]
+        )
+    )
+    reducer = Notebook(
+        nbformat.v4.new_notebook(
+            cells=[
+                nbformat.v4.new_code_cell("partitions = []"),
+                nbformat.v4.new_code_cell(
+                    "from firenze.exports import load\n"
+                    "sum(load(p['exports']['total']) for p in partitions if p['status'] == 'ok')"
+                ),
+            ]
+        )
+    )
+    runs = mapped.execute_batch(
+        [{"region": "north"}, {"region": "west"}, {"region": 1}],
+        str(tmp_path / "output_{index}.html"),
+        exports_path=str(tmp_path / "exports"),
+    )
+    assert [run.status for run in runs] == ["ok", "ok", "failed"]
+    assert runs[0].exports == {
+        "labels": str(tmp_path / "exports/0/labels.pickle"),
+        "total": str(tmp_path / "exports/0/total.json"),
+    }
+    assert runs[2].exports == {}
+
+    asyncio.run(batch.run_reduce(reducer, runs, str(tmp_path / "reduce.html")))
+    assert reducer.cells[1]["outputs"][0]["data"]["text/plain"] == "9"
+    index = batch.index_html(runs, str(tmp_path / "index.html"))
+    assert '<a href="output_0.html">report</a>' in index
+    assert "<b>total</b>: 4" in index
+    assert '<a href="exports/1/labels.pickle">labels.pickle</a>' in index
+
+
+def test_notebook_saves_are_incremental_atomic_and_skip_unchanged_content(
+    tmp_path, notebook_with_variables_path
+):
+    notebook = Notebook.from_path(notebook_with_variables_path)
+    notebook.client = DummyClient(notebook.jupyter_notebook)
+    notebook.cells.append(nbformat.v4.new_markdown_cell("# Ünicode"))
+    path = tmp_path / "output.ipynb"
+    notebook.save_notebook(path)
+    assert path.read_text() == nbformat.writes(notebook.jupyter_notebook)
+
+    notebook.execute()
+    notebook.save_notebook(path)
+    assert path.read_text() == nbformat.writes(notebook.jupyter_notebook)
+    modified = path.stat().st_mtime_ns
+    time.sleep(0.01)
+    notebook.save_notebook(path)
+    assert path.stat().st_mtime_ns == modified
+    assert [file.name for file in tmp_path.iterdir()] == ["output.ipynb"]
+
+
+def test_notebook_saves_write_through_symlinks(tmp_path, notebook_with_variables_path):
+    target = tmp_path / "target.ipynb"
+    target.write_text("{}")
+    link = tmp_path / "link.ipynb"
+    link.symlink_to(target)
+    notebook = Notebook.from_path(notebook_with_variables_path)
+    notebook.save_notebook(link)
+    assert link.is_symlink()
+    assert target.read_text() == nbformat.writes(notebook.jupyter_notebook)
+
+
+def test_cell_log_keeps_the_cells_of_a_resumed_run(tmp_path, notebook_with_variables_path):
+    log = CellLog(tmp_path / "cells.jsonl")
+    for resume in [False, True]:
+        notebook = Notebook.from_path(notebook_with_variables_path)
+        notebook.client = DummyClient(notebook.jupyter_notebook)
+        notebook.cell_log = log
+        checkpoint = Checkpoint.from_path(tmp_path / "checkpoint", resume=resume, save_state=False)
+        notebook.execute(checkpoint=checkpoint)
+    rebuilt = Notebook.from_path(notebook_with_variables_path)
+    assert log.rebuild(rebuilt.jupyter_notebook) == len(rebuilt.code_cells)
+
+
+def test_cell_log_rebuilds_the_last_run(tmp_path, notebook_with_variables_path):
+    log = CellLog(tmp_path / "cells.jsonl")
+    notebook = Notebook.from_path(notebook_with_variables_path)
+    notebook.client = DummyClient(notebook.jupyter_notebook)
+    notebook.cell_log = log
+    notebook.execute()
+    with open(log.path, "a") as f:
+        f.write('{"event": "cell", "index": 0, "outp')
+
+    rebuilt = Notebook.from_path(notebook_with_variables_path)
+    assert log.rebuild(rebuilt.jupyter_notebook) == 1
+    assert rebuilt.cells[0]["outputs"] == notebook.cells[0]["outputs"]
+
+    log.start()
+    assert log.rebuild(Notebook.from_path(notebook_with_variables_path).jupyter_notebook) == 0
+    changed = Notebook.from_path(notebook_with_variables_path)
+    changed.set_parameters(my_variable=5)
+    notebook.cell_log.append(0, notebook.cells[0])
+    assert log.rebuild(changed.jupyter_notebook) == 0
+
+
+class InterruptibleKernelManager:
+    def __init__(self, pid=None):
+        self.pid = pid
+        self.interrupted = asyncio.Event()
+
+    async def interrupt_kernel(self):
+        self.interrupted.set()
+
+
+class HangingDummyClient(DummyClient):
+    async def async_execute_cell(self, cell, index, **kwargs):
+        if "hang" not in cell["source"]:
+            return await super().async_execute_cell(cell, index, **kwargs)
+        if self.km.pid is not None:
+            self.affinity = os.sched_getaffinity(self.km.pid)
+        # like a kernel, only an interrupt stops the cell
+        await self.km.interrupted.wait()
+        cell["outputs"] = [nbformat.v4.new_output("error", ename="KeyboardInterrupt", evalue="")]
+        raise nbclient.exceptions.CellExecutionError("", "KeyboardInterrupt", "")
+
+
+def test_cell_timeout_interrupts_the_kernel_and_is_shown_in_the_html():
+    jupyter_notebook = nbformat.v4.new_notebook()
+    jupyter_notebook.cells = [
+        nbformat.v4.new_code_cell("a = 1"),
+        nbformat.v4.new_code_cell("hang()"),
+        nbformat.v4.new_code_cell("b = 2"),
+    ]
+    client = HangingDummyClient(jupyter_notebook)
+    client.km = InterruptibleKernelManager()
+    notebook = Notebook(jupyter_notebook, client)
+    notebook.limits = ResourceLimits(cell_timeout=0.1, check_interval=0.05)
+    with pytest.raises(ResourceLimitError, match="Cell 2: stopped after the cell timeout of 0.1"):
+        notebook.execute()
+    assert client.km.interrupted.is_set()
+    assert notebook.cells[1]["metadata"]["firenze"]["breach"]["limit"] == "cell_timeout"
+    assert notebook.cells[1]["outputs"][-1]["ename"] == "ResourceLimitError"
+    assert notebook.cells[2]["outputs"] == []
+    assert "Resource limits exceeded" in notebook.html
+    notebook.clean()
+    assert "Resource limits exceeded" not in notebook.html
+
+
+def test_memory_limit_kills_the_kernel_and_cpus_are_pinned(monkeypatch):
+    monkeypatch.setattr(limits, "INTERRUPT_GRACE", 0.1)
+    # a process holding 100 MB stands in for the kernel
+    process = subprocess.Popen(
+        [sys.executable, "-c", "import time; x = bytearray(100 * 2**20); time.sleep(60)"]
+    )
+    time.sleep(0.5)
+    jupyter_notebook = nbformat.v4.new_notebook()
+    jupyter_notebook.cells = [nbformat.v4.new_code_cell("hang()")]
+    client = HangingDummyClient(jupyter_notebook)
+    client.km = InterruptibleKernelManager(process.pid)
+    notebook = Notebook(jupyter_notebook, client)
+    cpus = frozenset(list(os.sched_getaffinity(0))[:1])
+    notebook.limits = ResourceLimits(max_memory=50 * 2**20, cpus=cpus, check_interval=0.05)
+    try:
+        with pytest.raises(ResourceLimitError, match="Cell 1: kernel killed using"):
+            notebook.execute()
+        assert process.wait(timeout=5) == -9
+    finally:
+        process.kill()
+    assert client.affinity == cpus
+    assert not client.km.interrupted.is_set()
+    assert (
+        "over the limit of 50 MiB" in notebook.cells[0]["metadata"]["firenze"]["breach"]["message"]
+    )
+
+
+def test_cpus_are_not_pinned_where_the_platform_cannot(monkeypatch, caplog):
+    monkeypatch.delattr(os, "sched_setaffinity")
+    guard = limits.ResourceGuard(ResourceLimits(cpus=frozenset({0})))
+    guard._pin(os.getpid())
+    assert "only supported on linux" in caplog.text